@@ -0,0 +1,133 @@
+/*
+ * Copyright (c) 2025 INCHRON AG <info@inchron.com>
+ *
+ * This program and the accompanying materials are made available under the
+ * terms of the Eclipse Public License 2.0 which is available at
+ * https://www.eclipse.org/legal/epl-2.0/
+ *
+ * SPDX-License-Identifier: EPL-2.0
+ */
+#pragma once
+
+#include <cinttypes>
+#include <cmath>
+#include <cstdint>
+#include <cstdio>
+#include <string>
+#include <string_view>
+
+
+namespace ros2observer {
+
+/*
+ * Minimal buffered writer for compact JSON, one object per line (NDJSON).
+ * The output is flushed to the underlying FILE in large blocks. The owner
+ * calls flush() for the rest before closing the FILE, the destructor does
+ * not write to it.
+ */
+class JsonWriter {
+public:
+	static constexpr std::size_t flushSize = 1 << 20;
+
+	explicit JsonWriter( std::FILE* file ) : _file( file ) { _buffer.reserve( 2 * flushSize ); }
+
+	JsonWriter( const JsonWriter& ) = delete;
+	JsonWriter& operator=( const JsonWriter& ) = delete;
+
+	void beginObject() {
+		_buffer.push_back( '{' );
+		_first = true;
+	}
+
+	void endObject() {
+		_buffer.append( "}\n" );
+		if ( _buffer.size() >= flushSize ) {
+			flush();
+		}
+	}
+
+	/* Ends an object that is the value of a member, not a whole line */
+	void endNestedObject() {
+		_buffer.push_back( '}' );
+		_first = false;
+	}
+
+	void key( std::string_view name ) {
+		if ( !_first ) {
+			_buffer.push_back( ',' );
+		}
+		_first = false;
+		string( name );
+		_buffer.push_back( ':' );
+	}
+
+	void beginArray() { _buffer.push_back( '[' ); }
+	void endArray() { _buffer.push_back( ']' ); }
+	void separator() { _buffer.push_back( ',' ); }
+
+	void null() { _buffer.append( "null" ); }
+	void boolean( bool value ) { _buffer.append( value ? "true" : "false" ); }
+
+	void number( int64_t value ) { format( "%" PRId64, value ); }
+	void number( uint64_t value ) { format( "%" PRIu64, value ); }
+
+	void number( double value ) {
+		/* JSON has no representation of NaN and infinity */
+		if ( !std::isfinite( value ) ) {
+			null();
+			return;
+		}
+		format( "%.17g", value );
+	}
+
+	void hex( uint64_t value ) { format( "\"0x%" PRIX64 "\"", value ); }
+
+	/* Decimal seconds with nanosecond fraction, e.g. "1714561909.443960423" */
+	void seconds( int64_t nanoseconds, const char* sign = "" ) {
+		const auto negative = nanoseconds < 0;
+		const auto ns = static_cast<uint64_t>( negative ? -nanoseconds : nanoseconds );
+		format( "\"%s%s%" PRIu64 ".%09" PRIu64 "\"", negative ? "-" : "", sign,
+				ns / 1000000000ULL, ns % 1000000000ULL );
+	}
+
+	void string( std::string_view value ) {
+		_buffer.push_back( '"' );
+		for ( const char c : value ) {
+			switch ( c ) {
+			case '"': _buffer.append( "\\\"" ); break;
+			case '\\': _buffer.append( "\\\\" ); break;
+			case '\n': _buffer.append( "\\n" ); break;
+			case '\r': _buffer.append( "\\r" ); break;
+			case '\t': _buffer.append( "\\t" ); break;
+			default:
+				if ( static_cast<unsigned char>( c ) < 0x20 ) {
+					format( "\\u%04x", static_cast<unsigned>( c ) );
+				} else {
+					_buffer.push_back( c );
+				}
+			}
+		}
+		_buffer.push_back( '"' );
+	}
+
+	bool flush() {
+		const auto written = std::fwrite( _buffer.data(), 1, _buffer.size(), _file );
+		const auto ok = written == _buffer.size();
+		_buffer.clear();
+		return ok && std::fflush( _file ) == 0;
+	}
+
+private:
+	template<typename... Args>
+	void format( const char* fmt, Args... args ) {
+		char text[64];
+		const auto length = std::snprintf( text, sizeof( text ), fmt, args... );
+		_buffer.append( text, static_cast<std::size_t>( length ) );
+	}
+
+	std::FILE* _file;
+	std::string _buffer;
+	bool _first{ true };
+};
+
+}  // namespace ros2observer
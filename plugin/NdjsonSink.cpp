@@ -0,0 +1,364 @@
+/*
+ * Copyright (c) 2025 INCHRON AG <info@inchron.com>
+ *
+ * This program and the accompanying materials are made available under the
+ * terms of the Eclipse Public License 2.0 which is available at
+ * https://www.eclipse.org/legal/epl-2.0/
+ *
+ * SPDX-License-Identifier: EPL-2.0
+ */
+
+#include "NdjsonSink.h"
+
+#include <cerrno>
+#include <cstdio>
+#include <cstring>
+#include <memory>
+#include <optional>
+#include <string>
+#include <unordered_map>
+
+#include <common/bt2/ClockSnapshot.h>
+#include <common/bt2/Event.h>
+#include <common/bt2/EventClass.h>
+#include <common/bt2/EventMessage.h>
+#include <common/bt2/Message.h>
+#include <common/bt2/MessageIterator.h>
+#include <common/bt2/Packet.h>
+#include <common/bt2/Sink.h>
+#include <common/bt2/Stream.h>
+#include <common/bt2/Trace.h>
+#include <common/bt2/Value.h>
+
+#include "JsonWriter.h"
+
+
+namespace ros2observer::ndjson {
+
+namespace {
+
+/* Sink component's private data */
+struct Data {
+	explicit Data( std::FILE* f, bool close ) : file( f ), closeFile( close ), writer( f ) {}
+
+	/* The writer does not flush on destruction, it is destroyed after the file is closed */
+	~Data() {
+		writer.flush();
+		if ( closeFile ) {
+			std::fclose( file );
+		}
+	}
+
+	/* Upstream message iterator (owned by this) */
+	bt2::MessageIterator* messageIterator{ nullptr };
+
+	std::FILE* file;
+	bool closeFile;
+	JsonWriter writer;
+
+	/* Timestamp of the previous event, for the `delta` of the next one */
+	std::optional<int64_t> previousTimestamp;
+
+	/* The `hostname` environment entry of each trace */
+	std::unordered_map<const bt_trace*, std::string> hostnames;
+
+	/* Reused buffer for flattened "parent.child" member names */
+	std::string key;
+};
+
+void appendErrorCause( bt_self_component_sink* self_component_sink, const char* message ) {
+	BT_CURRENT_THREAD_ERROR_APPEND_CAUSE_FROM_COMPONENT(
+		bt_self_component_sink_as_self_component( self_component_sink ), "%s", message );
+}
+
+/*
+ * Writes a field that is not flattened into the record: scalars, arrays,
+ * options, variants and structures nested inside of arrays.
+ */
+void writeValue( JsonWriter& writer, const bt_field* field ) {
+	const auto type = bt_field_get_class_type( field );
+
+	if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_INTEGER ) ) {
+		const auto* fieldClass = bt_field_borrow_class_const( field );
+		const auto hex = bt_field_class_integer_get_preferred_display_base( fieldClass ) ==
+						 BT_FIELD_CLASS_INTEGER_PREFERRED_DISPLAY_BASE_HEXADECIMAL;
+		if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_UNSIGNED_INTEGER ) ) {
+			const uint64_t value = bt_field_integer_unsigned_get_value( field );
+			hex ? writer.hex( value ) : writer.number( value );
+		} else {
+			const int64_t value = bt_field_integer_signed_get_value( field );
+			hex && value >= 0 ? writer.hex( static_cast<uint64_t>( value ) )
+							  : writer.number( value );
+		}
+	} else if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_STRING ) ) {
+		writer.string( { bt_field_string_get_value( field ),
+						 static_cast<std::size_t>( bt_field_string_get_length( field ) ) } );
+	} else if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_BOOL ) ) {
+		writer.boolean( bt_field_bool_get_value( field ) );
+	} else if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_BIT_ARRAY ) ) {
+		writer.number( static_cast<uint64_t>( bt_field_bit_array_get_value_as_integer( field ) ) );
+	} else if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_SINGLE_PRECISION_REAL ) ) {
+		writer.number( static_cast<double>( bt_field_real_single_precision_get_value( field ) ) );
+	} else if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_DOUBLE_PRECISION_REAL ) ) {
+		writer.number( bt_field_real_double_precision_get_value( field ) );
+	} else if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_ARRAY ) ) {
+		const auto length = bt_field_array_get_length( field );
+		writer.beginArray();
+		for ( uint64_t i = 0; i < length; ++i ) {
+			if ( i > 0 ) {
+				writer.separator();
+			}
+			writeValue( writer, bt_field_array_borrow_element_field_by_index_const( field, i ) );
+		}
+		writer.endArray();
+	} else if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_OPTION ) ) {
+		const auto* option = bt_field_option_borrow_field_const( field );
+		option ? writeValue( writer, option ) : writer.null();
+	} else if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_VARIANT ) ) {
+		writeValue( writer, bt_field_variant_borrow_selected_option_field_const( field ) );
+	} else if ( type == BT_FIELD_CLASS_TYPE_STRUCTURE ) {
+		const auto* fieldClass = bt_field_borrow_class_const( field );
+		const auto count = bt_field_class_structure_get_member_count( fieldClass );
+		writer.beginObject();
+		for ( uint64_t i = 0; i < count; ++i ) {
+			const auto* member =
+				bt_field_class_structure_borrow_member_by_index_const( fieldClass, i );
+			writer.key( bt_field_class_structure_member_get_name( member ) );
+			writeValue( writer, bt_field_structure_borrow_member_field_by_index_const( field, i ) );
+		}
+		writer.endNestedObject();
+	} else {
+		writer.null();
+	}
+}
+
+/*
+ * Keys of the record header. Top-level members with these names, e.g. the
+ * `timestamp` of `ros2:rmw_publish`, are written as "payload_<name>" like the
+ * Python converters do, so they don't replace the header.
+ */
+bool isHeaderKey( const char* name ) {
+	for ( const char* key : { "timestamp", "delta", "hostname", "event" } ) {
+		if ( std::strcmp( name, key ) == 0 ) {
+			return true;
+		}
+	}
+	return false;
+}
+
+/*
+ * Writes the members of a structure field as members of the record, nested
+ * structures are flattened to "parent.child" keys.
+ */
+void writeMembers( Data* data, const bt2::Field* structure ) {
+	if ( structure == nullptr ) {
+		return;
+	}
+
+	const auto* field = reinterpret_cast<const bt_field*>( structure );
+	const auto* fieldClass = bt_field_borrow_class_const( field );
+	const auto count = bt_field_class_structure_get_member_count( fieldClass );
+	const auto prefixLength = data->key.size();
+
+	for ( uint64_t i = 0; i < count; ++i ) {
+		const auto* member = bt_field_class_structure_borrow_member_by_index_const( fieldClass, i );
+		const char* name = bt_field_class_structure_member_get_name( member );
+		if ( prefixLength > 0 ) {
+			data->key.push_back( '.' );
+		} else if ( isHeaderKey( name ) ) {
+			data->key.append( "payload_" );
+		}
+		data->key.append( name );
+
+		const auto* memberField = structure->getFieldByIndex( i );
+		if ( bt_field_get_class_type( reinterpret_cast<const bt_field*>( memberField ) ) ==
+			 BT_FIELD_CLASS_TYPE_STRUCTURE ) {
+			writeMembers( data, memberField );
+		} else {
+			data->writer.key( data->key );
+			writeValue( data->writer, reinterpret_cast<const bt_field*>( memberField ) );
+		}
+		data->key.resize( prefixLength );
+	}
+}
+
+const std::string& getHostname( Data* data, const bt2::Event* event ) {
+	const auto* trace = event->getStream()->getTrace();
+	const auto* t = reinterpret_cast<const bt_trace*>( trace );
+	auto it = data->hostnames.find( t );
+	if ( it == data->hostnames.end() ) {
+		std::string hostname;
+		const auto* value = trace->getEnvironmentValueByName( "hostname" );
+		if ( value != nullptr && bt_value_is_string( reinterpret_cast<const bt_value*>( value ) ) ) {
+			hostname = static_cast<const char*>( *value );
+		}
+		it = data->hostnames.emplace( t, std::move( hostname ) ).first;
+	}
+	return it->second;
+}
+
+/*
+ * Writes the record of `msg`, if it's an event message.
+ */
+void writeMessage( Data* data, const bt2::Message* msg ) {
+	if ( msg->getType() != BT_MESSAGE_TYPE_EVENT ) {
+		return;
+	}
+
+	const auto* message = reinterpret_cast<const bt2::EventMessage*>( msg );
+	const auto* event = message->getEvent();
+	auto& writer = data->writer;
+
+	/* Events of streams without a default clock have no timestamp */
+	int64_t timestamp = 0;
+	if ( bt_message_event_borrow_stream_class_default_clock_class_const(
+			 reinterpret_cast<const bt_message*>( msg ) ) != nullptr ) {
+		timestamp = message->getDefaultClockSnapshot()->getNsFromOrigin().value_or( 0 );
+	}
+
+	writer.beginObject();
+	writer.key( "timestamp" );
+	writer.number( timestamp );
+	writer.key( "delta" );
+	writer.number( data->previousTimestamp ? timestamp - *data->previousTimestamp : int64_t{ 0 } );
+	writer.key( "hostname" );
+	writer.string( getHostname( data, event ) );
+	writer.key( "event" );
+	const auto* name = event->getEventClass()->getName();
+	writer.string( name != nullptr ? name : "" );
+	writer.key( "original_timestamp" );
+	writer.seconds( timestamp );
+	writer.key( "original_delta" );
+	if ( data->previousTimestamp ) {
+		writer.seconds( timestamp - *data->previousTimestamp, "+" );
+	} else {
+		writer.string( "+?.?????????" );
+	}
+	data->previousTimestamp = timestamp;
+
+	if ( const auto* packet = event->getPacket(); packet != nullptr ) {
+		if ( const auto* context = packet->getContext(); context != nullptr ) {
+			if ( const auto* cpuId = context->getFieldByName( "cpu_id" ); cpuId != nullptr ) {
+				writer.key( "cpu_id" );
+				writeValue( writer, reinterpret_cast<const bt_field*>( cpuId ) );
+			}
+		}
+	}
+
+	data->key.clear();
+	writeMembers( data, event->getCommonContextField() );
+	writeMembers( data, event->getSpecificContext() );
+	writeMembers( data, event->getPayloadField() );
+	writer.endObject();
+}
+
+}  // namespace
+
+/*
+ * Initializes the sink component.
+ */
+bt_component_class_initialize_method_status initialize(
+	bt_self_component_sink* self_component_sink,
+	bt_self_component_sink_configuration* configuration, const bt_value* params,
+	void* initialize_method_data ) {
+	auto* sink = reinterpret_cast<bt2::Sink*>( self_component_sink );
+
+	std::FILE* file = stdout;
+	bool closeFile = false;
+	const auto* path = bt_value_map_borrow_entry_value_const( params, "path" );
+	if ( path != nullptr ) {
+		if ( !bt_value_is_string( path ) ) {
+			appendErrorCause( self_component_sink, "The `path` parameter must be a string" );
+			return BT_COMPONENT_CLASS_INITIALIZE_METHOD_STATUS_ERROR;
+		}
+		file = std::fopen( bt_value_string_get( path ), "w" );
+		if ( file == nullptr ) {
+			appendErrorCause( self_component_sink, std::strerror( errno ) );
+			return BT_COMPONENT_CLASS_INITIALIZE_METHOD_STATUS_ERROR;
+		}
+		closeFile = true;
+	}
+
+	try {
+		sink->addInputPort( "in" );
+	} catch ( const bt2::Exception& e ) {
+		if ( closeFile ) {
+			std::fclose( file );
+		}
+		appendErrorCause( self_component_sink, e.what() );
+		return BT_COMPONENT_CLASS_INITIALIZE_METHOD_STATUS_ERROR;
+	}
+
+	sink->setData( new Data{ file, closeFile } );
+	return BT_COMPONENT_CLASS_INITIALIZE_METHOD_STATUS_OK;
+}
+
+/*
+ * Finalizes the sink component, the remaining output is flushed.
+ */
+void finalize( bt_self_component_sink* self_component_sink ) {
+	auto* sink = reinterpret_cast<bt2::Sink*>( self_component_sink );
+	std::unique_ptr<Data> data{ sink->getData<Data>() };
+}
+
+/*
+ * Creates the upstream message iterator once the graph is configured.
+ */
+bt_component_class_sink_graph_is_configured_method_status graphIsConfigured(
+	bt_self_component_sink* self_component_sink ) {
+	auto* sink = reinterpret_cast<bt2::Sink*>( self_component_sink );
+	auto* data = sink->getData<Data>();
+
+	try {
+		data->messageIterator = bt2::MessageIterator::create( sink, sink->getInputPortByIndex( 0 ) );
+	} catch ( const bt2::MemoryError& e ) {
+		return BT_COMPONENT_CLASS_SINK_GRAPH_IS_CONFIGURED_METHOD_STATUS_MEMORY_ERROR;
+	} catch ( const bt2::Exception& e ) {
+		appendErrorCause( self_component_sink, e.what() );
+		return BT_COMPONENT_CLASS_SINK_GRAPH_IS_CONFIGURED_METHOD_STATUS_ERROR;
+	}
+
+	return BT_COMPONENT_CLASS_SINK_GRAPH_IS_CONFIGURED_METHOD_STATUS_OK;
+}
+
+/*
+ * Consumes a batch of messages and writes a record for each event message.
+ */
+bt_component_class_sink_consume_method_status consume(
+	bt_self_component_sink* self_component_sink ) {
+	auto* sink = reinterpret_cast<bt2::Sink*>( self_component_sink );
+	auto* data = sink->getData<Data>();
+
+	auto&& [messages, next_status] = data->messageIterator->next();
+
+	switch ( next_status ) {
+	case BT_MESSAGE_ITERATOR_NEXT_STATUS_END:
+		data->messageIterator->putRef();
+		if ( !data->writer.flush() ) {
+			appendErrorCause( self_component_sink, std::strerror( errno ) );
+			return BT_COMPONENT_CLASS_SINK_CONSUME_METHOD_STATUS_ERROR;
+		}
+		return BT_COMPONENT_CLASS_SINK_CONSUME_METHOD_STATUS_END;
+
+	case BT_MESSAGE_ITERATOR_NEXT_STATUS_AGAIN:
+		return BT_COMPONENT_CLASS_SINK_CONSUME_METHOD_STATUS_AGAIN;
+
+	case BT_MESSAGE_ITERATOR_NEXT_STATUS_MEMORY_ERROR:
+		return BT_COMPONENT_CLASS_SINK_CONSUME_METHOD_STATUS_MEMORY_ERROR;
+
+	case BT_MESSAGE_ITERATOR_NEXT_STATUS_ERROR:
+		return BT_COMPONENT_CLASS_SINK_CONSUME_METHOD_STATUS_ERROR;
+
+	default:
+		break;
+	}
+
+	for ( const auto* message : messages ) {
+		writeMessage( data, message );
+		message->putRef();
+	}
+
+	return BT_COMPONENT_CLASS_SINK_CONSUME_METHOD_STATUS_OK;
+}
+
+}  // namespace ros2observer::ndjson
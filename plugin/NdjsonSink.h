@@ -0,0 +1,38 @@
+/*
+ * Copyright (c) 2025 INCHRON AG <info@inchron.com>
+ *
+ * This program and the accompanying materials are made available under the
+ * terms of the Eclipse Public License 2.0 which is available at
+ * https://www.eclipse.org/legal/epl-2.0/
+ *
+ * SPDX-License-Identifier: EPL-2.0
+ */
+#pragma once
+
+#include <babeltrace2/babeltrace.h>
+
+
+/*
+ * The `sink.ros2observer.ndjson` component class writes every event message as
+ * one compact JSON object per line, the same records `ros2tools/ctf_reader.py`
+ * produces through the Python bindings.
+ *
+ * Parameters:
+ *   path  Output file, the standard output is used if omitted.
+ */
+namespace ros2observer::ndjson {
+
+bt_component_class_initialize_method_status initialize(
+	bt_self_component_sink* self_component_sink,
+	bt_self_component_sink_configuration* configuration, const bt_value* params,
+	void* initialize_method_data );
+
+void finalize( bt_self_component_sink* self_component_sink );
+
+bt_component_class_sink_graph_is_configured_method_status graphIsConfigured(
+	bt_self_component_sink* self_component_sink );
+
+bt_component_class_sink_consume_method_status consume(
+	bt_self_component_sink* self_component_sink );
+
+}  // namespace ros2observer::ndjson
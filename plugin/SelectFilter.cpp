@@ -0,0 +1,365 @@
+/*
+ * Copyright (c) 2025 INCHRON AG <info@inchron.com>
+ *
+ * This program and the accompanying materials are made available under the
+ * terms of the Eclipse Public License 2.0 which is available at
+ * https://www.eclipse.org/legal/epl-2.0/
+ *
+ * SPDX-License-Identifier: EPL-2.0
+ */
+
+#include "SelectFilter.h"
+
+#include <fnmatch.h>
+
+#include <cstdlib>
+#include <memory>
+#include <optional>
+#include <string>
+#include <string_view>
+#include <unordered_map>
+#include <unordered_set>
+#include <vector>
+
+#include <common/bt2/ClockSnapshot.h>
+#include <common/bt2/Event.h>
+#include <common/bt2/EventClass.h>
+#include <common/bt2/EventMessage.h>
+#include <common/bt2/Filter.h>
+#include <common/bt2/Message.h>
+#include <common/bt2/MessageIterator.h>
+
+
+namespace ros2observer::select {
+
+namespace {
+
+/* Filter component's private data: the parsed parameters */
+struct Selection {
+	std::vector<std::string> events;
+	std::unordered_set<int64_t> pids;
+	std::unordered_set<std::string> procnames;
+	std::optional<int64_t> begin;
+	std::optional<int64_t> end;
+
+	[[nodiscard]] bool selectsProcess() const { return !pids.empty() || !procnames.empty(); }
+	[[nodiscard]] bool selectsTime() const { return begin.has_value() || end.has_value(); }
+};
+
+/* Message iterator's private data */
+struct IteratorData {
+	/* Upstream message iterator (owned by this) */
+	bt2::MessageIterator* upstream{ nullptr };
+
+	const Selection* selection{ nullptr };
+
+	/* Whether the name of an event class matches one of the globs */
+	std::unordered_map<const bt_event_class*, bool> eventClasses;
+
+	/* Upstream messages which did not fit into the last downstream batch */
+	std::vector<const bt2::Message*> pending;
+	std::size_t pendingIndex{ 0 };
+};
+
+std::vector<std::string> splitList( std::string_view list ) {
+	std::vector<std::string> items;
+	while ( !list.empty() ) {
+		const auto comma = list.find( ',' );
+		auto item = list.substr( 0, comma );
+		while ( !item.empty() && item.front() == ' ' ) {
+			item.remove_prefix( 1 );
+		}
+		while ( !item.empty() && item.back() == ' ' ) {
+			item.remove_suffix( 1 );
+		}
+		if ( !item.empty() ) {
+			items.emplace_back( item );
+		}
+		if ( comma == std::string_view::npos ) {
+			break;
+		}
+		list.remove_prefix( comma + 1 );
+	}
+	return items;
+}
+
+std::optional<int64_t> integerParam( const bt_value* value ) {
+	if ( bt_value_is_signed_integer( value ) ) {
+		return bt_value_integer_signed_get( value );
+	}
+	if ( bt_value_is_unsigned_integer( value ) ) {
+		return static_cast<int64_t>( bt_value_integer_unsigned_get( value ) );
+	}
+	return std::nullopt;
+}
+
+/*
+ * Parses the component parameters, returns an error message for invalid ones.
+ */
+const char* parseParams( const bt_value* params, Selection& selection ) {
+	if ( const auto* events = bt_value_map_borrow_entry_value_const( params, "events" ) ) {
+		if ( !bt_value_is_string( events ) ) {
+			return "The `events` parameter must be a string";
+		}
+		selection.events = splitList( bt_value_string_get( events ) );
+	}
+
+	if ( const auto* pid = bt_value_map_borrow_entry_value_const( params, "pid" ) ) {
+		if ( const auto value = integerParam( pid ) ) {
+			selection.pids.insert( *value );
+		} else if ( bt_value_is_string( pid ) ) {
+			for ( auto& item : splitList( bt_value_string_get( pid ) ) ) {
+				char* end;
+				const auto value = std::strtoll( item.c_str(), &end, 10 );
+				if ( *end == '\0' ) {
+					selection.pids.insert( value );
+				} else {
+					selection.procnames.insert( std::move( item ) );
+				}
+			}
+		} else {
+			return "The `pid` parameter must be an integer or a string";
+		}
+	}
+
+	for ( const auto& [name, bound] :
+		  { std::pair{ "begin", &selection.begin }, std::pair{ "end", &selection.end } } ) {
+		if ( const auto* value = bt_value_map_borrow_entry_value_const( params, name ) ) {
+			*bound = integerParam( value );
+			if ( !bound->has_value() ) {
+				return "The `begin` and `end` parameters must be integers (ns from origin)";
+			}
+		}
+	}
+
+	return nullptr;
+}
+
+bool matchesEventClass( IteratorData* data, const bt2::EventClass* eventClass ) {
+	const auto& events = data->selection->events;
+	if ( events.empty() ) {
+		return true;
+	}
+
+	const auto* ec = reinterpret_cast<const bt_event_class*>( eventClass );
+	auto it = data->eventClasses.find( ec );
+	if ( it == data->eventClasses.end() ) {
+		const auto* name = eventClass->getName();
+		bool matches = false;
+		for ( const auto& pattern : events ) {
+			if ( name != nullptr && fnmatch( pattern.c_str(), name, 0 ) == 0 ) {
+				matches = true;
+				break;
+			}
+		}
+		it = data->eventClasses.emplace( ec, matches ).first;
+	}
+	return it->second;
+}
+
+bool matchesProcess( const Selection& selection, const bt2::Event* event ) {
+	const auto* context = event->getCommonContextField();
+	if ( context == nullptr ) {
+		return false;
+	}
+
+	if ( const auto* vpid = context->getFieldByName( "vpid" ); vpid != nullptr ) {
+		const auto* field = reinterpret_cast<const bt_field*>( vpid );
+		const auto type = bt_field_get_class_type( field );
+		if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_SIGNED_INTEGER ) &&
+			 selection.pids.count( bt_field_integer_signed_get_value( field ) ) > 0 ) {
+			return true;
+		}
+		if ( bt_field_class_type_is( type, BT_FIELD_CLASS_TYPE_UNSIGNED_INTEGER ) &&
+			 selection.pids.count(
+				 static_cast<int64_t>( bt_field_integer_unsigned_get_value( field ) ) ) > 0 ) {
+			return true;
+		}
+	}
+
+	if ( const auto* procname = context->getFieldByName( "procname" ); procname != nullptr ) {
+		const auto* field = reinterpret_cast<const bt_field*>( procname );
+		if ( bt_field_get_class_type( field ) == BT_FIELD_CLASS_TYPE_STRING &&
+			 selection.procnames.count( bt_field_string_get_value( field ) ) > 0 ) {
+			return true;
+		}
+	}
+
+	return false;
+}
+
+bool matchesTime( const Selection& selection, const bt2::Message* msg ) {
+	/* Events of streams without a default clock are not time filtered */
+	if ( bt_message_event_borrow_stream_class_default_clock_class_const(
+			 reinterpret_cast<const bt_message*>( msg ) ) == nullptr ) {
+		return true;
+	}
+
+	const auto* message = reinterpret_cast<const bt2::EventMessage*>( msg );
+	const auto timestamp = message->getDefaultClockSnapshot()->getNsFromOrigin();
+	if ( !timestamp.has_value() ) {
+		return true;
+	}
+	return !( selection.begin && *timestamp < *selection.begin ) &&
+		   !( selection.end && *timestamp > *selection.end );
+}
+
+/*
+ * Returns whether `msg` is passed downstream: all messages which are not
+ * event messages and the selected event messages.
+ */
+bool isSelected( IteratorData* data, const bt2::Message* msg ) {
+	if ( msg->getType() != BT_MESSAGE_TYPE_EVENT ) {
+		return true;
+	}
+
+	const auto& selection = *data->selection;
+	const auto* event = reinterpret_cast<const bt2::EventMessage*>( msg )->getEvent();
+	if ( !matchesEventClass( data, event->getEventClass() ) ) {
+		return false;
+	}
+	if ( selection.selectsTime() && !matchesTime( selection, msg ) ) {
+		return false;
+	}
+	if ( selection.selectsProcess() && !matchesProcess( selection, event ) ) {
+		return false;
+	}
+	return true;
+}
+
+/*
+ * The wrapper of `bt_self_message_iterator` gives access to the protected
+ * members of bt2::MessageIterator.
+ */
+class SelectIterator : public bt2::MessageIterator {
+public:
+	static SelectIterator* from( bt_self_message_iterator* self_message_iterator ) {
+		return reinterpret_cast<SelectIterator*>( self_message_iterator );
+	}
+
+	bt_message_iterator_class_initialize_method_status initialize() {
+		auto* filter = reinterpret_cast<bt2::Filter*>( getComponent() );
+		auto data = std::make_unique<IteratorData>();
+		data->selection = filter->getData<Selection>();
+
+		try {
+			data->upstream = create( filter->getInputPortByIndex( 0 ) );
+		} catch ( const bt2::MemoryError& e ) {
+			return BT_MESSAGE_ITERATOR_CLASS_INITIALIZE_METHOD_STATUS_MEMORY_ERROR;
+		} catch ( const bt2::Exception& e ) {
+			appendErrorCause( e );
+			return BT_MESSAGE_ITERATOR_CLASS_INITIALIZE_METHOD_STATUS_ERROR;
+		}
+
+		setData( data.release() );
+		return BT_MESSAGE_ITERATOR_CLASS_INITIALIZE_METHOD_STATUS_OK;
+	}
+
+	void finalize() {
+		std::unique_ptr<IteratorData> data{ getData<IteratorData>() };
+		for ( auto i = data->pendingIndex; i < data->pending.size(); ++i ) {
+			data->pending[i]->putRef();
+		}
+		data->upstream->putRef();
+	}
+
+	bt_message_iterator_class_next_method_status next( bt_message_array_const messages,
+													   uint64_t capacity, uint64_t* count ) {
+		auto* data = getData<IteratorData>();
+		uint64_t selected = 0;
+
+		while ( selected < capacity ) {
+			if ( data->pendingIndex == data->pending.size() ) {
+				/* Deliver what we have before asking upstream for more */
+				if ( selected > 0 ) {
+					break;
+				}
+
+				auto&& [batch, status] = data->upstream->next();
+				switch ( status ) {
+				case BT_MESSAGE_ITERATOR_NEXT_STATUS_END:
+					return BT_MESSAGE_ITERATOR_CLASS_NEXT_METHOD_STATUS_END;
+				case BT_MESSAGE_ITERATOR_NEXT_STATUS_AGAIN:
+					return BT_MESSAGE_ITERATOR_CLASS_NEXT_METHOD_STATUS_AGAIN;
+				case BT_MESSAGE_ITERATOR_NEXT_STATUS_MEMORY_ERROR:
+					return BT_MESSAGE_ITERATOR_CLASS_NEXT_METHOD_STATUS_MEMORY_ERROR;
+				case BT_MESSAGE_ITERATOR_NEXT_STATUS_ERROR:
+					return BT_MESSAGE_ITERATOR_CLASS_NEXT_METHOD_STATUS_ERROR;
+				default:
+					break;
+				}
+				data->pending.assign( batch.begin(), batch.end() );
+				data->pendingIndex = 0;
+				continue;
+			}
+
+			const auto* message = data->pending[data->pendingIndex++];
+			if ( isSelected( data, message ) ) {
+				messages[selected++] = reinterpret_cast<const bt_message*>( message );
+			} else {
+				message->putRef();
+			}
+		}
+
+		*count = selected;
+		return BT_MESSAGE_ITERATOR_CLASS_NEXT_METHOD_STATUS_OK;
+	}
+};
+
+}  // namespace
+
+/*
+ * Initializes the filter component.
+ */
+bt_component_class_initialize_method_status initialize(
+	bt_self_component_filter* self_component_filter,
+	bt_self_component_filter_configuration* configuration, const bt_value* params,
+	void* initialize_method_data ) {
+	auto* filter = reinterpret_cast<bt2::Filter*>( self_component_filter );
+	auto selection = std::make_unique<Selection>();
+
+	if ( const auto* error = parseParams( params, *selection ) ) {
+		BT_CURRENT_THREAD_ERROR_APPEND_CAUSE_FROM_COMPONENT(
+			bt_self_component_filter_as_self_component( self_component_filter ), "%s", error );
+		return BT_COMPONENT_CLASS_INITIALIZE_METHOD_STATUS_ERROR;
+	}
+
+	try {
+		filter->addInputPort( "in" );
+		filter->addOutputPort( "out" );
+	} catch ( const bt2::Exception& e ) {
+		BT_CURRENT_THREAD_ERROR_APPEND_CAUSE_FROM_COMPONENT(
+			bt_self_component_filter_as_self_component( self_component_filter ), "%s", e.what() );
+		return BT_COMPONENT_CLASS_INITIALIZE_METHOD_STATUS_ERROR;
+	}
+
+	filter->setData( selection.release() );
+	return BT_COMPONENT_CLASS_INITIALIZE_METHOD_STATUS_OK;
+}
+
+/*
+ * Finalizes the filter component.
+ */
+void finalize( bt_self_component_filter* self_component_filter ) {
+	auto* filter = reinterpret_cast<bt2::Filter*>( self_component_filter );
+	std::unique_ptr<Selection> selection{ filter->getData<Selection>() };
+}
+
+bt_message_iterator_class_initialize_method_status iteratorInitialize(
+	bt_self_message_iterator* self_message_iterator,
+	bt_self_message_iterator_configuration* configuration,
+	bt_self_component_port_output* self_port ) {
+	return SelectIterator::from( self_message_iterator )->initialize();
+}
+
+void iteratorFinalize( bt_self_message_iterator* self_message_iterator ) {
+	SelectIterator::from( self_message_iterator )->finalize();
+}
+
+bt_message_iterator_class_next_method_status iteratorNext(
+	bt_self_message_iterator* self_message_iterator, bt_message_array_const messages,
+	uint64_t capacity, uint64_t* count ) {
+	return SelectIterator::from( self_message_iterator )->next( messages, capacity, count );
+}
+
+}  // namespace ros2observer::select
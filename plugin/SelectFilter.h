@@ -0,0 +1,46 @@
+/*
+ * Copyright (c) 2025 INCHRON AG <info@inchron.com>
+ *
+ * This program and the accompanying materials are made available under the
+ * terms of the Eclipse Public License 2.0 which is available at
+ * https://www.eclipse.org/legal/epl-2.0/
+ *
+ * SPDX-License-Identifier: EPL-2.0
+ */
+#pragma once
+
+#include <babeltrace2/babeltrace.h>
+
+
+/*
+ * The `filter.ros2observer.select` component class drops event messages that
+ * do not match the selection before they reach any sink. All other messages
+ * are passed through unchanged.
+ *
+ * Parameters:
+ *   events  Comma separated event name globs, e.g. "ros2:callback_*,ros2:rmw_*"
+ *   pid     Comma separated process IDs (vpid) or process names (procname)
+ *   begin   Start of the time range in ns from the clock origin (inclusive)
+ *   end     End of the time range in ns from the clock origin (inclusive)
+ */
+namespace ros2observer::select {
+
+bt_component_class_initialize_method_status initialize(
+	bt_self_component_filter* self_component_filter,
+	bt_self_component_filter_configuration* configuration, const bt_value* params,
+	void* initialize_method_data );
+
+void finalize( bt_self_component_filter* self_component_filter );
+
+bt_message_iterator_class_initialize_method_status iteratorInitialize(
+	bt_self_message_iterator* self_message_iterator,
+	bt_self_message_iterator_configuration* configuration,
+	bt_self_component_port_output* self_port );
+
+void iteratorFinalize( bt_self_message_iterator* self_message_iterator );
+
+bt_message_iterator_class_next_method_status iteratorNext(
+	bt_self_message_iterator* self_message_iterator, bt_message_array_const messages,
+	uint64_t capacity, uint64_t* count );
+
+}  // namespace ros2observer::select
@@ -0,0 +1,43 @@
+/*
+ * Copyright (c) 2025 INCHRON AG <info@inchron.com>
+ *
+ * This program and the accompanying materials are made available under the
+ * terms of the Eclipse Public License 2.0 which is available at
+ * https://www.eclipse.org/legal/epl-2.0/
+ *
+ * SPDX-License-Identifier: EPL-2.0
+ */
+
+#include <babeltrace2/babeltrace.h>
+
+#include "NdjsonSink.h"
+#include "SelectFilter.h"
+
+
+/* Mandatory */
+BT_PLUGIN_MODULE();
+
+/* Define the `ros2observer` plugin */
+BT_PLUGIN( ros2observer );
+BT_PLUGIN_DESCRIPTION( "ROS 2 Observer trace conversion components" );
+BT_PLUGIN_LICENSE( "EPL-2.0" );
+
+/* Define the `ndjson` sink component class */
+BT_PLUGIN_SINK_COMPONENT_CLASS( ndjson, ros2observer::ndjson::consume );
+BT_PLUGIN_SINK_COMPONENT_CLASS_DESCRIPTION( ndjson,
+											"Write events as newline delimited JSON records" );
+BT_PLUGIN_SINK_COMPONENT_CLASS_INITIALIZE_METHOD( ndjson, ros2observer::ndjson::initialize );
+BT_PLUGIN_SINK_COMPONENT_CLASS_FINALIZE_METHOD( ndjson, ros2observer::ndjson::finalize );
+BT_PLUGIN_SINK_COMPONENT_CLASS_GRAPH_IS_CONFIGURED_METHOD(
+	ndjson, ros2observer::ndjson::graphIsConfigured );
+
+/* Define the `select` filter component class */
+BT_PLUGIN_FILTER_COMPONENT_CLASS( select, ros2observer::select::iteratorNext );
+BT_PLUGIN_FILTER_COMPONENT_CLASS_DESCRIPTION(
+	select, "Drop events by event name glob, process and time range" );
+BT_PLUGIN_FILTER_COMPONENT_CLASS_INITIALIZE_METHOD( select, ros2observer::select::initialize );
+BT_PLUGIN_FILTER_COMPONENT_CLASS_FINALIZE_METHOD( select, ros2observer::select::finalize );
+BT_PLUGIN_FILTER_COMPONENT_CLASS_MESSAGE_ITERATOR_CLASS_INITIALIZE_METHOD(
+	select, ros2observer::select::iteratorInitialize );
+BT_PLUGIN_FILTER_COMPONENT_CLASS_MESSAGE_ITERATOR_CLASS_FINALIZE_METHOD(
+	select, ros2observer::select::iteratorFinalize );
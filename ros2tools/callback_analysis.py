@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+try:
+    from ros2tools.trace_columns import ColumnarTrace, write_columnar_trace
+    from ros2tools.trace_converter import load_trace_events
+    from ros2tools.live_trace import CallbackRegistry, REGISTRY_EVENTS
+    from ros2tools.util import write_json_file
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_columns import ColumnarTrace, write_columnar_trace
+    from trace_converter import load_trace_events
+    from live_trace import CallbackRegistry, REGISTRY_EVENTS
+    from util import write_json_file
+
+
+# callback_analysis.py turns a converted trace into callback performance
+# numbers. The `ros2:callback_start` and `ros2:callback_end` columns of the
+# columnar trace (trace.npz) are paired per process, thread and callback
+# handle with one sort instead of a Python loop over the events: sorted by
+# (vpid, vtid, timestamp), a start directly followed by the end of the same
+# callback on the same thread is a callback execution. The durations are then
+# grouped per callback, again by sorting, and the callbacks are named through
+# the initialization events (node, topic, service or timer).
+
+CALLBACK_START = "ros2:callback_start"
+CALLBACK_END = "ros2:callback_end"
+PERCENTILES = (50, 90, 99)
+# Histogram bins: powers of two from 1.024 us to 17.2 s, plus underflow and overflow
+HISTOGRAM_EDGES = np.concatenate(([0], 2 ** np.arange(10, 35, dtype=np.int64), [np.iinfo(np.int64).max]))
+STATISTICS_COLUMNS = ["node", "callback", "vpid", "handle", "count", "total", "mean", "min"] \
+    + [f"p{percentile}" for percentile in PERCENTILES] + ["max", "budget", "over_budget"]
+
+
+def format_handle(handle):
+    return f"0x{int(handle):X}"
+
+
+def open_columnar_trace(trace_file):
+    """
+    Open a trace for column-wise analysis. A trace.npz is used directly, for
+    NDJSON or JSON traces the trace.npz next to them, or a temporary columnar
+    copy is written.
+    """
+    if trace_file.endswith(".npz"):
+        return ColumnarTrace(trace_file)
+    columns_file = os.path.join(os.path.dirname(trace_file), "trace.npz")
+    if os.path.exists(columns_file):
+        return ColumnarTrace(columns_file)
+    handle, columns_file = tempfile.mkstemp(suffix=".npz")
+    os.close(handle)
+    write_columnar_trace(columns_file, load_trace_events(trace_file))
+    trace = ColumnarTrace(columns_file)
+    os.remove(columns_file)
+    return trace
+
+
+def load_columns(trace, event, columns):
+    """
+    Load columns of an event class as arrays, missing columns are zeros and an
+    event class which is not in the trace has empty columns.
+    """
+    length = trace.length(event)
+    loaded = trace.load(event, columns) if length else {}
+    return {column: loaded[column] if column in loaded else np.zeros(length, dtype=np.int64) for column in columns}
+
+
+def group_boundaries(*keys):
+    """
+    The start indexes of the runs of equal keys in arrays sorted by `keys`,
+    with the total length appended.
+    """
+    length = len(keys[0])
+    if length == 0:
+        return np.zeros(1, dtype=np.int64)
+    changed = np.zeros(length, dtype=bool)
+    changed[0] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    return np.append(np.flatnonzero(changed), length)
+
+
+def grouped_statistics(values, boundaries, percentiles=PERCENTILES):
+    """
+    Count, sum, mean, minimum, percentiles (nearest rank) and maximum of the
+    groups of `values`, which are sorted by group and by value within each
+    group; `boundaries` are the group starts, see `group_boundaries`.
+
+    :return: A dictionary of arrays with one value per group
+    """
+    starts = boundaries[:-1]
+    counts = np.diff(boundaries)
+    totals = np.add.reduceat(values, starts) if len(values) else np.zeros(0, dtype=values.dtype)
+    statistics = {
+        "count": counts,
+        "total": totals,
+        "mean": totals / np.maximum(counts, 1),
+        "min": values[starts] if len(values) else totals,
+    }
+    for percentile in percentiles:
+        ranks = np.ceil(counts * (percentile / 100)).astype(np.int64) - 1
+        statistics[f"p{percentile}"] = values[starts + np.maximum(ranks, 0)] if len(values) else totals
+    statistics["max"] = values[boundaries[1:] - 1] if len(values) else totals
+    return statistics
+
+
+def grouped_histograms(values, group_index, group_count, edges=HISTOGRAM_EDGES):
+    """Histogram counts of `values` per group, an array of shape (group_count, len(edges) - 1)."""
+    bins = np.searchsorted(edges, values, side="right") - 1
+    bins = np.clip(bins, 0, len(edges) - 2)
+    counts = np.bincount(group_index * (len(edges) - 1) + bins, minlength=group_count * (len(edges) - 1))
+    return counts.reshape(group_count, len(edges) - 1)
+
+
+def pair_callbacks(trace):
+    """
+    Pair the callback start and end events.
+
+    :return: A dictionary of arrays with one entry per callback execution:
+        vpid, vtid, callback (handle), start (timestamp) and duration (ns)
+    """
+    columns = ["timestamp", "vpid", "vtid", "callback"]
+    starts = load_columns(trace, CALLBACK_START, columns)
+    ends = load_columns(trace, CALLBACK_END, columns)
+    timestamps = np.concatenate((starts["timestamp"], ends["timestamp"])).astype(np.int64)
+    vpids = np.concatenate((starts["vpid"], ends["vpid"])).astype(np.int64)
+    vtids = np.concatenate((starts["vtid"], ends["vtid"])).astype(np.int64)
+    callbacks = np.concatenate((starts["callback"], ends["callback"])).astype(np.uint64)
+    is_end = np.concatenate((np.zeros(len(starts["timestamp"]), dtype=np.int8), np.ones(len(ends["timestamp"]), dtype=np.int8)))
+
+    # Two packed sort keys instead of four: (vpid, vtid) and (timestamp, is_end)
+    threads = (vpids << 32) | vtids
+    order = np.lexsort((timestamps * 2 + is_end, threads))
+    timestamps, vpids, vtids, callbacks, is_end = timestamps[order], vpids[order], vtids[order], callbacks[order], is_end[order]
+    paired = (
+        (is_end[:-1] == 0) & (is_end[1:] == 1)
+        & (vpids[:-1] == vpids[1:]) & (vtids[:-1] == vtids[1:]) & (callbacks[:-1] == callbacks[1:])
+    )
+    first = np.flatnonzero(paired)
+    return {
+        "vpid": vpids[first],
+        "vtid": vtids[first],
+        "callback": callbacks[first],
+        "start": timestamps[first],
+        "duration": timestamps[first + 1] - timestamps[first],
+        "unpaired": len(timestamps) - 2 * len(first),
+    }
+
+
+def load_callback_registry(trace):
+    """
+    Name the callbacks through the initialization events of the trace, see
+    `CallbackRegistry`. These events are rare, so they are passed row by row.
+    """
+    registry = CallbackRegistry()
+    timer_periods = {}
+    events = []
+    for event in REGISTRY_EVENTS:
+        if not trace.length(event):
+            continue
+        columns = trace.load(event)
+        hex_columns = {name for name, values in columns.items() if values.dtype == np.uint64}
+        for row in range(len(columns["timestamp"])):
+            record = {"event": event}
+            for name, values in columns.items():
+                value = values[row]
+                record[name] = format_handle(value) if name in hex_columns else value.item()
+            events.append(record)
+    events.sort(key=lambda record: record["timestamp"])
+    for record in events:
+        try:
+            registry.add(record)
+        except KeyError:
+            continue
+        if record["event"] == "ros2:rcl_timer_init":
+            timer_periods[(record.get("vpid"), record["timer_handle"])] = record["period"]
+    return registry, timer_periods
+
+
+def process_names(trace):
+    """The procname of every vpid with callbacks, to name processes without node names."""
+    if not trace.has_column(CALLBACK_START, "procname"):
+        return {}
+    vpids, first = np.unique(trace.column(CALLBACK_START, "vpid"), return_index=True)
+    procnames = trace.column(CALLBACK_START, "procname")[first]
+    return dict(zip(vpids.tolist(), procnames.tolist()))
+
+
+def analyze_callbacks(trace, budget_ns=None):
+    """
+    Callback statistics of a columnar trace.
+
+    :param trace: A `ColumnarTrace`, see `open_columnar_trace`
+    :param budget_ns: Duration budget of every callback in ns; without it the
+        period of timer callbacks is their budget
+    :return: A dictionary with the per callback statistics (`callbacks`), the
+        histogram bin edges and the number of callback executions
+    """
+    executions = pair_callbacks(trace)
+    vpids, callbacks, durations = executions["vpid"], executions["callback"], executions["duration"]
+    order = np.lexsort((durations, callbacks, vpids))
+    vpids, callbacks, durations = vpids[order], callbacks[order], durations[order]
+    boundaries = group_boundaries(vpids, callbacks)
+    statistics = grouped_statistics(durations, boundaries)
+    group_index = np.repeat(np.arange(len(boundaries) - 1), np.diff(boundaries))
+    histograms = grouped_histograms(durations, group_index, len(boundaries) - 1)
+
+    registry, timer_periods = load_callback_registry(trace)
+    procnames = process_names(trace)
+    results = []
+    for group, start in enumerate(boundaries[:-1]):
+        vpid = int(vpids[start])
+        handle = format_handle(callbacks[start])
+        node, label = registry.callback_name(vpid, handle, procnames.get(vpid))
+        budget = budget_ns
+        if budget is None:
+            budget = timer_periods.get((vpid, registry.callbacks.get((vpid, handle))))
+        end = boundaries[group + 1]
+        over_budget = int(end - np.searchsorted(durations[start:end], budget, side="right") - start) if budget else None
+        result = {"node": node, "callback": label, "vpid": vpid, "handle": handle}
+        for name, values in statistics.items():
+            result[name] = values[group].item()
+        result["budget"] = budget
+        result["over_budget"] = over_budget
+        result["histogram"] = histograms[group].tolist()
+        results.append(result)
+    results.sort(key=lambda result: result["total"], reverse=True)
+    return {
+        "executions": len(durations),
+        "unpaired_events": executions["unpaired"],
+        "histogram_edges": HISTOGRAM_EDGES.tolist(),
+        "callbacks": results,
+    }
+
+
+def write_analysis_json(analysis, output_file, pretty=False):
+    write_json_file(output_file, analysis, pretty)
+
+
+def write_analysis_csv(analysis, output_file):
+    """
+    Write the statistics as CSV, one row per callback, and the histograms in
+    long form (one row per callback and bin) to `<output_file>` with the suffix
+    `_histograms.csv`.
+    """
+    with open(output_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=STATISTICS_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(analysis["callbacks"])
+    histogram_file = f"{os.path.splitext(output_file)[0]}_histograms.csv"
+    edges = analysis["histogram_edges"]
+    with open(histogram_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["node", "callback", "vpid", "handle", "bin_start_ns", "bin_end_ns", "count"])
+        for callback in analysis["callbacks"]:
+            for number, count in enumerate(callback["histogram"]):
+                if count:
+                    writer.writerow([callback["node"], callback["callback"], callback["vpid"], callback["handle"], edges[number], edges[number + 1], count])
+    print(f"Callback analysis written to {output_file} and {histogram_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per callback duration statistics of a converted ROS 2 trace")
+    parser.add_argument("trace_file", nargs="?", default="trace.npz", help="trace.npz, or trace.ndjson/trace.json (slower, converted to columns first). Default is trace.npz.")
+    parser.add_argument("-o", "--output", default="callbacks", help="Output file name without extension, .json and .csv are written. Default is callbacks.")
+    parser.add_argument("--budget", type=float, help="Duration budget of every callback in ms, over budget executions are counted. Default is the period of timer callbacks.")
+    parser.add_argument("--pretty", action="store_true", help="Write indented JSON, the output is compact by default.")
+    args = parser.parse_args()
+
+    trace = open_columnar_trace(args.trace_file)
+    analysis = analyze_callbacks(trace, None if args.budget is None else int(args.budget * 1e6))
+    trace.close()
+    write_analysis_json(analysis, f"{args.output}.json", args.pretty)
+    write_analysis_csv(analysis, f"{args.output}.csv")
+    print(f"{analysis['executions']} callback executions of {len(analysis['callbacks'])} callbacks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import datetime
+import os
+import sys
+
+import numpy as np
+
+try:
+    from ros2tools.trace_converter import NS_PER_SECOND
+    from ros2tools.callback_analysis import open_columnar_trace, grouped_statistics
+    from ros2tools.message_flow import match_messages, match_previous, grouped_rows
+    from ros2tools.util import read_json_file, write_json_file
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_converter import NS_PER_SECOND
+    from callback_analysis import open_columnar_trace, grouped_statistics
+    from message_flow import match_messages, match_previous, grouped_rows
+    from util import read_json_file, write_json_file
+
+
+# chain_analysis.py measures the end-to-end latency of a processing chain, a
+# path of nodes through the topic graph (e.g. sensor -> filter -> planner ->
+# controller). The messages of every hop come from `match_messages`; a chain
+# instance is followed backwards from every callback of the last node: the
+# message which started it, the input of the node which published that
+# message (the latest message it received before publishing) and so on up to
+# the first publish. Every hop is split into
+#   communication   rclcpp_publish to rmw_take
+#   queueing        rmw_take to callback_start
+#   processing      callback_start to the publish of the next hop (for nodes
+#                   publishing from a timer this includes the wait for the
+#                   timer), callback_start to callback_end on the last node
+
+HOP_SEGMENTS = ["communication", "queueing", "processing"]
+WORST_INSTANCES = 10
+
+
+def format_time(timestamp):
+    """A Unix timestamp in ns as local date and time with ns, as `babeltrace2 --clock-date` prints it."""
+    seconds, nanoseconds = divmod(int(timestamp), NS_PER_SECOND)
+    return f"{datetime.datetime.fromtimestamp(seconds):%Y-%m-%d %H:%M:%S}.{nanoseconds:09d}"
+
+
+def chain_topics(path, graph=None, endpoints=()):
+    """
+    The topics connecting consecutive nodes of `path`, from the edges of a
+    `ROS2Tools.generate_graph` graph or else from the (topic, node) endpoints
+    of the trace.
+
+    :raises: An exception if two nodes are not connected by exactly one topic
+    """
+    topics = []
+    for source, target in zip(path, path[1:]):
+        if graph is not None:
+            candidates = {edge["topic"] for edge in graph["edges"] if edge["source"] == source and edge["target"] == target}
+        else:
+            published = {topic for topic, node in endpoints if node == source}
+            candidates = {topic for topic, node in endpoints if node == target and topic in published}
+        if len(candidates) != 1:
+            found = ", ".join(sorted(candidates)) or "none"
+            raise Exception(f"ERROR: Expected one topic from {source} to {target}, found {found}. Use --topics to choose.")
+        topics.append(candidates.pop())
+    return topics
+
+
+def hop_messages(messages, topic, source, target):
+    """The messages of `messages` on `topic` from the node `source` to the node `target`, sorted by publish time."""
+    names = messages["endpoints"]
+    publishers = np.array([node == source and name == topic for name, node in names] + [False])
+    subscriptions = np.array([node == target and name == topic for name, node in names] + [False])
+    selected = np.flatnonzero(publishers[messages["publisher"]] & subscriptions[messages["subscription"]])
+    selected = selected[np.argsort(messages["publish"][selected], kind="stable")]
+    return {name: messages[name][selected] for name in ["publish", "take", "callback_start", "callback_end"]}
+
+
+def chain_instances(trace, path, topics=None, graph=None):
+    """
+    Follow the instances of the chain `path` through a trace.
+
+    :param trace: A `ColumnarTrace`, see `open_columnar_trace`
+    :param path: Node names from the first publishing to the last subscribing node
+    :param topics: The topic of every hop, see `chain_topics` if None
+    :param graph: A graph of `ROS2Tools.generate_graph` to look up the topics
+    :return: A dictionary of arrays with one entry per instance: the first
+        publish (`start`), the end of the last callback (`end`), the `latency`
+        and the `segments` of every hop
+    """
+    if len(path) < 2:
+        raise Exception("ERROR: A chain needs at least two nodes.")
+    messages = match_messages(trace)
+    topics = topics or chain_topics(path, graph, messages["endpoints"])
+    if len(topics) != len(path) - 1:
+        raise Exception(f"ERROR: A chain of {len(path)} nodes needs {len(path) - 1} topics, got {len(topics)}.")
+    hops = [hop_messages(messages, topic, source, target) for topic, source, target in zip(topics, path, path[1:])]
+
+    # Follow every instance backwards from the messages of the last hop: the
+    # input of a publish is the latest message its node received before it
+    last = hops[-1]
+    indexes = [None] * len(hops)
+    indexes[-1] = np.flatnonzero(last["callback_end"] >= 0)
+    complete = np.ones(len(indexes[-1]), dtype=bool)
+    for hop in range(len(hops) - 2, -1, -1):
+        following = hops[hop + 1]["publish"]
+        inputs = match_previous(
+            [np.zeros(len(hops[hop]["callback_start"]), dtype=np.int64)], hops[hop]["callback_start"],
+            [np.zeros(len(following), dtype=np.int64)], following,
+        )
+        indexes[hop] = inputs[indexes[hop + 1]]
+        complete &= indexes[hop] >= 0
+        indexes[hop] = np.maximum(indexes[hop], 0)
+    indexes = [index[complete] for index in indexes]
+
+    segments = []
+    for hop, index in enumerate(indexes):
+        take = hops[hop]["take"][index]
+        callback_start = hops[hop]["callback_start"][index]
+        processing_end = hops[hop + 1]["publish"][indexes[hop + 1]] if hop + 1 < len(hops) else last["callback_end"][index]
+        segments.append({
+            "communication": take - hops[hop]["publish"][index],
+            "queueing": callback_start - take,
+            "processing": processing_end - callback_start,
+        })
+    start = hops[0]["publish"][indexes[0]]
+    end = last["callback_end"][indexes[-1]]
+    return {
+        "path": list(path),
+        "topics": topics,
+        "start": start,
+        "end": end,
+        "latency": end - start,
+        "segments": segments,
+        "incomplete": len(last["publish"]) - len(start),
+    }
+
+
+def distribution(values):
+    """Count, mean, minimum, percentiles and maximum of `values`, None without values."""
+    if not len(values):
+        return None
+    return grouped_rows(grouped_statistics(np.sort(values), np.array([0, len(values)])))[0]
+
+
+def summarize_chain(instances, worst=WORST_INSTANCES):
+    """
+    The latency distributions of a chain and of every hop segment, and the
+    `worst` slowest instances with their timestamps, see `chain_instances`.
+    """
+    path, segments = instances["path"], instances["segments"]
+    slowest = np.argsort(instances["latency"], kind="stable")[::-1][:worst]
+    return {
+        "path": path,
+        "topics": instances["topics"],
+        "instances": len(instances["latency"]),
+        "incomplete": instances["incomplete"],
+        "latency": distribution(instances["latency"]),
+        "hops": [
+            {"source": source, "target": target, "topic": topic, **{segment: distribution(values) for segment, values in hop_segments.items()}}
+            for topic, source, target, hop_segments in zip(instances["topics"], path, path[1:], segments)
+        ],
+        "worst": [
+            {
+                "start": int(instances["start"][instance]),
+                "end": int(instances["end"][instance]),
+                "start_time": format_time(instances["start"][instance]),
+                "end_time": format_time(instances["end"][instance]),
+                "latency": int(instances["latency"][instance]),
+                "hops": [{segment: int(values[instance]) for segment, values in hop_segments.items()} for hop_segments in segments],
+            }
+            for instance in slowest
+        ],
+    }
+
+
+def write_instances_csv(instances, output_file):
+    """Write every chain instance as a CSV row: start, end, latency and the segments of every hop in ns."""
+    hops = range(len(instances["segments"]))
+    columns = [instances[name] for name in ["start", "end", "latency"]]
+    columns += [instances["segments"][hop][segment] for hop in hops for segment in HOP_SEGMENTS]
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["start", "end", "latency"] + [f"hop{hop + 1}_{segment}" for hop in hops for segment in HOP_SEGMENTS])
+        writer.writerows(zip(*(values.tolist() for values in columns)))
+    print(f"Chain instances written to {output_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency of a processing chain of nodes from a converted ROS 2 trace")
+    parser.add_argument("trace_file", nargs="?", default="trace.npz", help="trace.npz, or trace.ndjson/trace.json (slower, converted to columns first). Default is trace.npz.")
+    parser.add_argument("--path", nargs="+", required=True, metavar="NODE", help="The nodes of the chain in order, e.g. /sensor /filter /planner /controller")
+    parser.add_argument("--topics", nargs="+", metavar="TOPIC", help="The topic of every hop, default is the only topic connecting two nodes")
+    parser.add_argument("--graph", help="graph.json of ros2-node-inspector to look up the topics of the hops")
+    parser.add_argument("--worst", type=int, default=WORST_INSTANCES, help=f"Number of slowest instances to report. Default is {WORST_INSTANCES}.")
+    parser.add_argument("-o", "--output", default="chain", help="Output file name without extension, .json and .csv are written. Default is chain.")
+    parser.add_argument("--pretty", action="store_true", help="Write indented JSON, the output is compact by default.")
+    args = parser.parse_args()
+
+    graph = read_json_file(args.graph) if args.graph else None
+    trace = open_columnar_trace(args.trace_file)
+    instances = chain_instances(trace, args.path, args.topics, graph)
+    trace.close()
+    write_instances_csv(instances, f"{args.output}.csv")
+    analysis = summarize_chain(instances, args.worst)
+    write_json_file(f"{args.output}.json", analysis, args.pretty)
+
+    latency = analysis["latency"]
+    print(f"{analysis['instances']} instances of {' -> '.join(args.path)}, {analysis['incomplete']} incomplete")
+    if latency:
+        print(f"latency p50 {latency['p50'] / 1e6:.3f} ms, p99 {latency['p99'] / 1e6:.3f} ms, max {latency['max'] / 1e6:.3f} ms")
+        for instance in analysis["worst"][:3]:
+            print(f"  {instance['latency'] / 1e6:.3f} ms from {instance['start_time']} to {instance['end_time']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import sys
+
+try:
+    import bt2
+except ImportError:
+    bt2 = None
+
+try:
+    from ros2tools.trace_converter import NS_PER_SECOND, payload_key
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_converter import NS_PER_SECOND, payload_key
+
+
+# ctf_reader.py reads LTTng CTF traces directly through the babeltrace2 Python
+# bindings (`python3-bt2`) and produces the same flat event records as the
+# `babeltrace2` text log parser in trace_converter.py, without the text round
+# trip. Field values are taken from the typed trace IR: integers stay integers,
+# integers displayed in hexadecimal (handles, pointers) are formatted like the
+# babeltrace2 text output and nested structures are flattened with "." keys.
+
+# Converted outputs which live next to the raw LTTng traces and must not be
+# read back as input
+EXCLUDED_TRACE_DIRECTORIES = ("trace.ctf",)
+
+
+def bt2_available():
+    return bt2 is not None
+
+
+def find_ctf_traces(trace_directory, exclude=EXCLUDED_TRACE_DIRECTORIES):
+    """
+    Find the CTF traces (directories containing a `metadata` file) below a
+    tracing session directory.
+
+    :param trace_directory: The tracing session directory
+    :param exclude: Directory names to skip, e.g. converted copies of the trace
+    :return: A sorted list of CTF trace directories
+    """
+    traces = []
+    for root, dirs, files in os.walk(trace_directory):
+        dirs[:] = [d for d in dirs if d not in exclude]
+        if "metadata" in files:
+            traces.append(root)
+            dirs[:] = []
+    return sorted(traces)
+
+
+def field_value(field):
+    """
+    Convert a bt2 field to a plain Python value.
+    """
+    if isinstance(field, bt2._StructureFieldConst):
+        return {name: field_value(member) for name, member in field.items()}
+    if isinstance(field, bt2._BoolFieldConst):
+        return bool(field)
+    if isinstance(field, bt2._IntegerFieldConst):
+        value = int(field)
+        if field.cls.preferred_display_base == 16:
+            return f"0x{value:X}"
+        return value
+    if isinstance(field, bt2._BitArrayFieldConst):
+        return int(field.value_as_integer)
+    if isinstance(field, bt2._RealFieldConst):
+        return float(field)
+    if isinstance(field, bt2._StringFieldConst):
+        return str(field)
+    if isinstance(field, bt2._ArrayFieldConst):
+        return [field_value(element) for element in field]
+    if isinstance(field, bt2._OptionFieldConst):
+        return field_value(field.field) if field.has_field else None
+    if isinstance(field, bt2._VariantFieldConst):
+        return field_value(field.selected_option)
+    return str(field)
+
+
+def add_fields(record, field, parent_key=""):
+    """
+    Add the members of a structure field to a flat record, nested members
+    are flattened to "parent.child" keys like `flatten_dict`.
+    """
+    if field is None:
+        return
+    for name, member in field.items():
+        key = f"{parent_key}.{name}" if parent_key else payload_key(name)
+        if isinstance(member, bt2._StructureFieldConst):
+            add_fields(record, member, key)
+        else:
+            record[key] = field_value(member)
+
+
+def format_seconds(nanoseconds, sign=""):
+    seconds, fraction = divmod(nanoseconds, NS_PER_SECOND)
+    return f"{sign}{seconds}.{fraction:09d}"
+
+
+def iter_ctf_events(traces, begin=None, end=None):
+    """
+    Iterate the events of one or more CTF traces in time order as flat event
+    records, the same records `iter_trace_events` produces from the
+    `babeltrace2 --clock-seconds` text log (without the raw `data` string).
+
+    :param traces: A CTF trace directory or a list of them, see `find_ctf_traces`
+    :param begin: Optional start of the time range in seconds from origin
+    :param end: Optional end of the time range in seconds from origin
+    :return: A generator of event dictionaries
+    """
+    if bt2 is None:
+        raise Exception("ERROR: The babeltrace2 Python bindings (python3-bt2) are not installed.")
+
+    if isinstance(traces, str):
+        traces = [traces]
+
+    hostnames = {}
+    previous_timestamp = None
+    iterator = bt2.TraceCollectionMessageIterator(traces, begin=begin, end=end)
+    for message in iterator:
+        if type(message) is not bt2._EventMessageConst:
+            continue
+
+        event = message.event
+        stream = event.stream
+        hostname = hostnames.get(stream.addr)
+        if hostname is None:
+            environment = stream.trace.environment
+            hostname = str(environment["hostname"]) if "hostname" in environment else ""
+            hostnames[stream.addr] = hostname
+
+        timestamp = message.default_clock_snapshot.ns_from_origin
+        if previous_timestamp is None:
+            delta = 0
+            original_delta = "+?.?????????"
+        else:
+            delta = timestamp - previous_timestamp
+            original_delta = format_seconds(delta, "+")
+        previous_timestamp = timestamp
+
+        record = {
+            "timestamp": timestamp,
+            "delta": delta,
+            "hostname": hostname,
+            "event": event.name,
+            "original_timestamp": format_seconds(timestamp),
+            "original_delta": original_delta,
+        }
+
+        packet = event.packet
+        if packet is not None and packet.context_field is not None and "cpu_id" in packet.context_field:
+            record["cpu_id"] = field_value(packet.context_field["cpu_id"])
+        add_fields(record, event.common_context_field)
+        add_fields(record, event.specific_context_field)
+        add_fields(record, event.payload_field)
+        yield record
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+try:
+    from ros2tools.trace_converter import NS_PER_SECOND, TimestampDecoder, TraceLineDecoder
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_converter import NS_PER_SECOND, TimestampDecoder, TraceLineDecoder
+
+
+# live_trace.py consumes the events of a running LTTng live session while they
+# are recorded. A long running `babeltrace2 --input-format=lttng-live` prints
+# the events as text, which are scanned incrementally: the frequent callback
+# events only have the few fields needed for the statistics extracted, the
+# rare initialization events, which name the nodes and callbacks, are decoded
+# completely by `TraceLineDecoder`. The statistics cover a rolling window of
+# one second slots, so the memory is bounded by the number of nodes and
+# callbacks and not by the length of the session.
+
+LIVE_CONVERT_COMMAND = "babeltrace2 --input-format=lttng-live --clock-seconds"
+READ_SIZE = 1024 * 1024
+WINDOW_SECONDS = 10
+# Callbacks beyond this number are counted under OTHER_KEY
+MAX_KEYS = 4096
+OTHER_KEY = (None, "<other>")
+
+VPID_PATTERN = re.compile(r"vpid = (\d+)")
+VTID_PATTERN = re.compile(r"vtid = (\d+)")
+PROCNAME_PATTERN = re.compile(r'procname = "([^"]*)"')
+CALLBACK_PATTERN = re.compile(r"callback = (0x[0-9A-Fa-f]+)")
+
+# Initialization events which name the nodes and callbacks, see `CallbackRegistry`
+REGISTRY_EVENTS = {
+    "ros2:rcl_node_init",
+    "ros2:rcl_subscription_init",
+    "ros2:rclcpp_subscription_init",
+    "ros2:rclcpp_subscription_callback_added",
+    "ros2:rcl_service_init",
+    "ros2:rclcpp_service_callback_added",
+    "ros2:rcl_timer_init",
+    "ros2:rclcpp_timer_callback_added",
+    "ros2:rclcpp_timer_link_node",
+    "ros2:rclcpp_callback_register",
+}
+
+
+def live_session_url(session_name, hostname=None, relay="localhost"):
+    hostname = hostname or subprocess.getoutput("hostname")
+    return f"net://{relay}/host/{hostname}/{session_name}"
+
+
+def duration_bin(duration):
+    """
+    Histogram bin of a duration in ns: four bins per power of two, so the
+    percentiles are exact to 1/8 of the value.
+    """
+    if duration < 4:
+        return max(duration, 0)
+    bits = duration.bit_length()
+    return bits * 4 + ((duration >> (bits - 3)) & 3)
+
+
+def bin_value(number):
+    """The center of a histogram bin, see `duration_bin`."""
+    if number < 4:
+        return number
+    bits, mantissa = divmod(number, 4)
+    lower = (4 + mantissa) << (bits - 3)
+    return lower + (1 << (bits - 3)) // 2
+
+
+class DurationStatistics:
+    """Count, sum, minimum, maximum and histogram of durations in ns."""
+
+    __slots__ = ("count", "total", "minimum", "maximum", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self.histogram = {}
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if self.minimum is None or duration < self.minimum:
+            self.minimum = duration
+        if self.maximum is None or duration > self.maximum:
+            self.maximum = duration
+        number = duration_bin(duration)
+        self.histogram[number] = self.histogram.get(number, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        if other.minimum is not None and (self.minimum is None or other.minimum < self.minimum):
+            self.minimum = other.minimum
+        if other.maximum is not None and (self.maximum is None or other.maximum > self.maximum):
+            self.maximum = other.maximum
+        for number, count in other.histogram.items():
+            self.histogram[number] = self.histogram.get(number, 0) + count
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for number in sorted(self.histogram):
+            seen += self.histogram[number]
+            if seen >= rank:
+                return min(max(bin_value(number), self.minimum), self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.minimum,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.maximum,
+        }
+
+
+class RollingStatistics:
+    """
+    Event counts and callback durations over the last `window` seconds, in
+    one slot per second of trace time. Old slots are dropped as the trace time
+    advances.
+    """
+
+    def __init__(self, window=WINDOW_SECONDS, max_keys=MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self.slots = deque()
+        self.slot_end = None
+        self.events = None
+        self.durations = None
+        self.keys = set()
+
+    def advance(self, timestamp):
+        """Start the slot of `timestamp` and drop the slots outside of the window."""
+        start = timestamp - timestamp % NS_PER_SECOND
+        self.events = {}
+        self.durations = {}
+        self.slots.append((start, self.events, self.durations))
+        self.slot_end = start + NS_PER_SECOND
+        while self.slots[0][0] <= start - self.window * NS_PER_SECOND:
+            self.slots.popleft()
+        if len(self.keys) > self.max_keys:
+            self.keys = {key for _, _, durations in self.slots for key in durations}
+
+    def add_duration(self, key, duration):
+        statistics = self.durations.get(key)
+        if statistics is None:
+            if key not in self.keys and len(self.keys) >= self.max_keys:
+                key = OTHER_KEY
+            self.keys.add(key)
+            statistics = self.durations.get(key)
+            if statistics is None:
+                statistics = self.durations[key] = DurationStatistics()
+        statistics.add(duration)
+
+    def seconds(self):
+        """
+        The trace time covered by the window in seconds, from the first to the
+        current slot. Seconds without events have no slot but are covered.
+        """
+        if not self.slots:
+            return 0
+        return min((self.slots[-1][0] - self.slots[0][0]) // NS_PER_SECOND + 1, self.window)
+
+    def event_counts(self):
+        counts = {}
+        for _, events, _ in self.slots:
+            for key, count in events.items():
+                counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def duration_statistics(self):
+        merged = {}
+        for _, _, durations in self.slots:
+            for key, statistics in durations.items():
+                merged.setdefault(key, DurationStatistics()).merge(statistics)
+        return merged
+
+
+class CallbackRegistry:
+    """
+    Names of the nodes and callbacks, from the initialization events of the
+    trace. Handles are pointers and only unique within a process, so they
+    are stored per vpid.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.node_names = {}
+        self.owners = {}
+        self.labels = {}
+        self.subscriptions = {}
+        self.callbacks = {}
+        self.symbols = {}
+
+    def add(self, event):
+        vpid = event.get("vpid")
+        name = event["event"]
+        if name == "ros2:rcl_node_init":
+            node = f"{event['namespace'].rstrip('/')}/{event['node_name']}"
+            self.nodes[(vpid, event["node_handle"])] = node
+            self.node_names.setdefault(vpid, []).append(node)
+        elif name == "ros2:rcl_subscription_init":
+            self.owners[(vpid, event["subscription_handle"])] = event["node_handle"]
+            self.labels[(vpid, event["subscription_handle"])] = event["topic_name"]
+        elif name == "ros2:rclcpp_subscription_init":
+            self.subscriptions[(vpid, event["subscription"])] = event["subscription_handle"]
+        elif name == "ros2:rclcpp_subscription_callback_added":
+            handle = self.subscriptions.get((vpid, event["subscription"]))
+            self.callbacks[(vpid, event["callback"])] = handle
+        elif name == "ros2:rcl_service_init":
+            self.owners[(vpid, event["service_handle"])] = event["node_handle"]
+            self.labels[(vpid, event["service_handle"])] = event["service_name"]
+        elif name == "ros2:rclcpp_service_callback_added":
+            self.callbacks[(vpid, event["callback"])] = event["service_handle"]
+        elif name == "ros2:rcl_timer_init":
+            self.labels[(vpid, event["timer_handle"])] = f"timer {event['period'] / 1e6:g} ms"
+        elif name == "ros2:rclcpp_timer_callback_added":
+            self.callbacks[(vpid, event["callback"])] = event["timer_handle"]
+        elif name == "ros2:rclcpp_timer_link_node":
+            self.owners[(vpid, event["timer_handle"])] = event["node_handle"]
+        elif name == "ros2:rclcpp_callback_register":
+            self.symbols[(vpid, event["callback"])] = event["symbol"]
+
+    def process_name(self, vpid, procname=None):
+        names = self.node_names.get(vpid)
+        return ",".join(names) if names else (procname or str(vpid))
+
+    def callback_name(self, vpid, callback, procname=None):
+        """A tuple (node, label) naming a callback, the handle if it is unknown."""
+        handle = self.callbacks.get((vpid, callback))
+        node = self.nodes.get((vpid, self.owners.get((vpid, handle))))
+        label = self.labels.get((vpid, handle)) or self.symbols.get((vpid, callback)) or callback
+        return node or self.process_name(vpid, procname), label
+
+
+class LiveTraceConsumer:
+    """
+    Consumes the events of a live trace and keeps rolling statistics per node
+    (event rates) and per callback (call rates and durations).
+
+    Usage:
+        consumer = LiveTraceConsumer(live_session_url("ros2_tracer"))
+        consumer.start()
+        ...
+        print(consumer.snapshot())
+        consumer.stop()
+
+    :param url: The lttng-live URL of the session, see `live_session_url`
+    :param window: Length of the rolling window in seconds
+    :param base_date: Date of time of day only timestamps, see `TimestampDecoder`
+    :param latency_threshold: Optional callback duration in ns, `on_latency(vpid, callback, duration)`
+        is called for every callback running longer, e.g. to trigger a snapshot
+    """
+
+    def __init__(self, url=None, window=WINDOW_SECONDS, base_date=None, latency_threshold=None, on_latency=None):
+        self.url = url
+        self.latency_threshold = latency_threshold
+        self.on_latency = on_latency
+        self.statistics = RollingStatistics(window)
+        self.registry = CallbackRegistry()
+        self.decoder = TraceLineDecoder(base_date)
+        self.timestamps = TimestampDecoder(base_date)
+        self.procnames = {}
+        self.starts = {}
+        self.lock = threading.Lock()
+        self.total_events = 0
+        self.last_timestamp = None
+        self.unmatched_lines = 0
+        self.process = None
+        self.thread = None
+
+    def consume_lines(self, lines):
+        """Update the statistics with a block of babeltrace2 text lines."""
+        statistics = self.statistics
+        starts = self.starts
+        timestamps = self.timestamps
+        procnames = self.procnames
+        latency_threshold = self.latency_threshold
+        timestamp = None
+        count = 0
+        for line in lines:
+            timestamp_end = line.find("] (")
+            hostname_end = line.find(" ", line.find(") ", timestamp_end) + 2)
+            event_end = line.find(": ", hostname_end)
+            vpid = VPID_PATTERN.search(line, event_end)
+            if line[:1] != "[" or timestamp_end < 0 or hostname_end < 0 or event_end < 0 or vpid is None:
+                self.unmatched_lines += 1
+                continue
+            timestamp = timestamps.decode(line[1:timestamp_end])
+            if timestamp is None:
+                self.unmatched_lines += 1
+                continue
+            if statistics.slot_end is None or timestamp >= statistics.slot_end:
+                statistics.advance(timestamp)
+            count += 1
+
+            vpid = int(vpid.group(1))
+            if vpid not in procnames:
+                procname = PROCNAME_PATTERN.search(line, event_end)
+                procnames[vpid] = procname.group(1) if procname else None
+            events = statistics.events
+            events[vpid] = events.get(vpid, 0) + 1
+
+            event = line[hostname_end + 1:event_end]
+            if event == "ros2:callback_start":
+                vtid = VTID_PATTERN.search(line, event_end)
+                callback = CALLBACK_PATTERN.search(line, event_end)
+                if vtid and callback:
+                    starts[(vpid, vtid.group(1))] = (callback.group(1), timestamp)
+            elif event == "ros2:callback_end":
+                vtid = VTID_PATTERN.search(line, event_end)
+                start = starts.pop((vpid, vtid.group(1)), None) if vtid else None
+                callback = CALLBACK_PATTERN.search(line, event_end)
+                if start is not None and callback and start[0] == callback.group(1):
+                    duration = timestamp - start[1]
+                    statistics.add_duration((vpid, start[0]), duration)
+                    if latency_threshold is not None and duration > latency_threshold:
+                        self.on_latency(vpid, start[0], duration)
+            elif event in REGISTRY_EVENTS:
+                decoded = self.decoder.decode(line)
+                if decoded is not None:
+                    try:
+                        self.registry.add(decoded)
+                    except KeyError:
+                        pass
+        self.total_events += count
+        if timestamp is not None:
+            self.last_timestamp = timestamp
+
+    def consume(self, stream):
+        """
+        Consume a binary stream of babeltrace2 text output until it ends.
+        Whatever is available is read and processed as one block, so the
+        consumer catches up in large blocks when it falls behind.
+        """
+        read = getattr(stream, "read1", stream.read)
+        remainder = b""
+        while True:
+            data = read(READ_SIZE)
+            if not data:
+                break
+            data = remainder + data
+            end = data.rfind(b"\n") + 1
+            remainder = data[end:]
+            if end:
+                with self.lock:
+                    self.consume_lines(data[:end].decode(errors="replace").splitlines())
+        if remainder:
+            with self.lock:
+                self.consume_lines(remainder.decode(errors="replace").splitlines())
+
+    def run(self):
+        """Run `babeltrace2` on the live session and consume it until the session ends."""
+        self.process = subprocess.Popen(f"{LIVE_CONVERT_COMMAND} '{self.url}'", shell=True, stdout=subprocess.PIPE)
+        try:
+            self.consume(self.process.stdout)
+        finally:
+            self.process.stdout.close()
+            self.process.wait()
+
+    def start(self):
+        """Run the consumer in a background thread."""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """
+        Wait for the consumer to finish, after the session was stopped and
+        destroyed. `babeltrace2` is terminated if it does not end in time.
+        """
+        if self.thread is None:
+            return
+        self.thread.join(timeout)
+        if self.thread.is_alive() and self.process is not None:
+            self.process.terminate()
+            self.thread.join()
+
+    def snapshot(self):
+        """
+        :return: The current statistics as a dictionary:
+            `events_per_second`, `lag` (seconds between the last event and now),
+            `nodes` ({name: events per second}) and `callbacks` (a list of
+            dictionaries with node, callback, calls per second and the
+            duration statistics in ns)
+        """
+        with self.lock:
+            seconds = self.statistics.seconds() or 1
+            counts = self.statistics.event_counts()
+            durations = self.statistics.duration_statistics()
+            nodes = {}
+            for vpid, count in counts.items():
+                name = self.registry.process_name(vpid, self.procnames.get(vpid))
+                nodes[name] = nodes.get(name, 0) + count / seconds
+            callbacks = []
+            for (vpid, callback), statistics in durations.items():
+                node, label = self.registry.callback_name(vpid, callback, self.procnames.get(vpid)) if vpid is not None else ("", callback)
+                callbacks.append({"node": node, "callback": label, "calls_per_second": statistics.count / seconds, **statistics.summary()})
+            last_timestamp = self.last_timestamp
+        callbacks.sort(key=lambda callback: callback["calls_per_second"], reverse=True)
+        return {
+            "events": self.total_events,
+            "events_per_second": sum(nodes.values()),
+            "lag": None if last_timestamp is None else time.time() - last_timestamp / NS_PER_SECOND,
+            "nodes": dict(sorted(nodes.items(), key=lambda item: item[1], reverse=True)),
+            "callbacks": callbacks,
+        }
+
+
+def format_us(value):
+    return "-" if value is None else f"{value / 1000:.1f}"
+
+
+def print_snapshot(snapshot, limit=20, file=sys.stdout):
+    lag = "-" if snapshot["lag"] is None else f"{snapshot['lag']:.2f} s"
+    print(f"\n{snapshot['events_per_second']:.0f} events/s, {snapshot['events']} events, lag {lag}", file=file)
+    print(f"  {'node':<40} {'events/s':>10}", file=file)
+    for node, rate in list(snapshot["nodes"].items())[:limit]:
+        print(f"  {node:<40} {rate:>10.1f}", file=file)
+    print(f"  {'callback':<40} {'node':<24} {'calls/s':>8} {'mean':>8} {'p50':>8} {'p99':>8} {'max':>8} (us)", file=file)
+    for callback in snapshot["callbacks"][:limit]:
+        print(
+            f"  {str(callback['callback'])[:40]:<40} {str(callback['node'])[:24]:<24} {callback['calls_per_second']:>8.1f} "
+            f"{format_us(callback['mean']):>8} {format_us(callback['p50']):>8} {format_us(callback['p99']):>8} {format_us(callback['max']):>8}",
+            file=file,
+        )
+
+
+def report_periodically(consumer, interval, stop_event):
+    """Print a snapshot of `consumer` every `interval` seconds until `stop_event` is set."""
+    while not stop_event.wait(interval):
+        print_snapshot(consumer.snapshot())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print rolling node and callback statistics of a live ROS 2 trace")
+    parser.add_argument("url", help="lttng-live URL of the session, e.g. net://localhost/host/<hostname>/<session>, or - to read babeltrace2 text output from the standard input")
+    parser.add_argument("-i", "--interval", type=float, default=2.0, help="Seconds between two reports. Default is 2.")
+    parser.add_argument("-w", "--window", type=int, default=WINDOW_SECONDS, help=f"Length of the rolling window in seconds. Default is {WINDOW_SECONDS}.")
+    args = parser.parse_args()
+
+    consumer = LiveTraceConsumer(args.url, args.window)
+    stop_event = threading.Event()
+    reporter = threading.Thread(target=report_periodically, args=(consumer, args.interval, stop_event), daemon=True)
+    reporter.start()
+    try:
+        if args.url == "-":
+            consumer.consume(sys.stdin.buffer)
+        else:
+            consumer.run()
+    except KeyboardInterrupt:
+        pass
+    stop_event.set()
+    print_snapshot(consumer.snapshot())
+
+
+if __name__ == "__main__":
+    main()
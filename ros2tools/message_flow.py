@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+try:
+    from ros2tools.callback_analysis import open_columnar_trace, load_columns, group_boundaries, grouped_statistics
+    from ros2tools.util import read_json_file, write_json_file
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from callback_analysis import open_columnar_trace, load_columns, group_boundaries, grouped_statistics
+    from util import read_json_file, write_json_file
+
+
+# message_flow.py follows every message from `rclcpp_publish` in the publishing
+# node to the start of the subscription callback in the receiving node:
+#
+#   rclcpp_publish --(thread, message)--> rmw_publish
+#   rcl_publish --(thread, message)--> rmw_publish           (publisher handle)
+#   rmw_publish --(topic, source timestamp)--> rmw_take      (across processes)
+#   rmw_take --(thread, next callback)--> callback_start
+#
+# Every link is a join of two event columns on a key, computed with one sort of
+# both sides (`match_previous`), so matching is O(n log n) and not a search per
+# message. Topics and nodes come from the `rcl_publisher_init`,
+# `rcl_subscription_init` and `rcl_node_init` events, the per edge results use
+# the `source`/`target`/`topic` keys of the edges of `ROS2Tools.generate_graph`
+# (`graph.json` of `ros2-node-inspector`).
+
+RCLCPP_PUBLISH = "ros2:rclcpp_publish"
+RCL_PUBLISH = "ros2:rcl_publish"
+RMW_PUBLISH = "ros2:rmw_publish"
+RMW_TAKE = "ros2:rmw_take"
+CALLBACK_START = "ros2:callback_start"
+CALLBACK_END = "ros2:callback_end"
+LATENCY_SEGMENTS = ["publish", "transport", "dispatch", "total"]
+STATISTICS_COLUMNS = ["topic", "source", "target", "segment", "count", "mean", "min", "p50", "p90", "p99", "max"]
+
+
+def match_previous(keys_a, timestamps_a, keys_b, timestamps_b):
+    """
+    Join two event columns: for every event b the index of the latest event a
+    with equal keys and a timestamp not after b.
+
+    :param keys_a: List of key arrays of the events a
+    :param keys_b: List of key arrays of the events b, in the same order
+    :return: An int64 array with one index into a per event b, -1 if none matches
+    """
+    count_a = len(timestamps_a)
+    keys = [np.concatenate((key_a, key_b)) for key_a, key_b in zip(keys_a, keys_b)]
+    timestamps = np.concatenate((timestamps_a, timestamps_b))
+    is_b = np.concatenate((np.zeros(count_a, dtype=np.int8), np.ones(len(timestamps_b), dtype=np.int8)))
+    if len(timestamps) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Sorted by key and time, the match of a b is the last a of its key before it
+    order = np.lexsort([is_b, timestamps] + keys[::-1])
+    keys = [key[order] for key in keys]
+    positions = np.arange(len(order))
+    last_a = np.maximum.accumulate(np.where(order < count_a, positions, -1))
+    group_starts = group_boundaries(*keys)[:-1]
+    group_start = np.maximum.accumulate(np.isin(positions, group_starts, assume_unique=True) * positions)
+    matched = np.full(len(timestamps_b), -1, dtype=np.int64)
+    b_positions = np.flatnonzero(order >= count_a)
+    valid = last_a[b_positions] >= group_start[b_positions]
+    matched[order[b_positions] - count_a] = np.where(valid, order[np.maximum(last_a[b_positions], 0)], -1)
+    return matched
+
+
+def match_next(keys_a, timestamps_a, keys_b, timestamps_b):
+    """For every event b the index of the earliest event a with equal keys and a timestamp not before b, see `match_previous`."""
+    return match_previous(keys_a, -np.asarray(timestamps_a), keys_b, -np.asarray(timestamps_b))
+
+
+def load_topics(trace):
+    """
+    The topics and node names of the publishers and subscriptions.
+
+    :return: A tuple of two dictionaries (publishers, subscriptions), keyed by
+        (vpid, rcl publisher handle) and (vpid, rmw publisher handle), and by
+        (vpid, rmw subscription handle), with (topic, node) values
+    """
+    nodes = {}
+    if trace.length("ros2:rcl_node_init"):
+        columns = trace.load("ros2:rcl_node_init", ["vpid", "node_handle", "namespace", "node_name"])
+        for vpid, handle, namespace, name in zip(*(columns[column].tolist() for column in ["vpid", "node_handle", "namespace", "node_name"])):
+            nodes[(vpid, handle)] = f"{namespace.rstrip('/')}/{name}"
+
+    def endpoints(event, *handle_columns):
+        if not trace.length(event):
+            return {}
+        columns = load_columns(trace, event, ["vpid", "node_handle", *handle_columns])
+        topics = trace.column(event, "topic_name").tolist()
+        result = {}
+        # rcl and rmw handles are different allocations, they do not collide within a process
+        for handle_column in handle_columns:
+            for vpid, handle, node_handle, topic in zip(columns["vpid"].tolist(), columns[handle_column].tolist(), columns["node_handle"].tolist(), topics):
+                if handle:
+                    result[(vpid, handle)] = (topic, nodes.get((vpid, node_handle), str(vpid)))
+        return result
+
+    return endpoints("ros2:rcl_publisher_init", "publisher_handle", "rmw_publisher_handle"), endpoints("ros2:rcl_subscription_init", "rmw_subscription_handle")
+
+
+def endpoint_codes(vpids, handles, endpoints, names):
+    """
+    Map the (vpid, handle) of every event to an index into `names`, a
+    dictionary of (topic, node) tuples to indexes which grows with new
+    endpoints; -1 for unknown handles.
+    """
+    if not len(vpids):
+        return np.zeros(0, dtype=np.int64)
+    pairs, inverse = np.unique(np.stack((vpids.astype(np.uint64), handles.astype(np.uint64))), axis=1, return_inverse=True)
+    pair_codes = np.full(pairs.shape[1], -1, dtype=np.int64)
+    for number, (vpid, handle) in enumerate(zip(*pairs.tolist())):
+        endpoint = endpoints.get((vpid, handle))
+        if endpoint is not None:
+            pair_codes[number] = names.setdefault(endpoint, len(names))
+    return pair_codes[inverse.reshape(-1)]
+
+
+def match_messages(trace):
+    """
+    Follow the messages from publish to subscription callback.
+
+    Traces from ROS 2 Iron on record the source timestamp of every message in
+    `rmw_publish` and `rmw_take`, and messages are matched exactly on it. On
+    older distributions a take is matched with the latest publish on the same
+    topic, which is correct as long as messages on a topic do not overtake each
+    other. Intra-process messages do not pass rmw and are not matched.
+
+    The publisher of a message is the `publisher_handle` of `rcl_publish`, or
+    the `rmw_publisher_handle` of `rmw_publish` on Iron and later. rclcpp
+    passes no handle to `rclcpp_publish`, it is only used as a fallback.
+
+    :return: A dictionary of arrays with one entry per delivered message:
+        the topic index into `topics`, the publishing and subscribing endpoint
+        indexes into `endpoints` (a list of (topic, node) tuples) and the
+        timestamps of every event, -1 for a callback end which is missing
+    """
+    publishes = load_columns(trace, RCLCPP_PUBLISH, ["timestamp", "vpid", "vtid", "publisher_handle", "message"])
+    rcl_publishes = load_columns(trace, RCL_PUBLISH, ["timestamp", "vpid", "vtid", "publisher_handle", "message"])
+    rmw_publishes = load_columns(trace, RMW_PUBLISH, ["timestamp", "vpid", "vtid", "message", "payload_timestamp", "rmw_publisher_handle"])
+    takes = load_columns(trace, RMW_TAKE, ["timestamp", "vpid", "vtid", "rmw_subscription_handle", "source_timestamp", "taken"])
+    callbacks = load_columns(trace, CALLBACK_START, ["timestamp", "vpid", "vtid", "callback"])
+    callback_ends = load_columns(trace, CALLBACK_END, ["timestamp", "vpid", "vtid", "callback"])
+    exact = trace.has_column(RMW_PUBLISH, "payload_timestamp")
+
+    def thread_message(columns):
+        return [columns["vpid"], columns["vtid"], columns["message"].astype(np.uint64)]
+
+    def linked(column, index, default):
+        """The values of `column` at the indexes `index`, `default` where an index is -1."""
+        if not len(column):
+            return np.broadcast_to(default, index.shape).copy()
+        return np.where(index >= 0, column[np.maximum(index, 0)], default)
+
+    # rclcpp_publish and rcl_publish -> rmw_publish: the same message pointer on the same thread
+    publish_of_rmw = match_previous(thread_message(publishes), publishes["timestamp"], thread_message(rmw_publishes), rmw_publishes["timestamp"])
+    rcl_of_rmw = match_previous(thread_message(rcl_publishes), rcl_publishes["timestamp"], thread_message(rmw_publishes), rmw_publishes["timestamp"])
+
+    # The publisher from rcl_publish, rmw_publish (Iron and later) or rclcpp_publish
+    endpoints = {}
+    publisher_topics, subscription_topics = load_topics(trace)
+    publishers = np.full(len(rmw_publishes["timestamp"]), -1, dtype=np.int64)
+    for handles in (
+        linked(publishes["publisher_handle"].astype(np.uint64), publish_of_rmw, 0),
+        rmw_publishes["rmw_publisher_handle"].astype(np.uint64),
+        linked(rcl_publishes["publisher_handle"].astype(np.uint64), rcl_of_rmw, 0),
+    ):
+        codes = endpoint_codes(rmw_publishes["vpid"], handles, publisher_topics, endpoints)
+        publishers = np.where(codes >= 0, codes, publishers)
+    # The publish starts at rclcpp_publish, or at rcl_publish without rclcpp (e.g. rclpy)
+    publish_times = linked(publishes["timestamp"], publish_of_rmw, linked(rcl_publishes["timestamp"], rcl_of_rmw, rmw_publishes["timestamp"]))
+    known = publishers >= 0
+    rmw_publishes = {name: values[known] for name, values in rmw_publishes.items()}
+    publishers, publish_times = publishers[known], publish_times[known]
+    subscriptions = endpoint_codes(takes["vpid"], takes["rmw_subscription_handle"], subscription_topics, endpoints)
+    names = list(endpoints)
+    topics = sorted({topic for topic, _ in names})
+    # The topic index of every endpoint, with -1 for the unknown endpoint -1 at the end
+    code_topics = np.array([topics.index(topic) for topic, _ in names] + [-1], dtype=np.int64)
+    publish_topics = code_topics[publishers]
+    take_topics = code_topics[subscriptions]
+
+    # rmw_publish -> rmw_take: the topic and source timestamp, across processes
+    taken = (takes["taken"] != 0) if trace.has_column(RMW_TAKE, "taken") else np.ones(len(takes["timestamp"]), dtype=bool)
+    taken &= take_topics >= 0
+    if exact:
+        rmw_of_take = match_previous(
+            [publish_topics, rmw_publishes["payload_timestamp"]], np.zeros(len(publish_topics), dtype=np.int64),
+            [take_topics, takes["source_timestamp"]], np.zeros(len(take_topics), dtype=np.int64),
+        )
+    else:
+        rmw_of_take = match_previous([publish_topics], rmw_publishes["timestamp"], [take_topics], takes["timestamp"])
+    delivered = taken & (rmw_of_take >= 0)
+
+    # rmw_take -> callback_start: the next callback on the thread which took the message
+    callback_of_take = match_next(
+        [callbacks["vpid"], callbacks["vtid"]], callbacks["timestamp"],
+        [takes["vpid"], takes["vtid"]], takes["timestamp"],
+    )
+    delivered &= callback_of_take >= 0
+
+    # callback_start -> callback_end: the next end of the same callback on the thread
+    callback = callback_of_take[delivered]
+    end_of_callback = match_next(
+        [callback_ends["vpid"], callback_ends["vtid"], callback_ends["callback"]], callback_ends["timestamp"],
+        [callbacks["vpid"][callback], callbacks["vtid"][callback], callbacks["callback"][callback]], callbacks["timestamp"][callback],
+    )
+
+    ends = np.full(len(callback), -1, dtype=np.int64)
+    ends[end_of_callback >= 0] = callback_ends["timestamp"][end_of_callback[end_of_callback >= 0]]
+
+    rmw = rmw_of_take[delivered]
+    return {
+        "endpoints": names,
+        "topics": topics,
+        "topic": take_topics[delivered],
+        "publisher": publishers[rmw],
+        "subscription": subscriptions[delivered],
+        "publish": publish_times[rmw],
+        "rmw_publish": rmw_publishes["timestamp"][rmw],
+        "take": takes["timestamp"][delivered],
+        "callback_start": callbacks["timestamp"][callback],
+        "callback_end": ends,
+        "exact": exact,
+        "unmatched_takes": int(np.count_nonzero(taken & ~delivered)),
+    }
+
+
+def analyze_message_flow(trace):
+    """
+    Latency distributions of the messages per topic and per publisher and
+    subscriber node, split into the segments:
+        publish     rclcpp_publish to rmw_publish
+        transport   rmw_publish to rmw_take
+        dispatch    rmw_take to callback_start
+        total       rclcpp_publish to callback_start
+
+    :param trace: A `ColumnarTrace`, see `open_columnar_trace`
+    :return: A dictionary with the per topic (`topics`) and per edge (`edges`)
+        statistics and the number of matched messages
+    """
+    messages = match_messages(trace)
+    names = messages["endpoints"]
+    segments = {
+        "publish": messages["rmw_publish"] - messages["publish"],
+        "transport": messages["take"] - messages["rmw_publish"],
+        "dispatch": messages["callback_start"] - messages["take"],
+        "total": messages["callback_start"] - messages["publish"],
+    }
+
+    def statistics_of(group_keys, describe):
+        order = np.lexsort(group_keys[::-1])
+        sorted_keys = [key[order] for key in group_keys]
+        boundaries = group_boundaries(*sorted_keys)
+        results = [describe(*(int(key[start]) for key in sorted_keys)) for start in boundaries[:-1]]
+        for segment in LATENCY_SEGMENTS:
+            values = segments[segment][order]
+            # Sort by value within every group for the percentiles
+            values = values[np.lexsort([values] + sorted_keys[::-1])]
+            for result, statistics in zip(results, grouped_rows(grouped_statistics(values, boundaries))):
+                result[segment] = statistics
+        return results
+
+    def describe_topic(topic):
+        return {"topic": messages["topics"][topic]}
+
+    def describe_edge(topic, publisher, subscription):
+        return {"source": names[publisher][1], "target": names[subscription][1], "topic": names[subscription][0]}
+
+    topics = statistics_of([messages["topic"]], describe_topic)
+    edges = statistics_of([messages["topic"], messages["publisher"], messages["subscription"]], describe_edge)
+    return {
+        "messages": len(messages["take"]),
+        "unmatched_takes": messages["unmatched_takes"],
+        "exact": messages["exact"],
+        "topics": sorted(topics, key=lambda result: result["topic"]),
+        "edges": sorted(edges, key=lambda result: (result["topic"], result["source"], result["target"])),
+    }
+
+
+def grouped_rows(statistics):
+    """The columns of `grouped_statistics` as one dictionary of plain values per group."""
+    names = [name for name in statistics if name != "total"]
+    return [dict(zip(names, row)) for row in zip(*(statistics[name].tolist() for name in names))]
+
+
+def annotate_graph(graph, analysis, segment="total"):
+    """
+    Add the latency statistics of `segment` to the matching edges of a topic
+    graph of `ROS2Tools.generate_graph`, as the key `latency`.
+    """
+    latencies = {(edge["source"], edge["target"], edge["topic"]): edge[segment] for edge in analysis["edges"]}
+    for edge in graph["edges"]:
+        latency = latencies.get((edge["source"], edge["target"], edge["topic"]))
+        if latency is not None:
+            edge["latency"] = latency
+    return graph
+
+
+def write_flow_csv(analysis, output_file):
+    """Write the statistics of every topic and edge as CSV, one row per segment."""
+    with open(output_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=STATISTICS_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        for result in analysis["topics"] + analysis["edges"]:
+            for segment in LATENCY_SEGMENTS:
+                writer.writerow({**result, **result[segment], "segment": segment})
+    print(f"Message flow written to {output_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish to subscription callback latencies of the messages of a converted ROS 2 trace")
+    parser.add_argument("trace_file", nargs="?", default="trace.npz", help="trace.npz, or trace.ndjson/trace.json (slower, converted to columns first). Default is trace.npz.")
+    parser.add_argument("-o", "--output", default="message_flow", help="Output file name without extension, .json and .csv are written. Default is message_flow.")
+    parser.add_argument("--graph", help="graph.json of ros2-node-inspector, written to <output>_graph.json with the total latency of every edge")
+    parser.add_argument("--pretty", action="store_true", help="Write indented JSON, the output is compact by default.")
+    args = parser.parse_args()
+
+    trace = open_columnar_trace(args.trace_file)
+    analysis = analyze_message_flow(trace)
+    trace.close()
+    write_json_file(f"{args.output}.json", analysis, args.pretty)
+    write_flow_csv(analysis, f"{args.output}.csv")
+    if args.graph:
+        graph = annotate_graph(read_json_file(args.graph), analysis)
+        write_json_file(f"{args.output}_graph.json", graph, args.pretty)
+    matching = "source timestamps" if analysis["exact"] else "latest publish per topic"
+    print(f"{analysis['messages']} messages on {len(analysis['topics'])} topics matched by {matching}, {analysis['unmatched_takes']} takes unmatched")
+
+
+if __name__ == "__main__":
+    main()
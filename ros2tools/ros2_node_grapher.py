@@ -1,10 +1,16 @@
 import os
-import json
+import sys
 import networkx as nx
 import plotly.graph_objects as go
 import graphviz
 import numpy as np
 
+try:
+    from ros2tools.util import read_json_file
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from util import read_json_file
+
 OUTPUT_DIRECTORY = os.environ.get('ROS_HOME', '.') + "/ros2_node_inspector"
 
 
@@ -19,8 +25,7 @@ class ROS2NodeGrapher:
         self._load_graph_data()
 
     def _load_graph_data(self):
-        with open(self.graph_json_file, 'r') as file:
-            graph_data = json.load(file)
+        graph_data = read_json_file(self.graph_json_file)
         print(f"Graph: {self.graph_json_file} loaded")
 
         for node in graph_data['nodes']:
@@ -59,11 +59,12 @@ def sanitize_filename(node_name):
 
 def load_node_summaries(output_dir):
     node_summaries = []
+    excluded = [os.path.basename(GRAPH_JSON_FILE), NODES_JSON_FILE, DATATYPES_JSON_FILE, NODE_SUMMARIES_JSON_FILE]
     for filename in os.listdir(output_dir):
-        if filename.endswith('.json') and filename not in [GRAPH_JSON_FILE, NODES_JSON_FILE, DATATYPES_JSON_FILE]:
+        name = filename[:len(filename) - len(compression_extension(filename))]
+        if name.endswith('.json') and name not in excluded:
             filepath = os.path.join(output_dir, filename)
-            with open(filepath, 'r') as f:
-                node_summaries.append(json.load(f))
+            node_summaries.append(read_json_file(filepath))
     return node_summaries
 
 def main():
@@ -97,8 +98,16 @@ def main():
     parser.add_argument('node_name', nargs='?', help='Name of the ROS 2 node to inspect (optional)')
     parser.add_argument('-o', '--output-json-file', help='Optional output JSON file')
     parser.add_argument('-l', '--load-node-summaries', action='store_true', help='Load existing node summaries from output directory')
+    parser.add_argument('--pretty', action='store_true', help='Write indented JSON, the output is compact by default')
+    parser.add_argument('-z', '--compress', choices=sorted(COMPRESSION_EXTENSIONS), help='Compress the JSON output with gzip (gz) or zstd (zst, requires the zstandard package)')
     
     args = parser.parse_args()
+    suffix = COMPRESSION_EXTENSIONS[args.compress] if args.compress else ""
+
+    def write_output(output_file, data):
+        if not compression_extension(output_file):
+            output_file += suffix
+        write_json_file(output_file, data, pretty=args.pretty)
 
 
     output_dir = OUTPUT_DIRECTORY
@@ -121,7 +130,7 @@ def main():
             sys.exit(1)
 
         node_summary = ROS2Tools.get_node_summary(node_name)
-        write_json_file(output_file, node_summary)
+        write_output(output_file, node_summary)
         node_summaries.append(node_summary)
     
     else:
@@ -137,7 +146,7 @@ def main():
             
             node_summary = ROS2Tools.get_node_summary(node_name)
             node_summaries.append(node_summary)
-            write_json_file(output_file, node_summary)
+            write_output(output_file, node_summary)
 
     datatypes = []
     for node in node_summaries:
@@ -152,20 +161,20 @@ def main():
 
     output_file = os.path.join(output_dir, GRAPH_JSON_FILE)
     graph = ROS2Tools.generate_graph(node_summaries) 
-    write_json_file(output_file, graph)
+    write_output(output_file, graph)
 
     output_file = os.path.join(output_dir, NODE_SUMMARIES_JSON_FILE)
-    write_json_file(output_file, node_summaries)
+    write_output(output_file, node_summaries)
 
     nodes = node_summaries
     nodes = delete_key_recursive(delete_key_recursive(node, "interface"), "interface_text")
     output_file = os.path.join(output_dir, NODES_JSON_FILE)
-    write_json_file(output_file, nodes)
+    write_output(output_file, nodes)
     
     output_file = os.path.join(output_dir, DATATYPES_JSON_FILE)
-    write_json_file(output_file, datatypes)
+    write_output(output_file, datatypes)
     
-    grapher = ROS2NodeGrapher(GRAPH_JSON_FILE)
+    grapher = ROS2NodeGrapher(GRAPH_JSON_FILE + suffix)
     grapher.create_graph()
     grapher.create_directed_graph()
     grapher.generate_dot_graph()
@@ -2,17 +2,44 @@
 
 import argparse
 import os
+import re
 import sys
 import time
 import shutil
+import signal
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tracetools_analysis.loading import load_file
 
 try:
     from ros2_tools.util import *
+    from ros2_tools.trace_converter import *
+    from ros2_tools.trace_columns import *
+    from ros2_tools.ctf_reader import *
+    from ros2_tools.trace_filter import *
+    from ros2_tools.trace_checkpoint import *
+    from ros2_tools.trace_index import *
+    from ros2_tools.stage_scheduler import *
+    from ros2_tools.live_trace import *
+    from ros2_tools.trace_profiles import *
+    from ros2_tools.trace_compare import *
+    from ros2_tools.trace_export import *
 except ImportError:
     sys.path.append(os.path.join(os.path.dirname(__file__), "."))
     from util import *
     from trace_converter import *
+    from trace_columns import *
+    from ctf_reader import *
+    from trace_filter import *
+    from trace_checkpoint import *
+    from trace_index import *
+    from stage_scheduler import *
+    from live_trace import *
+    from trace_profiles import *
+    from trace_compare import *
+    from trace_export import *
 
 SESSION_NAME = "ros2_tracer"
 START_TRACER_COMMAND = f"ros2 trace -a start {SESSION_NAME}"
@@ -23,31 +50,80 @@ OUTPUT_DIRECTORY = TRACING_DIRECTORY + SESSION_NAME
 LTTNG_OUTPUT_DIRECTORY = OUTPUT_DIRECTORY + "/lttng-traces"
 TRACE_LOG_FILE = f"trace.log"
 OUTPUT_JSON_FILE = f"{OUTPUT_DIRECTORY}/trace.json"
-BABEL_TRACE_CONVERT_COMMAND = (
-    f"cd {OUTPUT_DIRECTORY} && babeltrace2 . > {TRACE_LOG_FILE}"
-)
+OUTPUT_NDJSON_FILE = f"{OUTPUT_DIRECTORY}/trace.ndjson"
+OUTPUT_COLUMNS_FILE = f"{OUTPUT_DIRECTORY}/trace.npz"
+OUTPUT_CHECKPOINT_FILE = f"{OUTPUT_DIRECTORY}/trace.checkpoint.json"
+OUTPUT_CTF_DIRECTORY = f"{OUTPUT_DIRECTORY}/trace.ctf"
+# The CTF copy is written outside of OUTPUT_DIRECTORY and moved into place when
+# `ros2 trace-analysis`, which reads all traces below OUTPUT_DIRECTORY, is done
+OUTPUT_CTF_TEMPORARY_DIRECTORY = f"{TRACING_DIRECTORY}.{SESSION_NAME}.ctf"
+# --clock-seconds prints absolute seconds since the Unix epoch, which decode
+# to exact nanoseconds independent of the date of the conversion
+BABEL_TRACE_CONVERT_COMMAND = "babeltrace2 --clock-seconds"
 BABEL_TRACE_CONVERT_COMMAND_LTTNG = (
-    f"cd {OUTPUT_DIRECTORY} && babeltrace2 ./lttng-traces > {TRACE_LOG_FILE}"
+    f"cd {OUTPUT_DIRECTORY} && babeltrace2 --clock-seconds ./lttng-traces > {TRACE_LOG_FILE}"
 )
 TRACE_LOG_FILE = f"{OUTPUT_DIRECTORY}/{TRACE_LOG_FILE}"
-BABEL_TRACE_CONVERT_CTF_COMMAND = f"cd {OUTPUT_DIRECTORY} && babeltrace2 convert --output-format=ctf  --output trace.ctf ."
+# Native conversion with the `sink.ros2observer.ndjson` component of the plugin in
+# plugin/, babeltrace2 finds it through BABELTRACE_PLUGIN_PATH
+NDJSON_SINK_COMPONENT = "sink.ros2observer.ndjson"
+NDJSON_SINK_CHECK_COMMAND = f"babeltrace2 help {NDJSON_SINK_COMPONENT}"
+BABEL_TRACE_CONVERT_CTF_COMMAND = "babeltrace2 convert --output-format=ctf"
 BABEL_TRACE_LTTNG_CONVERT_CTF_COMMAND = f"cd {OUTPUT_DIRECTORY} && babeltrace2 convert --output-format=ctf  --output trace.ctf ."
-ROS2_TRACE_ANALYSIS_COMMAND = f"ros2 trace-analysis process {OUTPUT_DIRECTORY}"
+ROS2_TRACE_ANALYSIS_COMMAND = f"ros2 trace-analysis process --force-conversion {OUTPUT_DIRECTORY}"
+# The post processing stages only read the raw trace and run concurrently
+STAGE_WORKERS = 3
+# Seconds between two reports of the live statistics
+LIVE_STATISTICS_INTERVAL = 5
+# Tracing profile of live and snapshot sessions, see trace_profiles.py. Timed
+# sessions use `ros2 trace -a` unless a profile is selected
+LIVE_PROFILE = "ros2"
+# Rotation mode: the session is rotated every --rotate seconds, every archived
+# trace chunk is converted and indexed in the background while tracing goes on
+ROTATE_ARCHIVE_PATTERN = re.compile(r"readable at (\S+)")
+CHUNK_WORKERS = 2
+# Flight recorder mode: the events are kept in per CPU ring buffers of
+# SNAPSHOT_NUM_SUBBUF sub-buffers of SNAPSHOT_SUBBUF_SIZE and only dumped and
+# converted on a trigger, the last SNAPSHOT_SECONDS of every dump are kept
+SNAPSHOT_SESSION_NAME = f"{SESSION_NAME}_snapshot"
+SNAPSHOT_TRIGGER_SESSION_NAME = f"{SESSION_NAME}_trigger"
+SNAPSHOT_DIRECTORY = TRACING_DIRECTORY + SNAPSHOT_SESSION_NAME
+SNAPSHOT_PID_FILE = f"{SNAPSHOT_DIRECTORY}/snapshot.pid"
+SNAPSHOT_SUBBUF_SIZE = "1M"
+SNAPSHOT_NUM_SUBBUF = 8
+SNAPSHOT_SECONDS = 10
+# Minimum seconds between two snapshots triggered by the callback latency
+SNAPSHOT_COOLDOWN = 30
+# The live session watching the callback latency only records the callbacks
+SNAPSHOT_TRIGGER_PROFILE = "minimal"
 
 check_command_installed("babeltrace2")
 check_command_installed("ros2")
 
 
-def start_tracing():
+def start_tracing(profile=None):
+    """
+    Start the tracing session, with `ros2 trace -a` or the events, buffers and
+    contexts of the named `profile`, see TRACE_PROFILES.
+    """
     if os.path.exists(OUTPUT_DIRECTORY):
         raise Exception(
             f"ERROR: The tracing output directory: {OUTPUT_DIRECTORY} already exists!"
         )
-    run_command(START_TRACER_COMMAND)
+    if profile:
+        configure_session(get_profile(profile), SESSION_NAME, f"--output={OUTPUT_DIRECTORY}")
+        run_command(f"lttng start {SESSION_NAME}", echo=True, echo_out=True)
+    else:
+        run_command(START_TRACER_COMMAND)
     print("Tracing started")
 
-def start_live_trace(session_name, output_dir):
-    """Starts a live trace session using LTTng, with a specified output directory."""
+def start_live_trace(session_name, output_dir, statistics_interval=LIVE_STATISTICS_INTERVAL, profile=LIVE_PROFILE):
+    """
+    Starts a live trace session using LTTng, with a specified output directory.
+    While the session runs its events are consumed by a `LiveTraceConsumer`,
+    which prints rolling node and callback statistics every
+    `statistics_interval` seconds.
+    """
     if not session_name:
         print("Provide trace session name")
         return
@@ -61,58 +137,406 @@ def start_live_trace(session_name, output_dir):
     run_command(f"mkdir -p {output_dir}")
     run_command("lttng-relayd --daemonize || true")
     time.sleep(1)
-    run_command(f"lttng create {session_name} --live", echo=True, echo_out=True)
-    run_command("lttng enable-channel -u ros --subbuf-size=8M", echo=True, echo_out=True)
-    run_command("lttng enable-event -c ros -u 'ros2:*'", echo=True, echo_out=True)
-    run_command("lttng add-context -u -t vtid -t vpid -t procname", echo=True, echo_out=True)
+    configure_session(get_profile(profile), session_name, "--live")
     run_command("lttng start", echo=True, echo_out=True)
     time.sleep(2)
-    run_command("babeltrace2 --input-format=lttng-live net://localhost", echo=True, echo_out=True)
-    print(f"\nLive trace URI: net://localhost/host/{hostname}/{session_name}")
-    print(f"\n    To monitor this trace use: 'babeltrace2 --input-format=lttng-live net://localhost/host/{hostname}/{session_name}'")
+    url = live_session_url(session_name, hostname)
+    print(f"\nLive trace URI: {url}")
+    print(f"\n    To monitor this trace use: 'babeltrace2 --input-format=lttng-live {url}'")
+    consumer = LiveTraceConsumer(url)
+    consumer.start()
+    stop_event = threading.Event()
+    reporter = threading.Thread(target=report_periodically, args=(consumer, statistics_interval, stop_event), daemon=True)
+    reporter.start()
     print("Press any key to stop & destroy")
     input()
+    stop_event.set()
     run_command("lttng stop")
     run_command("lttng destroy")
+    consumer.stop()
+    print_snapshot(consumer.snapshot())
     run_command(f"cp -r ~/lttng-traces {output_dir}")
     run_command(f"rm -rf ~/lttng-traces")
 
-def stop_tracing():
+def stop_tracing(**options):
     run_command(STOP_TRACER_COMMAND)
     print("Tracing stopped")
-    process_trace()
+    process_trace(**options)
 
 
-def timed_trace(seconds):
-    start_tracing()
+def timed_trace(seconds, profile=None, **options):
+    start_tracing(profile)
     for remaining in range(seconds, 0, -1):
         print(f"Tracer will stop in {remaining} seconds...")
         time.sleep(1)
-    stop_tracing()
+    stop_tracing(**options)
 
 
-def process_trace():
-    print(f"Post processing trace in: {OUTPUT_DIRECTORY}")
-    run_command(ROS2_TRACE_ANALYSIS_COMMAND)
-    run_command(BABEL_TRACE_CONVERT_COMMAND)
-    run_command(BABEL_TRACE_CONVERT_CTF_COMMAND)
-    write_json_file(OUTPUT_JSON_FILE, trace_log_to_dict(f"{TRACE_LOG_FILE}"))
+def rotate_session(session_name=SESSION_NAME):
+    """
+    Rotate the session: the events recorded since the last rotation are
+    archived as a trace chunk below archives/.
+
+    :return: The directory of the archived chunk, None if the rotation failed
+    """
+    stdout, stderr = run_command(f"lttng rotate {session_name}", timeout=None)
+    match = ROTATE_ARCHIVE_PATTERN.search(stdout)
+    if match is None:
+        print(f"ERROR: The rotation of {session_name} failed: {stderr or stdout}", file=sys.stderr)
+        return None
+    return match.group(1)
+
+
+def process_chunk(directory, jobs=1, text_log=False, selector=None, **options):
+    """Convert and index an archived trace chunk into its directory, see `convert_trace`."""
+    convert_trace(jobs=jobs, text_log=text_log, selector=selector, directory=directory)
+    return directory
+
+
+def rotating_trace(seconds, rotate_seconds, profile=None, chunk_workers=CHUNK_WORKERS, jobs=1, **options):
+    """
+    Trace for `seconds` and rotate the session every `rotate_seconds`. The
+    archived chunks are converted and indexed by `chunk_workers` background
+    workers while tracing goes on, so after the stop only the last chunk is
+    left to convert. The chunks are listed in chunks.json and are read as one
+    trace by `ChunkedTraceReader`.
+    """
+    start_tracing(profile)
+    chunk_jobs = max(1, jobs // chunk_workers)
+    chunks = []
+    with ThreadPoolExecutor(max_workers=chunk_workers) as executor:
+        start = time.monotonic()
+        next_rotation = start + rotate_seconds
+        for remaining in range(seconds, 0, -1):
+            print(f"Tracer will stop in {remaining} seconds...")
+            time.sleep(max(0, start + seconds - remaining + 1 - time.monotonic()))
+            if time.monotonic() >= next_rotation and remaining > 1:
+                next_rotation += rotate_seconds
+                chunk = rotate_session()
+                if chunk:
+                    print(f"Trace chunk {chunk} archived")
+                    chunks.append(executor.submit(process_chunk, chunk, jobs=chunk_jobs, **options))
+        run_command(f"lttng stop {SESSION_NAME}", timeout=None)
+        chunk = rotate_session()
+        run_command(f"lttng destroy {SESSION_NAME}", timeout=None)
+        print("Tracing stopped")
+        if chunk:
+            chunks.append(executor.submit(process_chunk, chunk, jobs=jobs, **options))
+        directories = [future.result() for future in chunks]
+    write_chunk_manifest(OUTPUT_DIRECTORY, [trace_output(directory, OUTPUT_NDJSON_FILE) for directory in directories])
+
+
+def native_plugin_available():
+    """Checks if babeltrace2 finds the `sink.ros2observer.ndjson` component class."""
+    result = subprocess.run(NDJSON_SINK_CHECK_COMMAND, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+
+def trace_output(directory, output_file):
+    """The path of an output file such as OUTPUT_NDJSON_FILE in another trace directory."""
+    return os.path.join(directory, os.path.basename(output_file))
+
+
+def quoted_traces(directory=OUTPUT_DIRECTORY):
+    return " ".join(f"'{trace}'" for trace in find_ctf_traces(directory))
+
+
+def native_convert_command(output_file, selector=None, directory=OUTPUT_DIRECTORY):
+    select = f" --component={SELECT_FILTER_COMPONENT} --params='{selector.component_params()}'" if selector else ""
+    return f"babeltrace2 {quoted_traces(directory)}{select} --component={NDJSON_SINK_COMPONENT} --params='path=\"{output_file}\"'"
+
+
+def text_log_convert_command(selector=None, directory=OUTPUT_DIRECTORY):
+    """
+    The babeltrace2 text dump to the standard output, trimmed to the time
+    range of `selector`. The CTF traces are passed explicitly, so the copy in
+    trace.ctf written concurrently is not read.
+    """
+    trim = ""
+    if selector and selector.begin is not None:
+        trim += f" --begin={format_seconds(selector.begin)}"
+    if selector and selector.end is not None:
+        trim += f" --end={format_seconds(selector.end)}"
+    return f"{BABEL_TRACE_CONVERT_COMMAND}{trim} {quoted_traces(directory)}"
+
+
+def stream_trace_log(jobs=1, selector=None, checkpoint=None, directory=OUTPUT_DIRECTORY):
+    """
+    Run the babeltrace2 text dump and convert its output to trace.ndjson while
+    it is written. The text log is kept in trace.log.
+    """
+    process = subprocess.Popen(text_log_convert_command(selector, directory), shell=True, stdout=subprocess.PIPE)
+    try:
+        with open(trace_output(directory, TRACE_LOG_FILE), "wb") as tee:
+            convert_trace_stream(process.stdout, trace_output(directory, OUTPUT_NDJSON_FILE), jobs, read_trace_date(directory), selector or None, checkpoint, tee)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise Exception(f"ERROR: The babeltrace2 text dump failed with exit code {returncode}.")
+
+
+def convert_trace(jobs=1, text_log=False, selector=None, checkpoint=None, compress=None, directory=OUTPUT_DIRECTORY):
+    """
+    Convert the raw LTTng trace to trace.ndjson, its index trace.ndjson.idx
+    and trace.npz.
+
+    The CTF trace is converted by the native `sink.ros2observer.ndjson`
+    babeltrace2 component when the plugin is installed, otherwise it is read
+    through the babeltrace2 Python bindings. The `babeltrace2` text log
+    (trace.log) is only written and parsed when requested with `text_log` or
+    as the last fallback; it is parsed while `babeltrace2` writes it.
+
+    Events not matching the `EventSelector` are dropped during the conversion,
+    natively by the `filter.ros2observer.select` component if available.
+
+    With a `TraceCheckpoint` the conversion resumes after its last checkpoint:
+    only the events from the last converted timestamp on are converted and
+    appended to trace.ndjson. When trace.ndjson is missing or shorter than
+    the checkpoint the checkpoint is reset and the whole trace is converted.
+
+    With `compress` ("gz" or "zst") trace.ndjson is finally replaced by a
+    compressed trace.ndjson.gz or trace.ndjson.zst and its index is removed.
+    A compressed trace can not be resumed: a later run on a raw trace with
+    added events converts the whole trace again.
+
+    The trace in OUTPUT_DIRECTORY is converted unless another trace
+    `directory` is given, the output files are written to that directory.
+    """
+    selector = selector or EventSelector()
+    ndjson_file = trace_output(directory, OUTPUT_NDJSON_FILE)
+    columns_file = trace_output(directory, OUTPUT_COLUMNS_FILE)
+    if checkpoint is not None:
+        if checkpoint.conversion_done and os.path.exists(columns_file):
+            print(f"{ndjson_file} is up to date")
+            return
+        selector = selector.starting_at(checkpoint.resume_from(ndjson_file))
+
+    if not text_log and native_plugin_available():
+        print(f"Converting the trace with {NDJSON_SINK_COMPONENT}")
+        output_file = ndjson_file if checkpoint is None else f"{ndjson_file}.part"
+        result = subprocess.run(native_convert_command(output_file, selector, directory), shell=True, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise Exception(f"ERROR: The {NDJSON_SINK_COMPONENT} conversion failed:\n{result.stderr}")
+        if checkpoint is None:
+            print(f"NDJSON file written to {ndjson_file}")
+        else:
+            append_ndjson_checkpointed(ndjson_file, output_file, checkpoint)
+            os.remove(output_file)
+    elif text_log or not bt2_available():
+        stream_trace_log(jobs, selector, checkpoint, directory)
+    else:
+        events = selector.filter(iter_ctf_events(find_ctf_traces(directory), selector.begin_seconds(), selector.end_seconds()))
+        if checkpoint is None:
+            write_ndjson_file(ndjson_file, events)
+        else:
+            write_ndjson_checkpointed(ndjson_file, events, checkpoint)
+    update_trace_index(ndjson_file)
+    write_columnar_trace(columns_file, read_ndjson_file(ndjson_file))
+    if compress:
+        compress_file(ndjson_file, compress)
+        os.remove(index_path(ndjson_file))
+
+
+def open_checkpoint(selector=None, resume=True):
+    """
+    The conversion checkpoint of the trace in OUTPUT_DIRECTORY, a fresh one
+    when `resume` is False.
+    """
+    fingerprint = trace_fingerprint(find_ctf_traces(OUTPUT_DIRECTORY))
+    selection = selector.component_params() if selector else ""
+    checkpoint = TraceCheckpoint(OUTPUT_CHECKPOINT_FILE, fingerprint, selection)
+    if not resume:
+        checkpoint.reset()
+        checkpoint.stages = {}
+    return checkpoint
+
+
+def run_stage(checkpoint, stage, command, output=None):
+    """
+    Run a post processing command unless it already completed for the current
+    trace. A stale `output` directory of a previous run is removed first.
+    """
+    if checkpoint.is_done(stage):
+        print(f"Skipping {stage}, it is up to date")
+        return
+    if output and os.path.isdir(output):
+        shutil.rmtree(output)
+    run_command(command, timeout=None)
+    checkpoint.stage_done(stage)
+
 
-def process_live_trace():
+def convert_ctf(checkpoint):
+    """
+    Convert the raw trace to a CTF copy in OUTPUT_CTF_TEMPORARY_DIRECTORY,
+    see `install_ctf`.
+    """
+    if checkpoint.is_done("ctf"):
+        print("Skipping ctf, it is up to date")
+        return
+    if os.path.isdir(OUTPUT_CTF_TEMPORARY_DIRECTORY):
+        shutil.rmtree(OUTPUT_CTF_TEMPORARY_DIRECTORY)
+    run_command(f"{BABEL_TRACE_CONVERT_CTF_COMMAND} --output '{OUTPUT_CTF_TEMPORARY_DIRECTORY}' {quoted_traces()}", timeout=None)
+
+
+def install_ctf(checkpoint):
+    """Move the CTF copy written by `convert_ctf` to trace.ctf."""
+    if not os.path.isdir(OUTPUT_CTF_TEMPORARY_DIRECTORY):
+        return
+    if os.path.isdir(OUTPUT_CTF_DIRECTORY):
+        shutil.rmtree(OUTPUT_CTF_DIRECTORY)
+    shutil.move(OUTPUT_CTF_TEMPORARY_DIRECTORY, OUTPUT_CTF_DIRECTORY)
+    checkpoint.stage_done("ctf")
+
+
+def process_trace(resume=True, stage_workers=STAGE_WORKERS, **options):
+    """
+    Run the post processing stages of the trace. `ros2 trace-analysis`, the
+    conversion to trace.ndjson and the CTF copy only read the raw trace and
+    run concurrently on up to `stage_workers` threads.
+    """
+    print(f"Post processing trace in: {OUTPUT_DIRECTORY}")
+    checkpoint = open_checkpoint(options.get("selector"), resume)
+    scheduler = StageScheduler(stage_workers)
+    scheduler.add("trace-analysis", run_stage, checkpoint, "trace-analysis", ROS2_TRACE_ANALYSIS_COMMAND)
+    scheduler.add("convert", convert_trace, checkpoint=checkpoint, **options)
+    scheduler.add("ctf", convert_ctf, checkpoint)
+    scheduler.add("ctf-install", install_ctf, checkpoint, after=("ctf", "trace-analysis"))
+    scheduler.run()
+
+def process_live_trace(resume=True, stage_workers=STAGE_WORKERS, **options):
     print(f"Post processing trace in: {OUTPUT_DIRECTORY}")
-    run_command(BABEL_TRACE_CONVERT_COMMAND)
-    run_command(BABEL_TRACE_CONVERT_CTF_COMMAND)
-    write_json_file(OUTPUT_JSON_FILE, trace_log_to_dict(f"{TRACE_LOG_FILE}"))
+    checkpoint = open_checkpoint(options.get("selector"), resume)
+    scheduler = StageScheduler(stage_workers)
+    scheduler.add("convert", convert_trace, checkpoint=checkpoint, **options)
+    scheduler.add("ctf", convert_ctf, checkpoint)
+    scheduler.add("ctf-install", install_ctf, checkpoint, after=("ctf",))
+    scheduler.run()
+
+def start_snapshot_session(subbuf_size=SNAPSHOT_SUBBUF_SIZE, num_subbuf=SNAPSHOT_NUM_SUBBUF, profile=LIVE_PROFILE):
+    """
+    Create and start the LTTng snapshot session: the events of the `profile`
+    are recorded into ring buffers which overwrite the oldest events and are
+    only written to disk by `record_snapshot`.
+    """
+    configure_session(get_profile(profile), SNAPSHOT_SESSION_NAME, "--snapshot", subbuf_size=subbuf_size, num_subbuf=num_subbuf, overwrite=True)
+    run_command(f"lttng start {SNAPSHOT_SESSION_NAME}", echo=True, echo_out=True)
+
+
+def destroy_session(session_name):
+    run_command(f"lttng stop {session_name}")
+    run_command(f"lttng destroy {session_name}")
+
+
+def record_snapshot(seconds=SNAPSHOT_SECONDS, reason="trigger", jobs=1, text_log=False, selector=None, compress=None, **options):
+    """
+    Write the ring buffers of the snapshot session to a new directory below
+    SNAPSHOT_DIRECTORY and convert the events of the last `seconds` before
+    the trigger, see `convert_trace`.
+
+    :return: The snapshot directory, None if the snapshot is empty
+    """
+    trigger_time = time.time_ns()
+    directory = f"{SNAPSHOT_DIRECTORY}/snapshot-{time.strftime('%Y%m%d-%H%M%S')}-{trigger_time % NS_PER_SECOND // 1_000_000:03d}"
+    print(f"Recording snapshot ({reason}) to {directory}")
+    run_command(f"lttng snapshot record -s {SNAPSHOT_SESSION_NAME} '{directory}'", timeout=None, echo=True, echo_out=True)
+    if not find_ctf_traces(directory):
+        print(f"ERROR: The snapshot {directory} contains no trace", file=sys.stderr)
+        return None
+    selector = (selector or EventSelector()).starting_at(trigger_time - seconds * NS_PER_SECOND)
+    convert_trace(jobs=jobs, text_log=text_log, selector=selector, compress=compress, directory=directory)
+    return directory
+
+
+def start_latency_trigger(threshold_ms, triggers):
+    """
+    Watch the callback durations in a second, live session with only the
+    callback events and append a trigger to `triggers` for every callback
+    running longer than `threshold_ms`.
+    """
+    run_command("lttng-relayd --daemonize || true")
+    time.sleep(1)
+    configure_session(get_profile(SNAPSHOT_TRIGGER_PROFILE), SNAPSHOT_TRIGGER_SESSION_NAME, "--live")
+    run_command(f"lttng start {SNAPSHOT_TRIGGER_SESSION_NAME}", echo=True, echo_out=True)
+    time.sleep(2)
+
+    def on_latency(vpid, callback, duration):
+        triggers.append(("latency", f"callback {callback} of vpid {vpid} ran {duration / 1e6:.2f} ms"))
+
+    consumer = LiveTraceConsumer(live_session_url(SNAPSHOT_TRIGGER_SESSION_NAME), latency_threshold=int(threshold_ms * 1e6), on_latency=on_latency)
+    consumer.start()
+    return consumer
+
+
+def run_snapshot_mode(seconds=SNAPSHOT_SECONDS, subbuf_size=SNAPSHOT_SUBBUF_SIZE, num_subbuf=SNAPSHOT_NUM_SUBBUF, latency_threshold=None, cooldown=SNAPSHOT_COOLDOWN, profile=LIVE_PROFILE, **options):
+    """
+    Run the flight recorder until it is interrupted with Ctrl+C. A snapshot of
+    the last `seconds` is recorded and converted when the process receives
+    SIGUSR1 (e.g. from `ros2-tracer --snapshot-trigger`) or, with a
+    `latency_threshold` in ms, when a callback runs longer. Latency triggers
+    within `cooldown` seconds of the last snapshot are ignored.
+    """
+    if os.path.exists(SNAPSHOT_PID_FILE):
+        raise Exception(f"ERROR: A snapshot session is already running, see {SNAPSHOT_PID_FILE}")
+    mkdirp(SNAPSHOT_DIRECTORY)
+    start_snapshot_session(subbuf_size, num_subbuf, profile)
+    with open(SNAPSHOT_PID_FILE, "w") as f:
+        f.write(str(os.getpid()))
+
+    # Appending to a deque is safe in a signal handler and from the consumer thread
+    triggers = deque()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: triggers.append(("signal", "SIGUSR1")))
+    consumer = start_latency_trigger(latency_threshold, triggers) if latency_threshold else None
+    print(f"Flight recorder running, snapshots are written to {SNAPSHOT_DIRECTORY}")
+    print(f"    To record the last {seconds} seconds use: 'ros2-tracer --snapshot-trigger' or 'kill -USR1 {os.getpid()}'")
+    print("Press Ctrl+C to stop & destroy")
+
+    last_snapshot = None
+    try:
+        while True:
+            if not triggers:
+                time.sleep(0.1)
+                continue
+            pending = [triggers.popleft() for _ in range(len(triggers))]
+            if all(kind == "latency" for kind, _ in pending) and last_snapshot is not None and time.monotonic() - last_snapshot < cooldown:
+                continue
+            last_snapshot = time.monotonic()
+            record_snapshot(seconds, "; ".join(reason for _, reason in pending), **options)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        destroy_session(SNAPSHOT_SESSION_NAME)
+        if consumer is not None:
+            destroy_session(SNAPSHOT_TRIGGER_SESSION_NAME)
+            consumer.stop()
+        os.remove(SNAPSHOT_PID_FILE)
+        print("Flight recorder stopped")
+
+
+def trigger_snapshot():
+    """Ask the running flight recorder to record a snapshot."""
+    if not os.path.exists(SNAPSHOT_PID_FILE):
+        raise Exception("ERROR: No snapshot session is running, start one with `ros2-tracer --snapshot`.")
+    with open(SNAPSHOT_PID_FILE, "r") as f:
+        pid = int(f.read())
+    os.kill(pid, signal.SIGUSR1)
+    print(f"Snapshot triggered, it is written to {SNAPSHOT_DIRECTORY}")
+
 
 def main():
 
+    if sys.argv[1:2] == ["compare"]:
+        sys.exit(compare_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["export"]:
+        sys.exit(export_main(sys.argv[2:]))
+
     description = f"""
     ROS 2 Tracer
 
     The ROS 2 tracer is a session management tool that invokes the `ros2 trace`
     command. It provides basic management of live and fixed-time tracing 
-    sessions and auto-conversion of tracing output to json (via procedural 
-    parsing) and CTF using `babeltrace2`.
+    sessions and auto-conversion of tracing output to newline delimited json
+    (via procedural parsing) and CTF using `babeltrace2`.
 
     All tracing output will be placed in the ROS_HOME directory: {OUTPUT_DIRECTORY}
     
@@ -128,6 +552,36 @@ def main():
 
         Run a 5 second tracing session, overwrite the last output trace:
             ros2-tracer -t 5 -o
+
+        Convert the trace with 8 parser processes:
+            ros2-tracer -t 5 -o -j 8
+
+        Process the existing trace again, resuming after the last checkpoint:
+            ros2-tracer --process
+
+        Only convert the callbacks of the process `talker`:
+            ros2-tracer -t 5 -o --events 'ros2:callback_*' --pid talker
+
+        Trace for an hour in chunks of one minute, converted while tracing:
+            ros2-tracer -t 3600 -o --rotate 60
+
+        Trace only the callbacks, with small ring buffers:
+            ros2-tracer -t 5 -o --profile minimal
+
+        Measure the tracing overhead of every profile on the running system:
+            ros2-tracer --benchmark
+
+        Compare two traces of the same scenario and flag the regressions of B
+        (exit code 2), see `ros2-tracer compare --help`:
+            ros2-tracer compare before/trace.npz after/trace.npz
+
+        Export the callbacks and messages for the Perfetto UI, see
+        `ros2-tracer export --help`:
+            ros2-tracer export trace.ndjson -o trace_events.json.gz
+
+        Run a flight recorder, dump the last 10 seconds when a callback runs
+        longer than 50 ms or on `ros2-tracer --snapshot-trigger`:
+            ros2-tracer --snapshot --trigger-latency 50
        
        Run a live trace with lttng-live:
            ros2-tracer --live -o
@@ -149,6 +603,12 @@ def main():
         action="store_true",
         help="Start the ros2 trace with the session name: {SESSION_NAME} as a live session",
     )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=LIVE_STATISTICS_INTERVAL,
+        help=f"Seconds between two reports of the node and callback statistics of a live session. Default is {LIVE_STATISTICS_INTERVAL}.",
+    )
     parser.add_argument(
         "-S", "--stop", action="store_true", help="Stop the ros2 tracer"
     )
@@ -161,13 +621,158 @@ def main():
     parser.add_argument(
         "-t", "--time", type=int, help="Time in seconds to run the tracer"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes used to convert the trace log to json. Default is the number of CPU cores.",
+    )
+    parser.add_argument(
+        "--stage-workers",
+        type=int,
+        default=STAGE_WORKERS,
+        help=f"Number of post processing stages (trace-analysis, conversion, CTF copy) run concurrently. Default is {STAGE_WORKERS}.",
+    )
+    parser.add_argument(
+        "--text-log",
+        action="store_true",
+        help="Write the babeltrace2 text log (trace.log) and convert it, instead of converting the CTF trace with the ros2observer babeltrace2 plugin or the babeltrace2 Python bindings.",
+    )
+
+    parser.add_argument(
+        "--events",
+        help="Comma separated event name globs to convert, e.g. 'ros2:callback_*,ros2:rmw_*'. Default is all events.",
+    )
+    parser.add_argument(
+        "--pid",
+        help="Comma separated process IDs (vpid) or process names (procname) to convert. Default is all processes.",
+    )
+    parser.add_argument(
+        "--from",
+        dest="time_from",
+        help="Only convert events at or after this time, in seconds since the Unix epoch (e.g. 1714561909.5).",
+    )
+    parser.add_argument(
+        "--to",
+        dest="time_to",
+        help="Only convert events at or before this time, in seconds since the Unix epoch.",
+    )
+
+    parser.add_argument(
+        "-z",
+        "--compress",
+        choices=sorted(COMPRESSION_EXTENSIONS),
+        help="Compress trace.ndjson with gzip (gz) or zstd (zst, requires the zstandard package) after the conversion.",
+    )
+    parser.add_argument(
+        "--rotate",
+        type=int,
+        metavar="SECONDS",
+        help="With -t, rotate the session every SECONDS into trace chunks which are converted and indexed in the background while tracing. The chunks are listed in chunks.json and are not compressed.",
+    )
+    parser.add_argument(
+        "--chunk-workers",
+        type=int,
+        default=CHUNK_WORKERS,
+        help=f"Number of trace chunks converted concurrently with --rotate. Default is {CHUNK_WORKERS}.",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=list(TRACE_PROFILES),
+        help="Tracing profile selecting the events, buffer sizes and contexts: "
+        + "; ".join(f"{profile.name}: {profile.description}" for profile in TRACE_PROFILES.values())
+        + f". Timed sessions default to `ros2 trace -a`, live and snapshot sessions to {LIVE_PROFILE}.",
+    )
+    parser.add_argument(
+        "--benchmark",
+        nargs="*",
+        metavar="PROFILE",
+        help="Measure the tracing overhead (CPU time, discarded events, trace size) of the given profiles, default all, on the running system.",
+    )
+    parser.add_argument(
+        "--benchmark-seconds",
+        type=int,
+        default=BENCHMARK_SECONDS,
+        help=f"Seconds traced per profile by --benchmark, after an untraced window of the same length. Default is {BENCHMARK_SECONDS}.",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help=f"Run a flight recorder session: the events are kept in ring buffers and only the last --snapshot-seconds are written and converted when triggered, to {SNAPSHOT_DIRECTORY}.",
+    )
+    parser.add_argument(
+        "--snapshot-trigger",
+        action="store_true",
+        help="Trigger a snapshot of the running flight recorder session.",
+    )
+    parser.add_argument(
+        "--snapshot-seconds",
+        type=int,
+        default=SNAPSHOT_SECONDS,
+        help=f"Seconds before the trigger kept in a snapshot. Default is {SNAPSHOT_SECONDS}.",
+    )
+    parser.add_argument(
+        "--subbuf-size",
+        default=SNAPSHOT_SUBBUF_SIZE,
+        help=f"Size of the ring buffer sub-buffers of the flight recorder, e.g. 4M. Default is {SNAPSHOT_SUBBUF_SIZE}.",
+    )
+    parser.add_argument(
+        "--num-subbuf",
+        type=int,
+        default=SNAPSHOT_NUM_SUBBUF,
+        help=f"Number of sub-buffers per CPU of the flight recorder ring buffers. Default is {SNAPSHOT_NUM_SUBBUF}.",
+    )
+    parser.add_argument(
+        "--trigger-latency",
+        type=float,
+        help="Record a snapshot when a callback runs longer than this many milliseconds.",
+    )
+    parser.add_argument(
+        "--snapshot-cooldown",
+        type=float,
+        default=SNAPSHOT_COOLDOWN,
+        help=f"Minimum seconds between two snapshots triggered by --trigger-latency. Default is {SNAPSHOT_COOLDOWN}.",
+    )
+    parser.add_argument(
+        "-p",
+        "--process",
+        action="store_true",
+        help="Post process the existing trace in the output directory. An interrupted conversion resumes after its last checkpoint and only events added since the last run are converted.",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Ignore the checkpoints of a previous post processing and process the whole trace again.",
+    )
 
     args = parser.parse_args()
+    selector = EventSelector(args.events, args.pid, parse_time(args.time_from), parse_time(args.time_to))
+    options = {"jobs": args.jobs, "text_log": args.text_log, "selector": selector, "resume": not args.no_resume, "compress": args.compress, "stage_workers": args.stage_workers}
 
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(1)
 
+    if args.benchmark is not None:
+        benchmark_profiles(args.benchmark, args.benchmark_seconds)
+        sys.exit(0)
+
+    if args.snapshot_trigger:
+        trigger_snapshot()
+        sys.exit(0)
+
+    if args.snapshot:
+        run_snapshot_mode(args.snapshot_seconds, args.subbuf_size, args.num_subbuf, args.trigger_latency, args.snapshot_cooldown, args.profile or LIVE_PROFILE, **options)
+        sys.exit(0)
+
+    if args.process:
+        if not os.path.isdir(OUTPUT_DIRECTORY):
+            print(f"ERROR: There is no trace to process in: {OUTPUT_DIRECTORY}", file=sys.stderr)
+            sys.exit(1)
+        process_trace(**options)
+        sys.exit(0)
+
     if args.overwrite_last_trace:
         if os.path.exists(OUTPUT_DIRECTORY) and os.path.isdir(OUTPUT_DIRECTORY):
             shutil.rmtree(OUTPUT_DIRECTORY)
@@ -180,26 +785,29 @@ def main():
 
     if args.start:
         try:
-            start_tracing()
+            start_tracing(args.profile)
             print(f"Started tracing with session name: {SESSION_NAME}")
         except Exception as e:
             print(e)
     elif args.time:
         if args.time:
-            timed_trace(args.time)
+            if args.rotate:
+                rotating_trace(args.time, args.rotate, args.profile, args.chunk_workers, **options)
+            else:
+                timed_trace(args.time, args.profile, **options)
 
     if args.live:
         try:
             print(f"Starting tracing with session name: {SESSION_NAME}")
-            start_live_trace(SESSION_NAME, OUTPUT_DIRECTORY)
-            process_live_trace()
+            start_live_trace(SESSION_NAME, OUTPUT_DIRECTORY, args.stats_interval, args.profile or LIVE_PROFILE)
+            process_live_trace(**options)
             sys.exit(0)
         except Exception as e:
             print(e)
  
 
     if args.stop:
-        stop_tracing()
+        stop_tracing(**options)
         print("Stopped tracing.")
 
 
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+try:
+    from ros2tools.callback_analysis import open_columnar_trace, load_columns, group_boundaries, pair_callbacks, load_callback_registry, process_names, format_handle
+    from ros2tools.util import write_json_file
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from callback_analysis import open_columnar_trace, load_columns, group_boundaries, pair_callbacks, load_callback_registry, process_names, format_handle
+    from util import write_json_file
+
+
+# sched_analysis.py correlates the kernel scheduler events of a trace (the
+# `full` profile or `ros2 trace -a` with kernel events) with the ROS 2
+# callbacks. `sched_switch` and `sched_wakeup`/`sched_waking` give the state of
+# every thread over time:
+#   running     on a CPU, from being switched in to being switched out
+#   preempted   switched out while runnable (prev_state TASK_RUNNING, or
+#               TASK_REPORT_MAX which the kernel reports for a preemption)
+#   waiting     woken up and waiting for a CPU
+#   blocked     switched out while sleeping, until woken up
+# The state timelines are sorted by thread and time, and the callback intervals
+# are merged into them with `searchsorted` on the time-ordered columns, so the
+# time of a callback in every state is a difference of two cumulative sums.
+# Kernel thread ids are compared with the `vtid` of the ROS 2 events, which is
+# the same unless the ROS 2 processes run in their own PID namespace.
+
+SCHED_SWITCH = "sched_switch"
+WAKEUP_EVENTS = ["sched_waking", "sched_wakeup"]
+STATES = ["running", "preempted", "waiting", "blocked"]
+RUNNING, PREEMPTED, WAITING, BLOCKED = range(len(STATES))
+# Order of the transitions of a thread at the same timestamp
+SWITCH_OUT, WAKEUP, SWITCH_IN = range(3)
+RESOLUTION_MS = 100
+# prev_state of a preempted task since Linux 4.14, TASK_REPORT_MAX, and its
+# enumeration labels (TASK_STATE_MAX in older LTTng versions)
+TASK_REPORT_MAX = 0x100
+RUNNABLE_STATES = {"0", "R", "R+", str(TASK_REPORT_MAX)}
+RUNNABLE_LABELS = ["TASK_RUNNING", "TASK_REPORT_MAX", "TASK_STATE_MAX"]
+
+
+def runnable_states(trace):
+    """Whether the `prev_state` of every `sched_switch` is TASK_RUNNING (0) or TASK_REPORT_MAX, from integer or enumeration text values."""
+    if trace.is_string_column(SCHED_SWITCH, "prev_state"):
+        codes, strings = trace.column(SCHED_SWITCH, "prev_state", decode=False)
+        runnable = np.array([string.strip() in RUNNABLE_STATES or any(label in string for label in RUNNABLE_LABELS) for string in strings.tolist()] + [False])
+        return runnable[codes] if len(strings) else np.zeros(len(codes), dtype=bool)
+    return np.isin(load_columns(trace, SCHED_SWITCH, ["prev_state"])["prev_state"], [0, TASK_REPORT_MAX])
+
+
+class ThreadStates:
+    """
+    The scheduling state timelines of all threads of a trace, sorted by thread
+    and time: `tids`, `timestamps` and `states` have one entry per transition,
+    `boundaries` are the start indexes of the threads (see `group_boundaries`)
+    and `cumulative` the time spent in every state before every transition.
+    """
+
+    def __init__(self, trace):
+        switches = load_columns(trace, SCHED_SWITCH, ["timestamp", "prev_tid", "next_tid"])
+        runnable = runnable_states(trace) if trace.length(SCHED_SWITCH) else np.zeros(0, dtype=bool)
+        wakeups = [load_columns(trace, event, ["timestamp", "tid"]) for event in WAKEUP_EVENTS]
+        self.end = max([int(columns["timestamp"].max()) for columns in [switches] + wakeups if len(columns["timestamp"])] or [0])
+
+        count = len(switches["timestamp"])
+        tids = np.concatenate([switches["prev_tid"], switches["next_tid"]] + [columns["tid"] for columns in wakeups])
+        timestamps = np.concatenate([switches["timestamp"], switches["timestamp"]] + [columns["timestamp"] for columns in wakeups])
+        kinds = np.concatenate(
+            [np.full(count, SWITCH_OUT), np.full(count, SWITCH_IN)] + [np.full(len(columns["timestamp"]), WAKEUP) for columns in wakeups]
+        ).astype(np.int8)
+        states = np.concatenate(
+            [np.where(runnable, PREEMPTED, BLOCKED), np.full(count, RUNNING)] + [np.full(len(columns["timestamp"]), WAITING) for columns in wakeups]
+        ).astype(np.int8)
+        order = np.lexsort((kinds, timestamps, tids))
+        self.tids, self.timestamps, kinds, states = tids[order], timestamps[order], kinds[order], states[order]
+        self.boundaries = group_boundaries(self.tids)
+
+        # A wakeup only ends a blocked state: after a running or preempted
+        # state of the last switch it changes nothing
+        positions = np.arange(len(states))
+        last_switch = np.maximum.accumulate(np.where(kinds != WAKEUP, positions, -1))
+        thread_start = np.repeat(self.boundaries[:-1], np.diff(self.boundaries))
+        previous = np.where(last_switch >= thread_start, states[np.maximum(last_switch, 0)], BLOCKED)
+        self.states = np.where((kinds == WAKEUP) & (previous != BLOCKED), previous, states)
+
+        # Time in the state of every transition until the next one of the thread
+        following = np.append(self.timestamps[1:], self.end)
+        following[self.boundaries[1:] - 1] = self.end
+        durations = following - self.timestamps
+        in_state = np.zeros((len(durations), len(STATES)), dtype=np.int64)
+        in_state[positions, self.states] = durations
+        self.cumulative = np.vstack((np.zeros((1, len(STATES)), dtype=np.int64), np.cumsum(in_state, axis=0)))
+
+    def thread(self, tid):
+        """The (start, end) transition indexes of a thread, an empty range if it is not in the trace."""
+        number = np.searchsorted(self.tids[self.boundaries[:-1]], tid) if len(self.tids) else 0
+        if number >= len(self.boundaries) - 1 or self.tids[self.boundaries[number]] != tid:
+            return 0, 0
+        return self.boundaries[number], self.boundaries[number + 1]
+
+    def time_in_states(self, tid, starts, ends):
+        """
+        The time of the intervals [starts, ends) of a thread in every state, an
+        array of shape (len(starts), len(STATES)). Time before the first
+        transition of the thread is not in any state.
+        """
+        first, last = self.thread(tid)
+        if first == last:
+            return np.zeros((len(starts), len(STATES)), dtype=np.int64)
+        timestamps, states, cumulative = self.timestamps[first:last], self.states[first:last], self.cumulative[first:last + 1]
+
+        def until(times):
+            index = np.searchsorted(timestamps, times, side="right") - 1
+            known = index >= 0
+            index = np.maximum(index, 0)
+            result = cumulative[index] - cumulative[0]
+            result[np.arange(len(times)), states[index]] += times - timestamps[index]
+            result[~known] = 0
+            return result
+
+        return until(ends) - until(starts)
+
+    def running_intervals(self):
+        """The (tids, starts, ends) of all running intervals."""
+        running = np.flatnonzero(self.states == RUNNING)
+        durations = self.cumulative[running + 1, RUNNING] - self.cumulative[running, RUNNING]
+        return self.tids[running], self.timestamps[running], self.timestamps[running] + durations
+
+
+def cumulative_running(starts, ends, times):
+    """The total length of the intervals [starts, ends) before each of the sorted `times`."""
+    # Relative to the first time, the sums of the timestamps do not overflow
+    origin = times[0] if len(times) else 0
+    starts, ends, times = np.sort(starts) - origin, np.sort(ends) - origin, times - origin
+    start_sums = np.concatenate(([0], np.cumsum(starts)))
+    end_sums = np.concatenate(([0], np.cumsum(ends)))
+    started = np.searchsorted(starts, times, side="right")
+    ended = np.searchsorted(ends, times, side="right")
+    return (started * times - start_sums[started]) - (ended * times - end_sums[ended])
+
+
+def analyze_scheduling(trace, resolution_ns=RESOLUTION_MS * 1_000_000):
+    """
+    The scheduling states of the callbacks and the CPU utilization of the
+    ROS 2 processes of a columnar trace with kernel events.
+
+    :param trace: A `ColumnarTrace`, see `open_columnar_trace`
+    :param resolution_ns: Length of the utilization timeline bins in ns
+    :return: A dictionary with the time in every state per callback
+        (`callbacks`) and the CPU utilization timeline per process (`processes`)
+    """
+    if not trace.length(SCHED_SWITCH):
+        raise Exception(f"ERROR: The trace has no {SCHED_SWITCH} events, record it with kernel events (e.g. --profile full).")
+    threads = ThreadStates(trace)
+    executions = pair_callbacks(trace)
+    vpids, vtids, callbacks = executions["vpid"], executions["vtid"], executions["callback"]
+    starts = executions["start"]
+    ends = starts + executions["duration"]
+
+    in_states = np.zeros((len(starts), len(STATES)), dtype=np.int64)
+    order = np.argsort(vtids, kind="stable")
+    thread_boundaries = group_boundaries(vtids[order])
+    for first, last in zip(thread_boundaries[:-1], thread_boundaries[1:]):
+        selected = order[first:last]
+        in_states[selected] = threads.time_in_states(vtids[selected[0]], starts[selected], ends[selected])
+
+    registry, _ = load_callback_registry(trace)
+    procnames = process_names(trace)
+    order = np.lexsort((callbacks, vpids))
+    boundaries = group_boundaries(vpids[order], callbacks[order])
+    totals = np.add.reduceat(in_states[order], boundaries[:-1]) if len(order) else np.zeros((0, len(STATES)), dtype=np.int64)
+    durations = np.add.reduceat(executions["duration"][order], boundaries[:-1]) if len(order) else np.zeros(0, dtype=np.int64)
+    results = []
+    for group, start in enumerate(boundaries[:-1]):
+        vpid = int(vpids[order[start]])
+        handle = format_handle(callbacks[order[start]])
+        node, label = registry.callback_name(vpid, handle, procnames.get(vpid))
+        result = {"node": node, "callback": label, "vpid": vpid, "handle": handle, "count": int(boundaries[group + 1] - start), "total": int(durations[group])}
+        for state, time in zip(STATES, totals[group].tolist()):
+            result[state] = time
+        result["untraced"] = result["total"] - int(totals[group].sum())
+        results.append(result)
+    results.sort(key=lambda result: result["total"], reverse=True)
+
+    # CPU time of the threads of every ROS 2 process per timeline bin
+    thread_vpids = dict(zip(vtids.tolist(), vpids.tolist()))
+    for event in trace.event_classes:
+        if event.startswith("ros2:") and trace.has_column(event, "vtid"):
+            columns = load_columns(trace, event, ["vpid", "vtid"])
+            pairs = np.unique(np.stack((columns["vtid"], columns["vpid"])), axis=1)
+            thread_vpids.update(zip(pairs[0].tolist(), pairs[1].tolist()))
+    tids, running_starts, running_ends = threads.running_intervals()
+    begin = int(threads.timestamps.min()) if len(threads.timestamps) else 0
+    edges = np.arange(begin, threads.end + resolution_ns, resolution_ns, dtype=np.int64)
+    process_vpids = np.array([thread_vpids.get(tid, -1) for tid in tids.tolist()], dtype=np.int64)
+    processes = []
+    for vpid in sorted(set(thread_vpids.values())):
+        selected = process_vpids == vpid
+        cpu_time = np.diff(cumulative_running(running_starts[selected], running_ends[selected], edges))
+        processes.append({
+            "vpid": vpid,
+            "name": registry.process_name(vpid, procnames.get(vpid)),
+            "cpu_time": int(cpu_time.sum()),
+            "utilization": (cpu_time / resolution_ns).round(4).tolist(),
+        })
+    return {
+        "callbacks": results,
+        "start": begin,
+        "resolution": resolution_ns,
+        "processes": processes,
+    }
+
+
+def write_scheduling_csv(analysis, output_file):
+    """
+    Write the callback states as CSV, one row per callback, and the
+    utilization timelines to `<output_file>` with the suffix `_utilization.csv`
+    (one row per bin, one column per process, in CPUs).
+    """
+    columns = ["node", "callback", "vpid", "handle", "count", "total"] + STATES + ["untraced"]
+    with open(output_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(analysis["callbacks"])
+    utilization_file = f"{os.path.splitext(output_file)[0]}_utilization.csv"
+    processes = analysis["processes"]
+    with open(utilization_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp"] + [f"{process['name']} ({process['vpid']})" for process in processes])
+        bins = len(processes[0]["utilization"]) if processes else 0
+        for number in range(bins):
+            writer.writerow([analysis["start"] + number * analysis["resolution"]] + [process["utilization"][number] for process in processes])
+    print(f"Scheduling analysis written to {output_file} and {utilization_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Running, preempted, waiting and blocked time of the callbacks and CPU utilization of the processes of a ROS 2 trace with kernel events")
+    parser.add_argument("trace_file", nargs="?", default="trace.npz", help="trace.npz, or trace.ndjson/trace.json (slower, converted to columns first). Default is trace.npz.")
+    parser.add_argument("-o", "--output", default="scheduling", help="Output file name without extension, .json and .csv are written. Default is scheduling.")
+    parser.add_argument("--resolution", type=float, default=RESOLUTION_MS, help=f"Length of the utilization timeline bins in ms. Default is {RESOLUTION_MS}.")
+    parser.add_argument("--pretty", action="store_true", help="Write indented JSON, the output is compact by default.")
+    args = parser.parse_args()
+
+    trace = open_columnar_trace(args.trace_file)
+    analysis = analyze_scheduling(trace, int(args.resolution * 1e6))
+    trace.close()
+    write_json_file(f"{args.output}.json", analysis, args.pretty)
+    write_scheduling_csv(analysis, f"{args.output}.csv")
+
+    for result in analysis["callbacks"][:10]:
+        shares = ", ".join(f"{state} {100 * result[state] / max(result['total'], 1):.1f}%" for state in STATES)
+        print(f"{result['node']} {result['callback']}: {shares}")
+
+
+if __name__ == "__main__":
+    main()
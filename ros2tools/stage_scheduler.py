@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+# stage_scheduler.py runs the post processing stages of a trace. Stages whose
+# dependencies are done run concurrently on a bounded number of threads; the
+# stages themselves mostly wait on external commands (`babeltrace2`,
+# `ros2 trace-analysis`) or on process pools, so threads are sufficient.
+
+
+class Stage:
+    def __init__(self, name, function, args, kwargs, after):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.after = tuple(after)
+        self.status = "pending"
+        self.wall_time = None
+        self.error = None
+
+
+class StageScheduler:
+    """
+    Runs named stages concurrently as soon as the stages they depend on are
+    done, with at most `max_workers` stages at a time. A failed stage skips
+    all stages depending on it; the other stages still run.
+
+    :param max_workers: Maximum number of concurrently running stages
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.stages = {}
+
+    def add(self, name, function, *args, after=(), **kwargs):
+        """
+        Add the stage `name` running `function(*args, **kwargs)` after the
+        stages named in `after`.
+        """
+        for dependency in after:
+            if dependency not in self.stages:
+                raise Exception(f"ERROR: Stage {name} depends on the unknown stage {dependency}.")
+        self.stages[name] = Stage(name, function, args, kwargs, after)
+
+    def run_stage(self, stage):
+        start = time.perf_counter()
+        try:
+            stage.function(*stage.args, **stage.kwargs)
+        finally:
+            stage.wall_time = time.perf_counter() - start
+
+    def run(self):
+        """
+        Run all stages and print their wall times.
+
+        :raises: The exception of the first failed stage, after all other stages finished
+        """
+        start = time.perf_counter()
+        pending = list(self.stages.values())
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(pending) or 1) as executor:
+            while pending or running:
+                for stage in list(pending):
+                    dependencies = [self.stages[name].status for name in stage.after]
+                    if any(status in ("failed", "skipped") for status in dependencies):
+                        stage.status = "skipped"
+                        pending.remove(stage)
+                    elif all(status == "done" for status in dependencies):
+                        stage.status = "running"
+                        running[executor.submit(self.run_stage, stage)] = stage
+                        pending.remove(stage)
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    stage.error = future.exception()
+                    stage.status = "failed" if stage.error else "done"
+                    if stage.error:
+                        print(f"Stage {stage.name} failed: {stage.error}")
+
+        self.report(time.perf_counter() - start)
+        for stage in self.stages.values():
+            if stage.error:
+                raise stage.error
+
+    def report(self, total_time):
+        width = max([len(name) for name in self.stages] + [len("total")])
+        print("Post processing stages (wall time):")
+        for stage in self.stages.values():
+            wall_time = f"{stage.wall_time:8.2f} s" if stage.wall_time is not None else " " * 10
+            print(f"  {stage.name:<{width}}  {wall_time}  {stage.status}")
+        print(f"  {'total':<{width}}  {total_time:8.2f} s")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+try:
+    from ros2tools.callback_analysis import open_columnar_trace, load_columns, group_boundaries, load_callback_registry, process_names, format_handle
+    from ros2tools.util import write_json_file
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from callback_analysis import open_columnar_trace, load_columns, group_boundaries, load_callback_registry, process_names, format_handle
+    from util import write_json_file
+
+
+# timer_analysis.py measures how regularly the timers of a trace fire. Timer
+# callbacks are identified through `rcl_timer_init` (the period) and
+# `rclcpp_timer_callback_added` (the callback of a timer). The starts of the
+# timer callbacks are sorted per timer once, and everything else is an array
+# operation on their differences:
+#   interval    time between two consecutive starts
+#   periods     interval / period rounded, at least 1
+#   jitter      interval - periods * period
+#   missed      periods without a start (periods - 1)
+#   drift       deviation of the rate from the period over the whole trace, in ppm
+#   phase       start - the ideal start, the first start plus the periods
+#               elapsed since, so a constant offset of the rate accumulates
+
+CALLBACK_START = "ros2:callback_start"
+JITTER_PERCENTILES = (50, 90, 99)
+SERIES_COLUMNS = ["timestamp", "interval", "jitter", "phase"]
+
+
+def timer_callbacks(trace):
+    """
+    The timer callbacks of a trace.
+
+    :return: A dictionary keyed by (vpid, callback handle) with (node, label,
+        period in ns) values
+    """
+    registry, timer_periods = load_callback_registry(trace)
+    procnames = process_names(trace)
+    timers = {}
+    for (vpid, callback), timer in registry.callbacks.items():
+        period = timer_periods.get((vpid, timer))
+        if period:
+            node, label = registry.callback_name(vpid, callback, procnames.get(vpid))
+            timers[(vpid, callback)] = (node, label, int(period))
+    return timers
+
+
+def timer_series(trace):
+    """
+    The start times of every timer callback and their intervals.
+
+    :return: A tuple (timers, boundaries, series): a list of dictionaries
+        describing every timer, the start indexes of the timers in the series
+        (see `group_boundaries`) and a dictionary of arrays sorted by timer and
+        time: `timestamp`, `period`, `interval`, `jitter`, `missed` and `phase`
+        (the first start of a timer has no interval, its interval is 0)
+    """
+    timers = timer_callbacks(trace)
+    keys = list(timers)
+    starts = load_columns(trace, CALLBACK_START, ["timestamp", "vpid", "callback"])
+    if len(starts["timestamp"]):
+        pairs, inverse = np.unique(np.stack((starts["vpid"].astype(np.uint64), starts["callback"].astype(np.uint64))), axis=1, return_inverse=True)
+        numbers = {key: number for number, key in enumerate(keys)}
+        pair_timers = np.array([numbers.get((vpid, format_handle(callback)), -1) for vpid, callback in zip(*pairs.tolist())], dtype=np.int64)
+        timer = pair_timers[inverse.reshape(-1)]
+    else:
+        timer = np.zeros(0, dtype=np.int64)
+    selected = timer >= 0
+    timer, timestamps = timer[selected], starts["timestamp"][selected]
+
+    order = np.lexsort((timestamps, timer))
+    timer, timestamps = timer[order], timestamps[order]
+    boundaries = group_boundaries(timer)
+    first = boundaries[:-1]
+    periods = np.array([period for _, _, period in timers.values()] + [1], dtype=np.int64)[timer]
+    first_starts = np.repeat(timestamps[first], np.diff(boundaries))
+    intervals = np.diff(timestamps, prepend=timestamps[:1])
+    # The first start of a timer counts as on time, without jitter or missed periods
+    intervals[first] = periods[first]
+    elapsed = np.maximum(np.rint(intervals / periods).astype(np.int64), 1)
+    # Periods elapsed since the first start of the timer
+    steps = elapsed.copy()
+    steps[first] = 0
+    total = np.cumsum(steps)
+    total -= np.repeat(total[first], np.diff(boundaries))
+    series = {
+        "timestamp": timestamps,
+        "period": periods,
+        "interval": intervals,
+        "jitter": intervals - elapsed * periods,
+        "missed": elapsed - 1,
+        "phase": timestamps - first_starts - total * periods,
+    }
+    series["interval"][first] = 0
+    described = []
+    for number in timer[first].tolist():
+        vpid, handle = keys[number]
+        node, label, period = timers[(vpid, handle)]
+        described.append({"node": node, "timer": label, "vpid": vpid, "handle": handle, "period": period})
+    return described, boundaries, series
+
+
+def analyze_timers(trace):
+    """
+    Firing statistics of every timer of a columnar trace: count, mean
+    interval, drift, jitter minimum and maximum, percentiles of the absolute
+    jitter, missed periods and the largest phase offset, all in ns.
+
+    :param trace: A `ColumnarTrace`, see `open_columnar_trace`
+    :return: A tuple (timers, boundaries, series), see `timer_series`, with
+        the statistics added to the timers
+    """
+    timers, boundaries, series = timer_series(trace)
+    for timer, start, end in zip(timers, boundaries[:-1], boundaries[1:]):
+        # Without the first start, which has no interval
+        intervals = series["interval"][start + 1:end]
+        jitter = series["jitter"][start + 1:end]
+        timer["count"] = int(end - start)
+        if not len(intervals):
+            continue
+        mean_interval = float(intervals.mean())
+        timer["mean_interval"] = mean_interval
+        span = int(series["timestamp"][end - 1] - series["timestamp"][start])
+        expected = int(series["missed"][start + 1:end].sum()) + (end - start - 1)
+        timer["drift_ppm"] = (span / (expected * timer["period"]) - 1) * 1e6
+        timer["jitter_min"] = int(jitter.min())
+        timer["jitter_max"] = int(jitter.max())
+        for percentile, value in zip(JITTER_PERCENTILES, np.percentile(np.abs(jitter), JITTER_PERCENTILES).tolist()):
+            timer[f"jitter_p{percentile}"] = value
+        timer["missed"] = int(series["missed"][start + 1:end].sum())
+        timer["phase_max"] = int(np.abs(series["phase"][start:end]).max())
+    return timers, boundaries, series
+
+
+def write_timer_csv(timers, output_file):
+    columns = ["node", "timer", "vpid", "handle", "period", "count", "mean_interval", "drift_ppm", "jitter_min", "jitter_max"] \
+        + [f"jitter_p{percentile}" for percentile in JITTER_PERCENTILES] + ["missed", "phase_max"]
+    with open(output_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(timers)
+    print(f"Timer analysis written to {output_file}")
+
+
+def write_series_csv(timers, boundaries, series, output_file):
+    """Write the series of every timer in long form, one row per callback start, for plotting."""
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["node", "timer", "vpid"] + SERIES_COLUMNS)
+        for timer, start, end in zip(timers, boundaries[:-1], boundaries[1:]):
+            rows = zip(*(series[column][start:end].tolist() for column in SERIES_COLUMNS))
+            writer.writerows([timer["node"], timer["timer"], timer["vpid"], *row] for row in rows)
+    print(f"Timer series written to {output_file}")
+
+
+def print_timer_report(timers):
+    print(f"{'node':<24} {'timer':<18} {'count':>8} {'drift ppm':>10} {'p50 us':>8} {'p99 us':>8} {'max us':>8} {'missed':>7}")
+    for timer in timers:
+        if "mean_interval" not in timer:
+            print(f"{timer['node']:<24} {timer['timer']:<18} {timer['count']:>8}")
+            continue
+        largest = max(abs(timer["jitter_min"]), abs(timer["jitter_max"]))
+        print(
+            f"{timer['node']:<24} {timer['timer']:<18} {timer['count']:>8} {timer['drift_ppm']:>10.1f} "
+            f"{timer['jitter_p50'] / 1e3:>8.1f} {timer['jitter_p99'] / 1e3:>8.1f} {largest / 1e3:>8.1f} {timer['missed']:>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Period, drift, jitter and missed periods of the timers of a converted ROS 2 trace")
+    parser.add_argument("trace_file", nargs="?", default="trace.npz", help="trace.npz, or trace.ndjson/trace.json (slower, converted to columns first). Default is trace.npz.")
+    parser.add_argument("-o", "--output", default="timers", help="Output file name without extension, .json, .csv and _series.csv are written. Default is timers.")
+    parser.add_argument("--pretty", action="store_true", help="Write indented JSON, the output is compact by default.")
+    args = parser.parse_args()
+
+    trace = open_columnar_trace(args.trace_file)
+    timers, boundaries, series = analyze_timers(trace)
+    trace.close()
+    if not timers:
+        print("ERROR: The trace has no timer callbacks.", file=sys.stderr)
+        sys.exit(1)
+    write_json_file(f"{args.output}.json", timers, args.pretty)
+    write_timer_csv(timers, f"{args.output}.csv")
+    write_series_csv(timers, boundaries, series, f"{args.output}_series.csv")
+    print_timer_report(timers)
+
+
+if __name__ == "__main__":
+    main()
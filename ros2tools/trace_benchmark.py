@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import sys
+import time
+
+try:
+    from ros2tools.trace_converter import *
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_converter import *
+
+
+# trace_benchmark.py compares the per-line cost of the regex based
+# `parse_trace_line` (the parser behind the original `trace_log_to_dict`)
+# with the schema caching `TraceLineDecoder`.
+
+SAMPLE_EVENTS = [
+    ("ros2:callback_start", "{{ callback = 0x{handle:X}, is_intra_process = 0 }}"),
+    ("ros2:callback_end", "{{ callback = 0x{handle:X} }}"),
+    ("ros2:rclcpp_publish", "{{ publisher_handle = 0x{handle:X}, message = 0x{message:X} }}"),
+    ("ros2:rcl_publish", "{{ publisher_handle = 0x{handle:X}, message = 0x{message:X} }}"),
+    ("ros2:rmw_publish", "{{ rmw_publisher_handle = 0x{handle:X}, message = 0x{message:X}, timestamp = {timestamp} }}"),
+    ("ros2:rmw_take", "{{ rmw_subscription_handle = 0x{handle:X}, message = 0x{message:X}, source_timestamp = {timestamp}, taken = 1 }}"),
+]
+
+def generate_trace_lines(count, seed=0):
+    """
+    Generate `count` synthetic lines in the format of `babeltrace2` text output
+    of a `ros2 trace` session.
+    """
+    rng = random.Random(seed)
+    timestamp = (11 * 3600 + 11 * 60) * 1_000_000_000
+    lines = []
+    for _ in range(count):
+        delta = rng.randint(1_000, 50_000)
+        timestamp += delta
+        seconds, nanoseconds = divmod(timestamp, 1_000_000_000)
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        vpid = rng.choice((1001, 1002, 1003))
+        event, payload = rng.choice(SAMPLE_EVENTS)
+        payload = payload.format(handle=rng.randint(1 << 40, 1 << 47), message=rng.randint(1 << 40, 1 << 47), timestamp=timestamp)
+        lines.append(
+            f"[{hour:02d}:{minute:02d}:{second:02d}.{nanoseconds:09d}] (+0.{delta:09d}) localhost {event}: "
+            f"{{ cpu_id = {rng.randint(0, 7)} }}, {{ vpid = {vpid}, vtid = {vpid}, procname = \"node_{vpid}\" }}, {payload}"
+        )
+    return lines
+
+def time_parser(parse, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            parse(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the babeltrace2 text line parsers")
+    parser.add_argument("trace_log", nargs="?", help="babeltrace2 text log to benchmark with, synthetic lines are used if omitted")
+    parser.add_argument("-n", "--lines", type=int, default=100_000, help="Number of lines to parse. Default is 100000.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of timed runs, the best one is reported. Default is 3.")
+    args = parser.parse_args()
+
+    if args.trace_log:
+        with open(args.trace_log, "r") as f:
+            lines = [line for _, line in zip(range(args.lines), f)]
+    else:
+        lines = generate_trace_lines(args.lines)
+
+    decoder = TraceLineDecoder()
+    mismatches = sum(1 for line in lines if parse_trace_line(line) != decoder.decode(line))
+
+    regex_time = time_parser(parse_trace_line, lines, args.repeat)
+    decoder_time = time_parser(TraceLineDecoder().decode, lines, args.repeat)
+
+    print(f"lines:             {len(lines)}")
+    print(f"parse_trace_line:  {regex_time * 1e9 / len(lines):8.0f} ns/line")
+    print(f"TraceLineDecoder:  {decoder_time * 1e9 / len(lines):8.0f} ns/line")
+    print(f"speedup:           {regex_time / decoder_time:8.2f}x")
+    if mismatches:
+        print(f"WARNING: {mismatches} lines were parsed differently")
+
+
+if __name__ == "__main__":
+    main()
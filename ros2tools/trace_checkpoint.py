@@ -0,0 +1,355 @@
+import json
+import os
+import re
+import sys
+import threading
+
+try:
+    from ros2tools.trace_converter import NS_PER_SECOND
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_converter import NS_PER_SECOND
+
+
+# trace_checkpoint.py makes the trace conversion resumable. While trace.ndjson
+# is written, a checkpoint file records how many bytes and events of it are
+# complete and the timestamp of the last written event of every stream. LTTng
+# flushes the stream of every CPU independently, so when a growing trace is
+# converted again a lagging stream can add events before the last written
+# event of another stream. A later run truncates the output to the last
+# checkpoint, converts the events from the earliest of the stream timestamps
+# on and appends the ones after the timestamp of their own stream. The
+# fingerprint of the raw trace tells whether a completed stage has to be run
+# again because events were added.
+
+CHECKPOINT_VERSION = 2
+# Number of events between two checkpoints
+CHECKPOINT_INTERVAL = 100_000
+NDJSON_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def trace_fingerprint(traces):
+    """
+    Fingerprint of the raw CTF traces: the number and total size of their
+    files. It changes whenever events are added to the trace.
+
+    :param traces: CTF trace directories, see `find_ctf_traces`
+    """
+    count = 0
+    size = 0
+    for trace in traces:
+        for root, _, files in os.walk(trace):
+            for name in files:
+                count += 1
+                size += os.path.getsize(os.path.join(root, name))
+    return f"{count}:{size}"
+
+
+# The header fields of a NDJSON record which identify its stream, read
+# without decoding the record
+STREAM_FIELDS = re.compile(r'"(timestamp|event|cpu_id)":\s*("(?:[^"\\]|\\.)*"|-?\d+)')
+
+
+def event_stream(event, cpu_id):
+    """
+    The stream of an event: its tracing domain (kernel or userspace) and CPU,
+    the streams LTTng writes and flushes independently.
+    """
+    return f"{'ust' if ':' in event else 'kernel'}/{cpu_id}"
+
+
+def ndjson_streams(text):
+    """
+    :return: A dictionary keyed by the streams of the events of a NDJSON text
+        (see `event_stream`) with [last timestamp, number of events at the
+        last timestamp, number of events] values
+    """
+    streams = {}
+    for line in text.splitlines():
+        fields = {}
+        for name, value in STREAM_FIELDS.findall(line):
+            fields.setdefault(name, value)
+        if "timestamp" not in fields:
+            continue
+        timestamp = int(fields["timestamp"])
+        stream = event_stream(json.loads(fields.get("event", '""')), fields.get("cpu_id"))
+        last = streams.setdefault(stream, [timestamp, 0, 0])
+        if timestamp != last[0]:
+            last[0], last[1] = timestamp, 0
+        last[1] += 1
+        last[2] += 1
+    return streams
+
+
+class TraceCheckpoint:
+    """
+    Checkpoint of the conversion of a trace to trace.ndjson.
+
+    :param path: The checkpoint file
+    :param fingerprint: Fingerprint of the raw trace, see `trace_fingerprint`
+    :param selection: Description of the event selection; a checkpoint of a
+        different selection is discarded
+    """
+
+    def __init__(self, path, fingerprint=None, selection=""):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.selection = selection
+        # Post processing stages run concurrently and record their completion
+        # while the conversion records checkpoints
+        self.lock = threading.Lock()
+        self.reset()
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+            if state.get("version") == CHECKPOINT_VERSION:
+                self.stages = state.get("stages", {})
+                if state.get("selection") == selection:
+                    self.output_offset = state["output_offset"]
+                    self.events = state["events"]
+                    self.last_timestamp = state["last_timestamp"]
+                    self.streams = state["streams"]
+                    self.complete = state["complete"]
+
+    def reset(self):
+        self.output_offset = 0
+        self.events = 0
+        self.last_timestamp = None
+        # [last timestamp, number of events at the last timestamp] of every stream
+        self.streams = {}
+        self.complete = None
+        # The streams of a resumed conversion, counting down the events still
+        # to be skipped, until the last timestamp of all streams is passed
+        self.resume_streams = {}
+        self.previous_timestamp = None
+        self.delta_timestamp = None
+
+    def save(self):
+        """Atomically replace the checkpoint file."""
+        with self.lock:
+            state = {
+                "version": CHECKPOINT_VERSION,
+                "selection": self.selection,
+                "output_offset": self.output_offset,
+                "events": self.events,
+                "last_timestamp": self.last_timestamp,
+                "streams": self.streams,
+                "complete": self.complete,
+                "stages": self.stages,
+            }
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w") as f:
+                f.write(json.dumps(state))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, self.path)
+
+    def is_done(self, stage):
+        """Whether `stage` completed for the current state of the raw trace."""
+        return self.fingerprint is not None and self.stages.get(stage) == self.fingerprint
+
+    def stage_done(self, stage):
+        self.stages[stage] = self.fingerprint
+        self.save()
+
+    @property
+    def conversion_done(self):
+        return self.fingerprint is not None and self.complete == self.fingerprint
+
+    @property
+    def resume_timestamp(self):
+        """
+        Timestamp to resume the conversion at, the earliest last timestamp of
+        the streams, None to convert from the start.
+        """
+        if not self.streams:
+            return self.last_timestamp
+        return min(timestamp for timestamp, _ in self.streams.values())
+
+    def can_resume(self, output_file):
+        """
+        Whether the NDJSON output holds everything up to the last checkpoint,
+        the checkpoint is reset when it does not, e.g. because the output was
+        compressed or removed.
+        """
+        if self.last_timestamp is not None and os.path.exists(output_file) and os.path.getsize(output_file) >= self.output_offset:
+            return True
+        if self.last_timestamp is not None:
+            print(f"{output_file} is missing or shorter than its checkpoint, converting the whole trace")
+        self.reset()
+        return False
+
+    def resume_from(self, output_file):
+        """
+        Timestamp to resume the conversion to `output_file` at, None to convert
+        from the start, see `can_resume` and `resume_timestamp`.
+        """
+        return self.resume_timestamp if self.can_resume(output_file) else None
+
+    def open_output(self, output_file):
+        """
+        Open the NDJSON output for appending, truncated to the last checkpoint.
+        Without a usable checkpoint the conversion starts over.
+        """
+        if self.can_resume(output_file):
+            os.truncate(output_file, self.output_offset)
+            print(f"Resuming the conversion of {output_file} after {self.events} events")
+            self.resume_streams = {stream: list(last) for stream, last in self.streams.items()}
+            self.previous_timestamp = self.last_timestamp
+            self.delta_timestamp = self.last_timestamp
+            return open(output_file, "a")
+        return open(output_file, "w")
+
+    def is_converted(self, event):
+        """
+        Whether an event of a resumed conversion was already written: it is
+        before the last checkpoint timestamp of its stream, or at that
+        timestamp and not more events than were written.
+        """
+        last = self.resume_streams.get(event_stream(event["event"], event.get("cpu_id")))
+        if last is None or event["timestamp"] > last[0]:
+            return False
+        if event["timestamp"] == last[0]:
+            if last[1] <= 0:
+                return False
+            last[1] -= 1
+        return True
+
+    def skip_converted(self, events):
+        """
+        Skip the events of a resumed conversion which were already written,
+        see `is_converted`, until the last timestamp of all streams is passed.
+        The `delta` of the first new event is relative to the last written one.
+        """
+        events = iter(events)
+        if self.previous_timestamp is None:
+            yield from events
+            return
+        for event in events:
+            timestamp = event["timestamp"]
+            if self.is_converted(event):
+                continue
+            if self.delta_timestamp is not None:
+                delta = timestamp - self.delta_timestamp
+                seconds, fraction = divmod(abs(delta), NS_PER_SECOND)
+                event["delta"] = delta
+                event["original_delta"] = f"{'-' if delta < 0 else '+'}{seconds}.{fraction:09d}"
+                self.delta_timestamp = None
+            yield event
+            if timestamp > self.previous_timestamp:
+                self.previous_timestamp = None
+                break
+        yield from events
+
+    def skip_converted_text(self, text):
+        """
+        `skip_converted` for a block of NDJSON text. Only the lines up to the
+        first new event are decoded.
+        """
+        if self.previous_timestamp is None:
+            return text
+        lines = text.splitlines(keepends=True)
+        kept = []
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            for event in self.skip_converted([json.loads(line)]):
+                kept.append(json.dumps(event, separators=(',', ':')) + "\n")
+            if self.previous_timestamp is None:
+                return "".join(kept) + "".join(lines[index + 1:])
+        return "".join(kept)
+
+    def commit(self, output, text):
+        """
+        Record that the NDJSON `text` was written to the `output` file.
+        """
+        count = text.count("\n")
+        if count == 0:
+            return
+        for stream, (timestamp, timestamp_count, stream_count) in ndjson_streams(text).items():
+            last = self.streams.get(stream)
+            if last is not None and last[0] == timestamp and timestamp_count == stream_count:
+                last[1] += timestamp_count
+            else:
+                self.streams[stream] = [timestamp, timestamp_count]
+            self.last_timestamp = timestamp if self.last_timestamp is None else max(self.last_timestamp, timestamp)
+        self.events += count
+        output.flush()
+        self.output_offset = output.tell()
+        self.save()
+
+    def finish(self, output):
+        """Record that the conversion of the current raw trace is complete."""
+        output.flush()
+        self.output_offset = output.tell()
+        self.complete = self.fingerprint
+        self.save()
+
+
+def write_ndjson_checkpointed(output_file, events, checkpoint, interval=CHECKPOINT_INTERVAL):
+    """
+    `write_ndjson_file` with checkpoints, resuming after the last checkpoint.
+
+    :param events: The events to convert, on a resumed conversion the ones
+        from `checkpoint.resume_from(output_file)` on are sufficient
+    :return: The number of events written by this call
+    """
+    count = 0
+    try:
+        with checkpoint.open_output(output_file) as f:
+            block = []
+            for event in checkpoint.skip_converted(events):
+                block.append(json.dumps(event, separators=(',', ':')))
+                if len(block) >= interval:
+                    count += write_block(f, block, checkpoint)
+            count += write_block(f, block, checkpoint)
+            checkpoint.finish(f)
+        print(f"NDJSON file written to {output_file} ({count} new records, {checkpoint.events} total)")
+        return count
+    except IOError as e:
+        print(f"Error writing to file: {e}")
+        sys.exit(1)
+
+
+def write_block(f, block, checkpoint):
+    if not block:
+        return 0
+    text = "\n".join(block) + "\n"
+    f.write(text)
+    checkpoint.commit(f, text)
+    count = len(block)
+    block.clear()
+    return count
+
+
+def append_ndjson_checkpointed(output_file, input_file, checkpoint, block_size=NDJSON_BLOCK_SIZE):
+    """
+    Append the NDJSON records of `input_file`, e.g. written by the native
+    `sink.ros2observer.ndjson` component, to `output_file` with checkpoints.
+    The records are copied without decoding them, except for the already
+    converted ones at the start of a resumed conversion.
+
+    :return: The number of events appended
+    """
+    count = 0
+    try:
+        with checkpoint.open_output(output_file) as f, open(input_file, "r") as source:
+            remainder = ""
+            while True:
+                data = source.read(block_size)
+                if not data:
+                    break
+                data = remainder + data
+                end = data.rfind("\n") + 1
+                remainder = data[end:]
+                text = checkpoint.skip_converted_text(data[:end])
+                f.write(text)
+                checkpoint.commit(f, text)
+                count += text.count("\n")
+            checkpoint.finish(f)
+        print(f"NDJSON file written to {output_file} ({count} new records, {checkpoint.events} total)")
+        return count
+    except IOError as e:
+        print(f"Error writing to file: {e}")
+        sys.exit(1)
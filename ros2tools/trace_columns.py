@@ -0,0 +1,292 @@
+import os
+import sys
+from array import array
+
+import numpy as np
+
+try:
+    from ros2tools.util import read_ndjson_file
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from util import read_ndjson_file
+
+
+# trace_columns.py stores converted trace events column-wise, one group of
+# typed columns per event class (e.g. `ros2:callback_start`), in a NumPy .npz
+# archive. Every column is a separate member of the archive, so readers only
+# load the columns they actually use.
+#
+# Archive layout:
+#   <event>/<column>          int64, uint64 or float64 values, or int32 codes
+#                             for string columns
+#   <event>/<column>.strings  the interned string table of a string column
+
+COLUMN_SEPARATOR = "/"
+STRING_TABLE_SUFFIX = ".strings"
+
+# Keys which only carry the textual form of data that is already stored in
+# typed columns
+SKIPPED_KEYS = ("event", "data", "original_timestamp", "original_delta")
+
+
+class _Column:
+    """
+    A typed, append-only column. The type is inferred from the first value:
+    integers are stored as int64, hexadecimal strings (handles/pointers) as
+    uint64, reals as float64 and any other strings as int32 codes into an
+    interned string table. Columns are widened to float64 or strings when a
+    later value does not fit.
+    """
+
+    DEFAULTS = {"int": 0, "hex": 0, "float": float("nan"), "str": ""}
+
+    def __init__(self, kind, length):
+        self.kind = None
+        self.values = None
+        self.strings = {}
+        self._set_kind(kind)
+        for _ in range(length):
+            self.append_default()
+
+    @staticmethod
+    def kind_of(value):
+        if isinstance(value, bool):
+            return "int"
+        if isinstance(value, int):
+            return "int" if -2**63 <= value < 2**63 else "str"
+        if isinstance(value, float):
+            return "float"
+        if isinstance(value, str) and value[:2] in ("0x", "0X"):
+            try:
+                if int(value, 16) < 2**64:
+                    return "hex"
+            except ValueError:
+                pass
+        return "str"
+
+    def _set_kind(self, kind):
+        self.kind = kind
+        self.values = array({"int": "q", "hex": "Q", "float": "d", "str": "i"}[kind])
+
+    def _decoded(self):
+        if self.kind == "str":
+            table = list(self.strings)
+            return [table[code] for code in self.values]
+        if self.kind == "hex":
+            return [hex(value) for value in self.values]
+        return list(self.values)
+
+    def _widen(self, kind):
+        previous = self._decoded()
+        self.strings = {}
+        self._set_kind(kind)
+        for value in previous:
+            self.append(value)
+
+    def _intern(self, value):
+        code = self.strings.get(value)
+        if code is None:
+            code = self.strings[value] = len(self.strings)
+        return code
+
+    def append(self, value):
+        kind, value_type = self.kind, type(value)
+        try:
+            if kind == "str" and value_type is str:
+                self.values.append(self._intern(value))
+                return
+            if kind == "hex" and value_type is str and value[:2] in ("0x", "0X"):
+                self.values.append(int(value, 16))
+                return
+            if (kind == "int" and value_type is int) or (kind == "float" and value_type is float):
+                self.values.append(value)
+                return
+        except (ValueError, OverflowError):
+            pass
+        self._append_converted(value)
+
+    def _append_converted(self, value):
+        kind = self.kind_of(value)
+        if kind != self.kind:
+            if self.kind == "float" and kind == "int":
+                value = float(value)
+            elif self.kind == "int" and kind == "float":
+                self._widen("float")
+            elif self.kind == "hex" and kind == "int" and value >= 0:
+                value = hex(value)
+            elif self.kind != "str":
+                self._widen("str")
+
+        if self.kind == "str":
+            self.values.append(self._intern(str(value)))
+        elif self.kind == "hex":
+            self.values.append(int(value, 16))
+        else:
+            self.values.append(value)
+
+    def append_default(self):
+        if self.kind == "str":
+            self.values.append(self._intern(""))
+        else:
+            self.values.append(self.DEFAULTS[self.kind])
+
+    def arrays(self):
+        dtype = {"int": np.int64, "hex": np.uint64, "float": np.float64, "str": np.int32}[self.kind]
+        arrays = {"": np.frombuffer(self.values, dtype=dtype)}
+        if self.kind == "str":
+            arrays[STRING_TABLE_SUFFIX] = np.array(list(self.strings), dtype=np.str_)
+        return arrays
+
+
+class _EventClassColumns:
+    def __init__(self):
+        self.length = 0
+        self.columns = {}
+
+    def add(self, event):
+        appended = 0
+        for key, value in event.items():
+            if key in SKIPPED_KEYS:
+                continue
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = _Column(_Column.kind_of(value), self.length)
+            column.append(value)
+            appended += 1
+        self.length += 1
+        if appended < len(self.columns):
+            for column in self.columns.values():
+                if len(column.values) < self.length:
+                    column.append_default()
+
+
+class ColumnarTraceWriter:
+    """
+    Collects converted trace events into typed per-event-class columns and
+    writes them to a NumPy .npz archive.
+
+    Usage:
+        writer = ColumnarTraceWriter("trace.npz")
+        for event in events:
+            writer.add(event)
+        writer.close()
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.event_classes = {}
+        self.count = 0
+
+    def add(self, event):
+        name = event.get("event")
+        if name is None:
+            return
+        event_class = self.event_classes.get(name)
+        if event_class is None:
+            event_class = self.event_classes[name] = _EventClassColumns()
+        event_class.add(event)
+        self.count += 1
+
+    def close(self):
+        arrays = {}
+        for name, event_class in self.event_classes.items():
+            for key, column in event_class.columns.items():
+                for suffix, values in column.arrays().items():
+                    arrays[f"{name}{COLUMN_SEPARATOR}{key}{suffix}"] = values
+        with open(self.output_file, "wb") as f:
+            np.savez(f, **arrays)
+        print(f"Columnar trace written to {self.output_file} ({self.count} events, {len(self.event_classes)} event classes)")
+
+
+def write_columnar_trace(output_file, events):
+    """
+    Write an iterable of converted trace events to a columnar .npz archive.
+
+    :param output_file: Path of the .npz archive to write
+    :param events: Iterable of event dictionaries, e.g. from `read_ndjson_file`
+    :return: The number of events written
+    """
+    writer = ColumnarTraceWriter(output_file)
+    for event in events:
+        writer.add(event)
+    writer.close()
+    return writer.count
+
+
+class ColumnarTrace:
+    """
+    Read access to a columnar trace archive written by `ColumnarTraceWriter`.
+    Columns are loaded lazily and individually.
+
+    Usage:
+        trace = ColumnarTrace("trace.npz")
+        starts = trace.load("ros2:callback_start", ["timestamp", "callback"])
+        starts["timestamp"]   # numpy int64 array
+    """
+
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self._npz = np.load(input_file, allow_pickle=False)
+        self._columns = {}
+        for key in self._npz.files:
+            if key.endswith(STRING_TABLE_SUFFIX):
+                continue
+            name, column = key.split(COLUMN_SEPARATOR, 1)
+            self._columns.setdefault(name, []).append(column)
+
+    @property
+    def event_classes(self):
+        return sorted(self._columns)
+
+    def columns(self, event):
+        return list(self._columns.get(event, []))
+
+    def __len__(self):
+        return sum(self.length(name) for name in self._columns)
+
+    def length(self, event):
+        if event not in self._columns:
+            return 0
+        return len(self.column(event, "timestamp", decode=False))
+
+    def has_column(self, event, column):
+        return column in self._columns.get(event, ())
+
+    def is_string_column(self, event, column):
+        return f"{event}{COLUMN_SEPARATOR}{column}{STRING_TABLE_SUFFIX}" in self._npz.files
+
+    def column(self, event, column, decode=True):
+        """
+        Load a single column. String columns are returned decoded, or as
+        int32 codes together with their string table with `decode=False`
+        (as a tuple of (codes, strings)).
+        """
+        key = f"{event}{COLUMN_SEPARATOR}{column}"
+        values = self._npz[key]
+        if self.is_string_column(event, column):
+            strings = self._npz[key + STRING_TABLE_SUFFIX]
+            if not decode:
+                return values, strings
+            return strings[values] if len(strings) else np.array([""] * len(values))
+        return values
+
+    def load(self, event, columns=None):
+        """
+        Load several columns of an event class as a dictionary of arrays.
+
+        :param event: The event class name, e.g. `ros2:callback_start`
+        :param columns: Column names to load, all columns if None
+        """
+        names = self.columns(event) if columns is None else columns
+        return {name: self.column(event, name) for name in names if self.has_column(event, name)}
+
+    def close(self):
+        self._npz.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python3 trace_columns.py <trace.ndjson> <trace.npz>")
+        sys.exit(1)
+
+    write_columnar_trace(sys.argv[2], read_ndjson_file(sys.argv[1]))
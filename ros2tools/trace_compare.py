@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from ros2tools.callback_analysis import open_columnar_trace, pair_callbacks, load_callback_registry, process_names, grouped_statistics, group_boundaries, format_handle
+    from ros2tools.message_flow import match_messages
+    from ros2tools.util import write_json_file
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from callback_analysis import open_columnar_trace, pair_callbacks, load_callback_registry, process_names, grouped_statistics, group_boundaries, format_handle
+    from message_flow import match_messages
+    from util import write_json_file
+
+
+# trace_compare.py compares two traces of the same scenario, e.g. before and
+# after a release, for `ros2-tracer compare A B`. For both traces the
+# distributions of three metrics are computed in a separate process each:
+#   callback    duration of every callback (by node and topic/service/timer,
+#               handles differ between runs)
+#   topic       publish to subscription callback latency of every topic
+#   process     duration of all callbacks of a process (by node names)
+# A worker only loads the columns it needs and returns at most `max_samples`
+# values per distribution, a uniform subsample beyond that. The percentiles are
+# computed from all values before subsampling, the KS distance from the
+# samples. Only what a worker returns is bounded: the worker itself holds the
+# callback start/end columns and the message join of its trace (see
+# `pair_callbacks` and `match_messages`), its memory grows with the number of
+# events like the other columnar analyses.
+
+METRICS = ["callback", "topic", "process"]
+COMPARED_PERCENTILES = ["p50", "p90", "p99"]
+MAX_SAMPLES = 100_000
+THRESHOLD_PERCENT = 10.0
+KS_THRESHOLD = 0.1
+MIN_COUNT = 30
+REGRESSION_EXIT_CODE = 2
+
+
+def trace_file_of(path):
+    """The columnar trace of a trace directory, or `path` itself."""
+    if os.path.isdir(path):
+        return os.path.join(path, "trace.npz")
+    return path
+
+
+def name_codes(names):
+    """Codes for a list of names, equal names get the same code: a tuple (codes, unique names)."""
+    unique = sorted(set(names))
+    numbers = {name: number for number, name in enumerate(unique)}
+    return np.array([numbers[name] for name in names], dtype=np.int64), unique
+
+
+def distributions(codes, names, values, max_samples, seed=0):
+    """
+    The distribution of `values` per name: the statistics of all values and at
+    most `max_samples` sorted samples.
+
+    :param codes: The index into `names` of every value
+    :return: A dictionary keyed by the names with (statistics, samples) values
+    """
+    if not len(values):
+        return {}
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    boundaries = group_boundaries(codes)
+    statistics = grouped_statistics(values, boundaries)
+    generator = np.random.default_rng(seed)
+    result = {}
+    for group, (start, end) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+        samples = values[start:end]
+        if len(samples) > max_samples:
+            samples = np.sort(generator.choice(samples, max_samples, replace=False))
+        result[names[codes[start]]] = ({name: column[group].item() for name, column in statistics.items()}, samples)
+    return result
+
+
+def trace_metrics(path, max_samples=MAX_SAMPLES):
+    """
+    The `METRICS` distributions of a trace, see `distributions`. Runs in a
+    worker process, which loads all callback and message events of the trace.
+    """
+    trace = open_columnar_trace(trace_file_of(path))
+    executions = pair_callbacks(trace)
+    registry, _ = load_callback_registry(trace)
+    procnames = process_names(trace)
+    durations = executions["duration"]
+
+    # Callbacks and processes are named once per (vpid, handle) and vpid
+    pairs, inverse = np.unique(np.stack((executions["vpid"].astype(np.uint64), executions["callback"])), axis=1, return_inverse=True)
+    callback_names = [" ".join(registry.callback_name(vpid, format_handle(callback), procnames.get(vpid))) for vpid, callback in zip(*pairs.tolist())]
+    callback_codes, callback_names = name_codes(callback_names)
+    vpids, vpid_inverse = np.unique(executions["vpid"], return_inverse=True)
+    process_codes, process_labels = name_codes([registry.process_name(vpid, procnames.get(vpid)) for vpid in vpids.tolist()])
+
+    messages = match_messages(trace)
+    trace.close()
+    return {
+        "callback": distributions(callback_codes[inverse.reshape(-1)], callback_names, durations, max_samples),
+        "topic": distributions(messages["topic"], messages["topics"], messages["callback_start"] - messages["publish"], max_samples),
+        "process": distributions(process_codes[vpid_inverse.reshape(-1)], process_labels, durations, max_samples),
+    }
+
+
+def ks_distance(samples_a, samples_b):
+    """The two sample Kolmogorov-Smirnov statistic of two sorted samples."""
+    values = np.concatenate((samples_a, samples_b))
+    cdf_a = np.searchsorted(samples_a, values, side="right") / len(samples_a)
+    cdf_b = np.searchsorted(samples_b, values, side="right") / len(samples_b)
+    return float(np.abs(cdf_a - cdf_b).max())
+
+
+def ks_pvalue(distance, count_a, count_b):
+    """The asymptotic p-value of a KS distance of two samples of the given sizes."""
+    effective = math.sqrt(count_a * count_b / (count_a + count_b))
+    scaled = (effective + 0.12 + 0.11 / effective) * distance
+    if scaled < 0.2:
+        return 1.0
+    return max(0.0, min(1.0, 2 * sum((-1) ** (k - 1) * math.exp(-2 * k * k * scaled * scaled) for k in range(1, 101))))
+
+
+def compare_distributions(a, b, threshold_percent=THRESHOLD_PERCENT, ks_threshold=KS_THRESHOLD, min_count=MIN_COUNT):
+    """
+    Compare the distributions of one metric key in trace A and trace B.
+    B regresses when it has enough values, its distribution differs by more
+    than `ks_threshold` and a compared percentile increased by more than
+    `threshold_percent`.
+    """
+    (statistics_a, samples_a), (statistics_b, samples_b) = a, b
+    result = {"count_a": statistics_a["count"], "count_b": statistics_b["count"]}
+    increased = []
+    for percentile in COMPARED_PERCENTILES:
+        value_a, value_b = statistics_a[percentile], statistics_b[percentile]
+        change = (value_b - value_a) / value_a * 100 if value_a else None
+        result[percentile] = {"a": value_a, "b": value_b, "delta": value_b - value_a, "percent": change}
+        if change is not None and change > threshold_percent:
+            increased.append(percentile)
+    distance = ks_distance(samples_a, samples_b)
+    result["ks_distance"] = distance
+    result["ks_pvalue"] = ks_pvalue(distance, len(samples_a), len(samples_b))
+    enough = min(statistics_a["count"], statistics_b["count"]) >= min_count
+    result["regression"] = bool(enough and distance > ks_threshold and increased)
+    result["increased"] = increased
+    return result
+
+
+def compare_traces(path_a, path_b, max_samples=MAX_SAMPLES, **thresholds):
+    """
+    Compare the metrics of two traces, which are processed in parallel.
+
+    :param path_a: The baseline trace, a trace directory, trace.npz or trace.ndjson
+    :param path_b: The trace compared with the baseline
+    :param thresholds: `threshold_percent`, `ks_threshold` and `min_count`, see `compare_distributions`
+    :return: A dictionary with the comparison of every metric and key and the list of regressions
+    """
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        metrics_a, metrics_b = executor.map(trace_metrics, [path_a, path_b], [max_samples, max_samples])
+    comparison = {"a": path_a, "b": path_b, "thresholds": thresholds, "metrics": {}, "regressions": []}
+    for metric in METRICS:
+        a, b = metrics_a[metric], metrics_b[metric]
+        compared = {key: compare_distributions(a[key], b[key], **thresholds) for key in sorted(set(a) & set(b))}
+        comparison["metrics"][metric] = {
+            "compared": compared,
+            "only_a": sorted(set(a) - set(b)),
+            "only_b": sorted(set(b) - set(a)),
+        }
+        comparison["regressions"] += [{"metric": metric, "key": key, **result} for key, result in compared.items() if result["regression"]]
+    return comparison
+
+
+def print_comparison(comparison):
+    print(f"{'metric':<9} {'key':<48} {'p50 A':>10} {'p50 B':>10} {'p99 A':>10} {'p99 B':>10} {'p99 %':>7} {'KS':>5}")
+    for metric, compared in comparison["metrics"].items():
+        for key, result in compared["compared"].items():
+            change = result["p99"]["percent"]
+            flag = "  REGRESSION" if result["regression"] else ""
+            print(
+                f"{metric:<9} {key[:48]:<48} {result['p50']['a'] / 1e3:>10.1f} {result['p50']['b'] / 1e3:>10.1f} "
+                f"{result['p99']['a'] / 1e3:>10.1f} {result['p99']['b'] / 1e3:>10.1f} "
+                f"{'-' if change is None else f'{change:+.1f}':>7} {result['ks_distance']:>5.2f}{flag}"
+            )
+        for key in compared["only_a"]:
+            print(f"{metric:<9} {key[:48]:<48} only in A")
+        for key in compared["only_b"]:
+            print(f"{metric:<9} {key[:48]:<48} only in B")
+    print("Values in us.")
+    print(f"{len(comparison['regressions'])} regressions")
+
+
+def compare_main(argv=None):
+    """
+    `ros2-tracer compare A B`: compare two traces, write the comparison as JSON
+    and return the exit code, `REGRESSION_EXIT_CODE` if B regressed.
+    """
+    parser = argparse.ArgumentParser(prog="ros2-tracer compare", description="Compare the callback, topic and process latency distributions of two traces and flag regressions of B against A")
+    parser.add_argument("a", help="Baseline trace: trace directory, trace.npz or trace.ndjson")
+    parser.add_argument("b", help="Trace compared with the baseline")
+    parser.add_argument("-o", "--output", default="compare.json", help="JSON output file. Default is compare.json.")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD_PERCENT, help=f"Percent increase of p50, p90 or p99 which is a regression. Default is {THRESHOLD_PERCENT}.")
+    parser.add_argument("--ks-threshold", type=float, default=KS_THRESHOLD, help=f"Minimum KS distance of a regression. Default is {KS_THRESHOLD}.")
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT, help=f"Minimum number of values in both traces to flag a regression. Default is {MIN_COUNT}.")
+    parser.add_argument("--max-samples", type=int, default=MAX_SAMPLES, help=f"Maximum samples per distribution kept for the KS distance. Default is {MAX_SAMPLES}.")
+    parser.add_argument("--pretty", action="store_true", help="Write indented JSON, the output is compact by default.")
+    args = parser.parse_args(argv)
+
+    for path in (args.a, args.b):
+        if not os.path.exists(trace_file_of(path)):
+            print(f"ERROR: There is no trace: {trace_file_of(path)}", file=sys.stderr)
+            return 1
+    comparison = compare_traces(args.a, args.b, args.max_samples, threshold_percent=args.threshold, ks_threshold=args.ks_threshold, min_count=args.min_count)
+    print_comparison(comparison)
+    write_json_file(args.output, comparison, args.pretty)
+    return REGRESSION_EXIT_CODE if comparison["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(compare_main())
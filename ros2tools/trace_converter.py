@@ -2,6 +2,17 @@ import re
 import json
 import datetime
 import time
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+try:
+    from ros2tools.util import read_ndjson_file, write_ndjson_file, read_json_file, open_file, compression_extension, write_compact_json, JSON_SEPARATORS
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from util import read_ndjson_file, write_ndjson_file, read_json_file, open_file, compression_extension, write_compact_json, JSON_SEPARATORS
 
 
 # trace_converter.py provides procedural parsing to JSON for babeltrace2 log files
@@ -26,41 +37,123 @@ def flatten_dict(d, parent_key='', sep='.'):
             items.append((new_key, v))
     return dict(items)
 
-def convert_timestamp_to_unix_ns(timestamp_str):
+NS_PER_SECOND = 1_000_000_000
+
+# Keys of the event header; payload fields of the same name (e.g. the source
+# `timestamp` of `ros2:rmw_publish`) are stored with a "payload_" prefix
+HEADER_KEYS = ("timestamp", "delta", "hostname", "event")
+
+def payload_key(key):
+    return f"payload_{key}" if key in HEADER_KEYS else key
+SECONDS_PER_DAY = 24 * 60 * 60
+TRACE_CREATION_DATETIME_PATTERN = re.compile(r'trace_creation_datetime\s*=\s*"(\d{8})T')
+
+def split_seconds(seconds_str):
+    """
+    Convert a decimal seconds string like "1714561909.443960423" or
+    "+0.000014778" to integer nanoseconds without going through a float.
+    """
+    sign = 1
+    if seconds_str[:1] in ("+", "-"):
+        sign = -1 if seconds_str[0] == "-" else 1
+        seconds_str = seconds_str[1:]
+    seconds, _, fraction = seconds_str.partition(".")
+    nanoseconds = int(fraction.ljust(9, "0")[:9]) if fraction else 0
+    return sign * (int(seconds or 0) * NS_PER_SECOND + nanoseconds)
+
+def read_trace_date(trace_directory):
+    """
+    Read the trace creation date from the CTF metadata of a LTTng trace
+    (`env.trace_creation_datetime`).
+
+    :param trace_directory: A directory containing one or more CTF traces
+    :return: The creation date as `datetime.date` or None if it is not found
+    """
+    for root, _, files in os.walk(trace_directory):
+        if "metadata" not in files:
+            continue
+        try:
+            with open(os.path.join(root, "metadata"), "rb") as f:
+                match = TRACE_CREATION_DATETIME_PATTERN.search(f.read().decode(errors="ignore"))
+        except OSError:
+            continue
+        if match:
+            return datetime.datetime.strptime(match.group(1), "%Y%m%d").date()
+    return None
+
+class TimestampDecoder:
     """
-    Convert a timestamp string like "11:11:49.443960423" to a Unix timestamp in nanoseconds.
+    Decodes babeltrace2 text timestamps to exact integer Unix nanoseconds.
+
+    Supported formats:
+        1714561909.443960423             `babeltrace2 --clock-seconds`
+        2024-05-01 11:11:49.443960423    `babeltrace2 --clock-date`
+        11:11:49.443960423               default, time of day only
+
+    Time of day timestamps are placed on `base_date` (the trace creation date,
+    see `read_trace_date`, today if unknown). Timestamps are expected in trace
+    order; when the time of day jumps back by more than half a day the trace
+    crossed midnight and the following timestamps are moved to the next day.
+    The date/time to seconds conversion is only done when the `HH:MM:SS`
+    part changes, all other work is integer arithmetic.
+    """
+
+    def __init__(self, base_date=None):
+        self.date = base_date or datetime.datetime.now().date()
+        self.last_time_of_day = None
+        self.last_seconds = None
+        self.last_seconds_ns = None
+
+    def decode(self, timestamp_str):
+        """
+        :return: Unix timestamp in nanoseconds or None if it can not be decoded
+        """
+        try:
+            seconds, _, fraction = timestamp_str.partition(".")
+            nanoseconds = int(fraction.ljust(9, "0")[:9]) if fraction else 0
+            if seconds != self.last_seconds:
+                self.last_seconds_ns = self.decode_seconds(seconds)
+                self.last_seconds = seconds
+            return self.last_seconds_ns + nanoseconds
+        except Exception as e:
+            print(f"Error converting timestamp '{timestamp_str}': {e}")
+            return None
+
+    def decode_seconds(self, seconds):
+        if ":" not in seconds:
+            return int(seconds) * NS_PER_SECOND
+
+        date = self.date
+        if " " in seconds:
+            date_str, seconds = seconds.split(" ", 1)
+            date = datetime.date.fromisoformat(date_str)
+        hours, minutes, secs = seconds.split(":")
+        time_of_day = datetime.time(int(hours), int(minutes), int(secs))
+
+        if date is self.date:
+            current = int(hours) * 3600 + int(minutes) * 60 + int(secs)
+            if self.last_time_of_day is not None and self.last_time_of_day - current > SECONDS_PER_DAY // 2:
+                self.date = date = date + datetime.timedelta(days=1)
+            self.last_time_of_day = current
+
+        return int(datetime.datetime.combine(date, time_of_day).timestamp()) * NS_PER_SECOND
+
+def convert_timestamp_to_unix_ns(timestamp_str, base_date=None):
+    """
+    Convert a timestamp string like "11:11:49.443960423", "2024-05-01 11:11:49.443960423"
+    or "1714561909.443960423" to a Unix timestamp in nanoseconds.
+    For decoding many timestamps in trace order use `TimestampDecoder`.
     
     :param timestamp_str: The timestamp string to convert
+    :param base_date: Date of time of day only timestamps, default is today
     :return: Unix timestamp in nanoseconds as a 64-bit integer
     """
-    try:
-        today = datetime.datetime.now().date()
-        
-        hours, minutes, seconds_frac = timestamp_str.split(':')
-        seconds_parts = seconds_frac.split('.')
-        seconds = seconds_parts[0]
-        
-        nanoseconds = 0
-        if len(seconds_parts) > 1:
-            nano_str = seconds_parts[1].ljust(9, '0')[:9]
-            nanoseconds = int(nano_str)
-        
-        dt = datetime.datetime.combine(
-            today,
-            datetime.time(int(hours), int(minutes), int(seconds))
-        )
-        
-        unix_seconds = int(dt.timestamp())
-        unix_ns = unix_seconds * 1_000_000_000 + nanoseconds
-        
-        return int(unix_ns)
-    except Exception as e:
-        print(f"Error converting timestamp '{timestamp_str}': {e}")
-        return None
+    return TimestampDecoder(base_date).decode(timestamp_str)
 
 def convert_delta_to_ns(delta_str):
     """
     Convert a delta string like "+0.000014778" to nanoseconds as a 64-bit integer.
+    The conversion is exact, no floating point arithmetic is involved.
     
     :param delta_str: The delta string to convert
     :return: Delta in nanoseconds as a 64-bit integer
@@ -68,14 +161,7 @@ def convert_delta_to_ns(delta_str):
     try:
         if "?" in delta_str:
             return 0
-            
-        if delta_str.startswith('+'):
-            delta_str = delta_str[1:]
-        
-        delta_sec = float(delta_str)
-        delta_ns = int(delta_sec * 1_000_000_000)
-        
-        return int(delta_ns)
+        return split_seconds(delta_str)
     except Exception as e:
         print(f"Error converting delta '{delta_str}': {e}")
         return 0
@@ -99,66 +185,480 @@ def parse_value(value):
             pass
     return value
 
-def trace_log_to_dict(input_file):
-    pattern = re.compile(
-        r"""
-        \[(?P<timestamp>[^\]]+)\]\s+               # Timestamp in brackets
-        \((?P<delta>[^\)]+)\)\s+                   # Delta time in parentheses
-        (?P<hostname>[^\s]+)\s+                    # Hostname 
-        (?P<event>[^\:]+:[^\:]+):\s+               # Event name
-        (?P<data>.+)                               # Remaining data
-        """,
-        re.VERBOSE,
-    )
+TRACE_LINE_PATTERN = re.compile(
+    r"""
+    \[(?P<timestamp>[^\]]+)\]\s+               # Timestamp in brackets
+    \((?P<delta>[^\)]+)\)\s+                   # Delta time in parentheses
+    (?P<hostname>[^\s]+)\s+                    # Hostname 
+    (?P<event>[^\:]+:[^\:]+):\s+               # Event name
+    (?P<data>.+)                               # Remaining data
+    """,
+    re.VERBOSE,
+)
 
-    def parse_data_blocks(data):
-        result = []
-        for block in re.findall(r"\{([^\}]+)\}", data):
-            key_value_pairs = {}
-            for item in block.split(", "):
-                if "=" in item:
-                    key, value = item.split("=", 1)
-                    value = value.strip().strip('"')
-                    key_value_pairs[key.strip()] = parse_value(value)
-            result.append(key_value_pairs)
-        return result
+def parse_data_blocks(data):
+    """
+    Parse the `{ key = value, ... }` blocks of a babeltrace2 event line.
 
-    parsed_events = []
+    :param data: The data part of a babeltrace2 event line
+    :return: A list with one dictionary per data block
+    """
+    result = []
+    for block in re.findall(r"\{([^\}]+)\}", data):
+        key_value_pairs = {}
+        for item in block.split(", "):
+            if "=" in item:
+                key, value = item.split("=", 1)
+                value = value.strip().strip('"')
+                key_value_pairs[key.strip()] = parse_value(value)
+        result.append(key_value_pairs)
+    return result
+
+def parse_trace_line(line, timestamp_decoder=None):
+    """
+    Parse a single babeltrace2 text line into a flat event dictionary.
+
+    :param line: A line of `babeltrace2` text output
+    :param timestamp_decoder: The `TimestampDecoder` of the trace, a new one
+                              dated today if None
+    :return: The parsed event or None if the line does not match
+    """
+    match = TRACE_LINE_PATTERN.match(line.strip())
+    if not match:
+        return None
+
+    event = match.groupdict()
+
+    original_timestamp = event["timestamp"]
+    timestamp_decoder = timestamp_decoder or TimestampDecoder()
+    unix_timestamp_ns = timestamp_decoder.decode(original_timestamp)
+    if unix_timestamp_ns is not None:
+        event["original_timestamp"] = original_timestamp
+        event["timestamp"] = unix_timestamp_ns
+
+    original_delta = event["delta"]
+    delta_ns = convert_delta_to_ns(original_delta)
+    event["original_delta"] = original_delta
+    event["delta"] = delta_ns
+
+    data_blocks = parse_data_blocks(event["data"])
+    flattened_data = [flatten_dict(data_block) for data_block in data_blocks]
+    for data in flattened_data:
+        for key, value in data.items():
+            event[payload_key(key)] = parse_value(value)
+    return event
+
+INTEGER_PATTERN = re.compile(r"[+-]?\d+")
+
+def unquote(value):
+    return value[1:-1]
+
+def to_real(value):
+    float_val = float(value)
+    if float_val.is_integer():
+        return int(float_val)
+    return float_val
+
+def identity(value):
+    return value
+
+def field_converter(value):
+    """
+    Choose the converter for a field from its first observed raw value. The
+    converted results are the same as from `parse_value`, except that quoted
+    strings are always kept as strings.
+    """
+    if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+        return unquote
+    if INTEGER_PATTERN.fullmatch(value):
+        return int
+    if value[:2] in ("0x", "0X"):
+        return identity
+    try:
+        float(value)
+        return to_real
+    except ValueError:
+        return identity
+
+class TraceLineDecoder:
+    """
+    Fast babeltrace2 text line parser which caches the field layout of each
+    event class.
+
+    The first line of an event class is split into its `key = value` fields
+    and a schema is stored: the field keys in order and one converter per
+    field, chosen from the first value. Later lines of the same class are
+    split once with `str.split` and each value is converted exactly once by
+    its cached converter. Lines whose layout does not match the schema are
+    handed to the regex based `parse_trace_line`.
+
+    Usage:
+        decoder = TraceLineDecoder(read_trace_date(trace_directory))
+        event = decoder.decode(line)
+    """
+
+    def __init__(self, base_date=None):
+        self.schemas = {}
+        self.timestamps = TimestampDecoder(base_date)
+
+    @staticmethod
+    def split_fields(data):
+        if not (data.startswith("{ ") and data.endswith(" }")):
+            return None
+        return data[2:-2].replace(" }, { ", ", ").split(", ")
+
+    def learn(self, event_name, fields):
+        keys = []
+        prefixes = []
+        converters = []
+        for field in fields:
+            key, separator, value = field.partition(" = ")
+            if not separator:
+                return None
+            keys.append(payload_key(key))
+            prefixes.append(len(key) + 3)
+            converters.append(field_converter(value))
+        schema = (len(fields), tuple(zip(keys, prefixes, converters)))
+        self.schemas[event_name] = schema
+        return schema
+
+    def decode(self, line):
+        """
+        Parse a single babeltrace2 text line.
+
+        :param line: A line of `babeltrace2` text output
+        :return: The parsed event or None if the line does not match
+        """
+        line = line.strip()
+        timestamp_end = line.find("] (")
+        delta_end = line.find(") ", timestamp_end + 3)
+        hostname_end = line.find(" ", delta_end + 2)
+        event_end = line.find(": ", hostname_end + 1)
+        if line[:1] != "[" or timestamp_end < 0 or delta_end < 0 or hostname_end < 0 or event_end < 0:
+            return parse_trace_line(line, self.timestamps)
+
+        event_name = line[hostname_end + 1:event_end]
+        data = line[event_end + 2:]
+        fields = self.split_fields(data)
+        if fields is None:
+            return parse_trace_line(line, self.timestamps)
+
+        schema = self.schemas.get(event_name) or self.learn(event_name, fields)
+        if schema is None or schema[0] != len(fields):
+            return parse_trace_line(line, self.timestamps)
+
+        original_timestamp = line[1:timestamp_end]
+        original_delta = line[timestamp_end + 3:delta_end]
+        event = {
+            "timestamp": original_timestamp,
+            "delta": original_delta,
+            "hostname": line[delta_end + 2:hostname_end],
+            "event": event_name,
+            "data": data,
+        }
+
+        unix_timestamp_ns = self.timestamps.decode(original_timestamp)
+        if unix_timestamp_ns is not None:
+            event["original_timestamp"] = original_timestamp
+            event["timestamp"] = unix_timestamp_ns
+        event["original_delta"] = original_delta
+        event["delta"] = convert_delta_to_ns(original_delta)
+
+        try:
+            for field, (key, prefix, converter) in zip(fields, schema[1]):
+                event[key] = converter(field[prefix:])
+        except ValueError:
+            return parse_trace_line(line, self.timestamps)
+        return event
+
+def report_unmatched_lines(unmatched_count, unmatched_lines):
+    if unmatched_count:
+        print(f"Unmatched {unmatched_count} lines:")
+        for line in unmatched_lines[:5]:
+            print(line)
+
+def iter_trace_events(input_file, base_date=None):
+    """
+    Lazily parse a babeltrace2 text log, yielding one event dictionary per line.
+
+    Only the current line is held in memory, so arbitrarily large trace logs
+    can be converted with a flat memory footprint.
+
+    :param input_file: Path to the `babeltrace2` text log
+    :param base_date: Date of the first time of day only timestamp, see `TimestampDecoder`
+    :return: A generator of parsed event dictionaries
+    """
+    unmatched_count = 0
     unmatched_lines = []
 
+    decoder = TraceLineDecoder(base_date)
     with open(input_file, "r") as infile:
         for line in infile:
-            match = pattern.match(line.strip())
-            if match:
-                event = match.groupdict()
-                
-                original_timestamp = event["timestamp"]
-                unix_timestamp_ns = convert_timestamp_to_unix_ns(original_timestamp)
-                if unix_timestamp_ns is not None:
-                    event["original_timestamp"] = original_timestamp
-                    event["timestamp"] = unix_timestamp_ns
-                
-                original_delta = event["delta"]
-                delta_ns = convert_delta_to_ns(original_delta)
-                event["original_delta"] = original_delta
-                event["delta"] = delta_ns
-                
-                data_blocks = parse_data_blocks(event["data"])
-                flattened_data = [flatten_dict(data_block) for data_block in data_blocks]
-                for data in flattened_data:
-                    for key, value in data.items():
-                        data[key] = parse_value(value)
-                    event.update(data)
-                parsed_events.append(event)
+            event = decoder.decode(line)
+            if event is not None:
+                yield event
             else:
+                unmatched_count += 1
+                if len(unmatched_lines) < 5:
+                    unmatched_lines.append(line.strip())
+
+    report_unmatched_lines(unmatched_count, unmatched_lines)
+
+def trace_log_to_dict(input_file, base_date=None):
+    return list(iter_trace_events(input_file, base_date))
+
+# Size of the byte ranges handed to each parser worker. Small enough that the
+# bounded number of in-flight chunks keeps memory flat, large enough to
+# amortize the inter-process transfer.
+TRACE_LOG_CHUNK_SIZE = 8 * 1024 * 1024
+
+def split_trace_log(input_file, chunk_size=TRACE_LOG_CHUNK_SIZE):
+    """
+    Split a trace log into newline aligned byte ranges.
+
+    :param input_file: Path to the `babeltrace2` text log
+    :param chunk_size: Approximate size of each range in bytes
+    :return: A list of (start, end) byte offsets covering the whole file
+    """
+    size = os.path.getsize(input_file)
+    ranges = []
+    with open(input_file, 'rb') as f:
+        start = 0
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def trace_log_range_dates(input_file, ranges, base_date=None):
+    """
+    Determine the date at the start of each range of a trace log with time of
+    day only timestamps, by following the first timestamp of every range
+    across midnight. Each range is then decoded independently from its date.
+
+    :return: A list with one `datetime.date` per range
+    """
+    timestamps = TimestampDecoder(base_date)
+    dates = []
+    with open(input_file, 'rb') as f:
+        for start, _ in ranges:
+            f.seek(start)
+            line = f.readline().decode(errors="ignore")
+            if line.startswith("[") and "]" in line:
+                timestamps.decode(line[1:line.index("]")])
+            dates.append(timestamps.date)
+    return dates
+
+def parse_trace_log_text(text, base_date=None, selector=None):
+    """
+    Parse a block of complete trace log lines.
+    Only the events for which `selector(event)` is true are kept.
+
+    :return: A tuple (events, unmatched_count, unmatched_lines)
+    """
+    decoder = TraceLineDecoder(base_date)
+    events = []
+    unmatched_count = 0
+    unmatched_lines = []
+    for line in text.splitlines():
+        event = decoder.decode(line)
+        if event is not None:
+            if selector is None or selector(event):
+                events.append(event)
+        else:
+            unmatched_count += 1
+            if len(unmatched_lines) < 5:
                 unmatched_lines.append(line.strip())
+    return events, unmatched_count, unmatched_lines
 
-    if unmatched_lines:
-        print(f"Unmatched {len(unmatched_lines)} lines:")
-        for line in unmatched_lines[:5]:
-            print(line)
+def parse_trace_log_range(input_file, start, end, base_date=None, selector=None):
+    """
+    Parse the lines in the byte range [start, end) of a trace log, see
+    `parse_trace_log_text`.
+    """
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode()
+    return parse_trace_log_text(text, base_date, selector)
 
-    return parsed_events
+def encode_trace_log_text(text, base_date=None, selector=None):
+    """
+    Parse a block of trace log lines and encode the events as NDJSON text.
+
+    Encoding in the worker means the parent only has to write the result,
+    so the conversion scales with the number of workers.
+
+    :return: A tuple (ndjson_text, event_count, unmatched_count, unmatched_lines)
+    """
+    events, unmatched_count, unmatched_lines = parse_trace_log_text(text, base_date, selector)
+    text = "".join(json.dumps(event, separators=JSON_SEPARATORS) + "\n" for event in events)
+    return text, len(events), unmatched_count, unmatched_lines
+
+def encode_trace_log_range(input_file, start, end, base_date=None, selector=None):
+    """
+    `encode_trace_log_text` for the byte range [start, end) of a trace log.
+    """
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode()
+    return encode_trace_log_text(text, base_date, selector)
+
+def map_ordered(worker, tasks, jobs):
+    """
+    Run `worker(*task)` for all tasks in a process pool and yield the results
+    in task order. At most `2 * jobs` tasks are in flight at any time, so
+    `tasks` may be a lazy iterable, e.g. of blocks read from a pipe. With a
+    single job the tasks are processed in this process.
+    """
+    if jobs <= 1:
+        for task in tasks:
+            yield worker(*task)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(worker, *task))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def iter_trace_log_ranges(worker, input_file, jobs, chunk_size=TRACE_LOG_CHUNK_SIZE, base_date=None):
+    """
+    Run `worker(input_file, start, end, base_date)` over all ranges of a trace
+    log in a process pool and yield the results in file order, see
+    `map_ordered`.
+    """
+    ranges = split_trace_log(input_file, chunk_size)
+    dates = trace_log_range_dates(input_file, ranges, base_date)
+    tasks = ((input_file, start, end, date) for (start, end), date in zip(ranges, dates))
+    return map_ordered(worker, tasks, jobs)
+
+def iter_trace_log_stream(stream, chunk_size=TRACE_LOG_CHUNK_SIZE, base_date=None, tee=None):
+    """
+    Split a trace log read from a binary stream, e.g. the standard output of
+    `babeltrace2`, into newline aligned blocks while it is written.
+
+    :param tee: Optional binary file every block is also written to, e.g. trace.log
+    :return: A generator of (text, date) tuples, `date` is the date at the start
+        of the block, see `trace_log_range_dates`
+    """
+    timestamps = TimestampDecoder(base_date)
+    remainder = b""
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        if tee is not None:
+            tee.write(data)
+        data = remainder + data
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            remainder = data
+            continue
+        remainder = data[end:]
+        text = data[:end].decode()
+        if text.startswith("[") and "]" in text:
+            timestamps.decode(text[1:text.index("]")])
+        yield text, timestamps.date
+    if remainder:
+        text = remainder.decode()
+        if text.startswith("[") and "]" in text:
+            timestamps.decode(text[1:text.index("]")])
+        yield text, timestamps.date
+
+def iter_trace_events_parallel(input_file, jobs=None, chunk_size=TRACE_LOG_CHUNK_SIZE, base_date=None):
+    """
+    Parse a babeltrace2 text log on `jobs` processes, yielding the events in
+    the same order as `iter_trace_events`.
+    """
+    jobs = jobs or os.cpu_count()
+    if jobs <= 1:
+        yield from iter_trace_events(input_file, base_date)
+        return
+
+    unmatched_count = 0
+    unmatched_lines = []
+    for events, count, lines in iter_trace_log_ranges(parse_trace_log_range, input_file, jobs, chunk_size, base_date):
+        yield from events
+        unmatched_count += count
+        unmatched_lines.extend(lines[:5 - len(unmatched_lines)])
+
+    report_unmatched_lines(unmatched_count, unmatched_lines)
+
+def write_encoded_trace_log(results, output_file, checkpoint=None):
+    """
+    Write the results of `encode_trace_log_text` workers in order to a NDJSON
+    file, see `convert_trace_log`.
+
+    :return: The number of events written
+    """
+    count = 0
+    unmatched_count = 0
+    unmatched_lines = []
+    try:
+        with checkpoint.open_output(output_file) if checkpoint else open(output_file, 'w') as f:
+            for text, events, unmatched, lines in results:
+                if checkpoint:
+                    text = checkpoint.skip_converted_text(text)
+                    events = text.count("\n")
+                f.write(text)
+                if checkpoint:
+                    checkpoint.commit(f, text)
+                count += events
+                unmatched_count += unmatched
+                unmatched_lines.extend(lines[:5 - len(unmatched_lines)])
+            if checkpoint:
+                checkpoint.finish(f)
+    except IOError as e:
+        print(f"Error writing to file: {e}")
+        sys.exit(1)
+
+    report_unmatched_lines(unmatched_count, unmatched_lines)
+    print(f"NDJSON file written to {output_file} ({count} records)")
+    return count
+
+def convert_trace_log(input_file, output_file, jobs=1, base_date=None, selector=None, checkpoint=None):
+    """
+    Convert a babeltrace2 text log to a NDJSON file.
+
+    With `jobs` > 1 the log is split into newline aligned byte ranges which
+    are parsed and encoded by a pool of worker processes and written back in
+    order.
+
+    :param input_file: Path to the `babeltrace2` text log
+    :param output_file: Path of the NDJSON file to write
+    :param jobs: Number of parser processes, None for one per core
+    :param base_date: Date of the first time of day only timestamp, see `TimestampDecoder`
+    :param selector: Optional predicate, only events for which `selector(event)` is true are written, see `EventSelector`
+    :param checkpoint: Optional `TraceCheckpoint`, the output is appended to after its last checkpoint
+        and a checkpoint is recorded after every chunk
+    :return: The number of events written
+    """
+    jobs = jobs or os.cpu_count()
+    if jobs <= 1 and checkpoint is None:
+        return write_ndjson_file(output_file, filter(selector, iter_trace_events(input_file, base_date)))
+
+    worker = partial(encode_trace_log_range, selector=selector)
+    return write_encoded_trace_log(iter_trace_log_ranges(worker, input_file, jobs, base_date=base_date), output_file, checkpoint)
+
+def convert_trace_stream(stream, output_file, jobs=1, base_date=None, selector=None, checkpoint=None, tee=None):
+    """
+    Convert a babeltrace2 text log while it is read from a binary stream, e.g.
+    the standard output of a running `babeltrace2`. The conversion starts with
+    the first block of output instead of after the whole log was written.
+
+    :param stream: The binary stream of the `babeltrace2` text log
+    :param tee: Optional binary file the text log is also written to, e.g. trace.log
+    :return: The number of events written, see `convert_trace_log` for the other parameters
+    """
+    jobs = jobs or os.cpu_count()
+    worker = partial(encode_trace_log_text, selector=selector)
+    return write_encoded_trace_log(map_ordered(worker, iter_trace_log_stream(stream, base_date=base_date, tee=tee), jobs), output_file, checkpoint)
 
 def trace_log_to_dict_(input_file):
     pattern = re.compile(
@@ -216,12 +716,27 @@ def trace_log_to_dict_(input_file):
 
     return parsed_events
 
-class Int64Encoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, int):
-            return int(obj)
-        return super(Int64Encoder, self).default(obj)
+def save_to_json(parsed_events, output_file, pretty=False):
+    """
+    Write events as a JSON array, compact unless `pretty` is set and
+    compressed according to the file extension (.gz, .zst).
+    """
+    with open_file(output_file, 'w') as f:
+        if pretty:
+            f.write(json.dumps(parsed_events, indent=2))
+        else:
+            write_compact_json(f, parsed_events)
+
+def load_trace_events(trace_file):
+    """
+    Lazily load converted trace events from either a NDJSON (`.ndjson`) or a
+    JSON array (`.json`) trace file, optionally compressed (`.gz`, `.zst`).
+    """
+    if is_ndjson_file(trace_file):
+        yield from read_ndjson_file(trace_file)
+    else:
+        yield from read_json_file(trace_file)
 
-def save_to_json(parsed_events, output_file):
-    with open(output_file, 'w') as f:
-        json.dump(parsed_events, f, cls=Int64Encoder, indent=2)
+def is_ndjson_file(path):
+    extension = compression_extension(path)
+    return path[:len(path) - len(extension)].endswith('.ndjson')
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import sys
+
+try:
+    from ros2tools.trace_converter import load_trace_events
+    from ros2tools.trace_index import open_trace_reader
+    from ros2tools.trace_filter import parse_time
+    from ros2tools.live_trace import CallbackRegistry, REGISTRY_EVENTS
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_converter import load_trace_events
+    from trace_index import open_trace_reader
+    from trace_filter import parse_time
+    from live_trace import CallbackRegistry, REGISTRY_EVENTS
+
+
+# trace_export.py streams a converted trace into the JSON trace event format of
+# Chrome, which the Perfetto UI (ui.perfetto.dev) and chrome://tracing open:
+#   process/thread  every vpid is a process and every vtid a thread track
+#   callbacks       callback_start/callback_end are "B"/"E" duration slices,
+#                   named by the callback registry (topic, service or timer)
+#   publish         rclcpp_publish to rmw_publish is a "publish <topic>" slice,
+#                   the topic is resolved through rcl_publish or the
+#                   rmw_publisher_handle, rclcpp records a null publisher handle
+#   flows           a flow from the publish slice to the subscription callback
+#                   which handles the message
+# The events are written while they are read, in trace order. Only the
+# callback registry, the last publish and take of every thread and the last
+# publish of every topic are kept, so the memory does not grow with the trace.
+# Flows are identified by the topic and the source timestamp of a message on
+# ROS 2 Iron and later, see `message_flow.match_messages`. On older
+# distributions a take is linked to the latest publish on its topic.
+
+EXPORT_RCLCPP_PUBLISH = "ros2:rclcpp_publish"
+EXPORT_RCL_PUBLISH = "ros2:rcl_publish"
+EXPORT_RMW_PUBLISH = "ros2:rmw_publish"
+EXPORT_RMW_TAKE = "ros2:rmw_take"
+EXPORT_CALLBACK_START = "ros2:callback_start"
+EXPORT_CALLBACK_END = "ros2:callback_end"
+EXPORT_OUTPUT_FILE = "trace_events.json.gz"
+# Read from the start of the trace also when exporting a time range
+INIT_EVENTS = REGISTRY_EVENTS | {"ros2:rcl_publisher_init"}
+# Flow ids are JSON numbers, kept below 2**53 to be exact in JavaScript
+FLOW_ID_MASK = (1 << 53) - 1
+
+
+def event_time(event):
+    timestamp = event["timestamp"]
+    return int(float(timestamp)) if isinstance(timestamp, str) else timestamp
+
+
+def format_microseconds(ns):
+    """A ns duration as exact decimal us, the time unit of the trace event format."""
+    sign = "-" if ns < 0 else ""
+    return f"{sign}{abs(ns) // 1000}.{abs(ns) % 1000:03d}"
+
+
+class TraceEventWriter:
+    """
+    Writes trace events to a JSON trace event file one by one, gzip
+    compressed if the file name ends with .gz.
+    """
+
+    def __init__(self, output_file):
+        self.file = gzip.open(output_file, "wt") if output_file.endswith(".gz") else open(output_file, "w")
+        self.file.write('{"displayTimeUnit":"ns","traceEvents":[\n')
+        self.count = 0
+
+    def write(self, phase, ns, pid, tid, duration=None, **fields):
+        """Write one event, `ns` relative to the start of the trace and an optional `duration` in ns."""
+        if self.count:
+            self.file.write(",\n")
+        dur = "" if duration is None else f',"dur":{format_microseconds(duration)}'
+        fields = "".join(f',"{key}":{json.dumps(value, separators=(",", ":"))}' for key, value in fields.items())
+        self.file.write(f'{{"ph":"{phase}","ts":{format_microseconds(ns)},"pid":{pid},"tid":{tid}{dur}{fields}}}')
+        self.count += 1
+
+    def close(self, metadata):
+        self.file.write(f'\n],"otherData":{json.dumps(metadata)}}}\n')
+        self.file.close()
+
+
+class TraceEventExporter:
+    """
+    Converts the events of a trace to trace events, see `export_trace_events`.
+
+    :param writer: A `TraceEventWriter`
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.registry = CallbackRegistry()
+        self.origin = None
+        self.processes = set()
+        self.threads = set()
+        # Topics of the publishers and subscriptions by (vpid, handle)
+        self.publishers = {}
+        self.rmw_publishers = {}
+        self.subscriptions = {}
+        # Last rclcpp_publish or rcl_publish and flow of the last take of every thread, last flow of every topic
+        self.publishes = {}
+        self.takes = {}
+        self.latest = {}
+        self.exact = False
+        self.flows = 0
+
+    def flow_id(self, topic, source_timestamp):
+        """A flow id which is the same in every export of a message."""
+        digest = hashlib.blake2b(f"{topic}:{source_timestamp}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") & FLOW_ID_MASK
+
+    def add(self, event):
+        name = event["event"]
+        vpid, vtid = event.get("vpid"), event.get("vtid")
+        if name in REGISTRY_EVENTS:
+            try:
+                self.registry.add(event)
+            except KeyError:
+                pass
+            if name == "ros2:rcl_subscription_init":
+                self.subscriptions[(vpid, event.get("rmw_subscription_handle"))] = event.get("topic_name")
+            return
+        if name == "ros2:rcl_publisher_init":
+            self.publishers[(vpid, event.get("publisher_handle"))] = event.get("topic_name")
+            self.rmw_publishers[(vpid, event.get("rmw_publisher_handle"))] = event.get("topic_name")
+            return
+        if vpid is None or vtid is None:
+            return
+
+        timestamp = event_time(event)
+        if self.origin is None:
+            self.origin = timestamp
+        ns = timestamp - self.origin
+        if vpid not in self.processes:
+            self.processes.add(vpid)
+            self.writer.write("M", 0, vpid, vtid, name="process_name", args={"name": event.get("procname", str(vpid))})
+        if (vpid, vtid) not in self.threads:
+            self.threads.add((vpid, vtid))
+            self.writer.write("M", 0, vpid, vtid, name="thread_name", args={"name": f"{event.get('procname', vpid)} {vtid}"})
+
+        thread = (vpid, vtid)
+        if name == EXPORT_CALLBACK_START:
+            node, label = self.registry.callback_name(vpid, event["callback"], event.get("procname"))
+            self.writer.write("B", ns, vpid, vtid, name=str(label), cat="callback", args={"node": node, "callback": event["callback"]})
+            flow = self.takes.pop(thread, None)
+            if flow is not None:
+                self.writer.write("f", ns, vpid, vtid, name="message", cat="message", id=flow, bp="e")
+        elif name == EXPORT_CALLBACK_END:
+            self.writer.write("E", ns, vpid, vtid)
+        elif name == EXPORT_RCLCPP_PUBLISH:
+            self.publishes[thread] = (ns, event.get("message"), self.publishers.get((vpid, event.get("publisher_handle"))))
+        elif name == EXPORT_RCL_PUBLISH:
+            start, message = ns, event.get("message")
+            publish = self.publishes.get(thread)
+            topic = self.publishers.get((vpid, event.get("publisher_handle")))
+            if publish is not None and publish[1] == message:
+                start, topic = publish[0], topic or publish[2]
+            self.publishes[thread] = (start, message, topic)
+        elif name == EXPORT_RMW_PUBLISH:
+            self.rmw_publish(event, thread, ns)
+        elif name == EXPORT_RMW_TAKE and event.get("taken", 1):
+            topic = self.subscriptions.get((vpid, event.get("rmw_subscription_handle")))
+            flow = self.flow_id(topic, event.get("source_timestamp")) if self.exact else self.latest.get(topic)
+            if topic is not None and flow is not None:
+                self.takes[thread] = flow
+
+    def rmw_publish(self, event, thread, ns):
+        vpid, vtid = thread
+        start, topic = ns, None
+        publish = self.publishes.pop(thread, None)
+        if publish is not None and publish[1] == event.get("message"):
+            start, _, topic = publish
+        if topic is None:
+            topic = self.rmw_publishers.get((vpid, event.get("rmw_publisher_handle")))
+        if topic is None:
+            return
+        if "payload_timestamp" in event:
+            self.exact = True
+            flow = self.flow_id(topic, event["payload_timestamp"])
+        else:
+            flow = self.flow_id(topic, ns + self.origin)
+            self.latest[topic] = flow
+        self.writer.write("X", start, vpid, vtid, name=f"publish {topic}", cat="publish", duration=ns - start, args={"topic": topic})
+        self.writer.write("s", start, vpid, vtid, name="message", cat="message", id=flow)
+        self.flows += 1
+
+
+def export_trace_events(trace_file, output_file=EXPORT_OUTPUT_FILE, start_ns=None, end_ns=None):
+    """
+    Export the callbacks and messages of a converted trace as a JSON trace
+    event file for the Perfetto UI, in constant memory.
+
+    :param trace_file: trace.ndjson, trace.json (optionally compressed) or the directory of a rotated session
+    :param output_file: The trace event file, gzip compressed if it ends with .gz
+    :return: The number of written trace events
+    """
+    if trace_file.endswith(".ndjson") or os.path.isdir(trace_file):
+        reader = open_trace_reader(trace_file)
+        events = reader.query(start_ns, end_ns)
+        if start_ns is not None:
+            events = itertools.chain(reader.query(None, start_ns - 1, events=sorted(INIT_EVENTS)), events)
+    else:
+        events = (event for event in load_trace_events(trace_file)
+                  if event["event"] in INIT_EVENTS or ((start_ns is None or event_time(event) >= start_ns) and (end_ns is None or event_time(event) <= end_ns)))
+
+    writer = TraceEventWriter(output_file)
+    exporter = TraceEventExporter(writer)
+    for event in events:
+        exporter.add(event)
+    writer.close({"source": os.path.basename(os.path.abspath(trace_file)), "origin_ns": exporter.origin})
+    print(f"Exported {writer.count} trace events with {exporter.flows} messages to {output_file}")
+    return writer.count
+
+
+def export_main(argv=None):
+    """`ros2-tracer export`: export a trace for the Perfetto UI and return the exit code."""
+    parser = argparse.ArgumentParser(prog="ros2-tracer export", description="Export the callbacks and messages of a trace as a Chrome JSON trace event file for the Perfetto UI (ui.perfetto.dev)")
+    parser.add_argument("trace_file", nargs="?", default="trace.ndjson", help="trace.ndjson, trace.json (optionally .gz/.zst compressed) or the directory of a rotated session. Default is trace.ndjson.")
+    parser.add_argument("-o", "--output", default=EXPORT_OUTPUT_FILE, help=f"Trace event file, gzip compressed if it ends with .gz. Default is {EXPORT_OUTPUT_FILE}.")
+    parser.add_argument("--from", dest="time_from", help="Only export events at or after this time, in seconds since the Unix epoch.")
+    parser.add_argument("--to", dest="time_to", help="Only export events at or before this time, in seconds since the Unix epoch.")
+    args = parser.parse_args(argv)
+
+    if args.trace_file.endswith(".npz"):
+        print("ERROR: Columnar traces are not ordered by time, export trace.ndjson instead", file=sys.stderr)
+        return 1
+    if not os.path.exists(args.trace_file):
+        print(f"ERROR: There is no trace: {args.trace_file}", file=sys.stderr)
+        return 1
+    export_trace_events(args.trace_file, args.output, parse_time(args.time_from), parse_time(args.time_to))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(export_main())
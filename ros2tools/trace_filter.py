@@ -0,0 +1,134 @@
+import copy
+import fnmatch
+import os
+import re
+import sys
+
+try:
+    from ros2tools.trace_converter import NS_PER_SECOND, split_seconds
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_converter import NS_PER_SECOND, split_seconds
+
+
+# trace_filter.py selects trace events by event name glob, process (vpid or
+# procname) and time range. It mirrors the `filter.ros2observer.select`
+# babeltrace2 component in plugin/, which applies the same selection natively
+# before the events are converted; `EventSelector` is used on the Python
+# conversion paths and to build the parameters of the native component.
+
+SELECT_FILTER_COMPONENT = "filter.ros2observer.select"
+# Float seconds are only exact to a few hundred ns for epoch timestamps, time
+# ranges passed as seconds are widened by this margin and then cut exactly
+SECONDS_MARGIN_NS = 1000
+
+
+def parse_time(value):
+    """
+    Parse a point in time given as seconds since the Unix epoch, e.g.
+    "1714561909.5", to integer nanoseconds.
+    """
+    if value is None:
+        return None
+    try:
+        return split_seconds(str(value).strip())
+    except ValueError:
+        raise Exception(f"ERROR: Invalid time: {value}, expected seconds since the Unix epoch.")
+
+
+def split_list(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [item.strip() for item in value if str(item).strip()]
+
+
+class EventSelector:
+    """
+    Selection of trace events.
+
+    :param events: Event name globs, a list or a comma separated string, e.g. "ros2:callback_*,ros2:rmw_*"
+    :param pids: Process IDs (vpid) or process names, a list or a comma separated string
+    :param begin: Start of the time range in ns since the Unix epoch (inclusive)
+    :param end: End of the time range in ns since the Unix epoch (inclusive)
+    """
+
+    def __init__(self, events=None, pids=None, begin=None, end=None):
+        self.events = split_list(events)
+        self.pids = set()
+        self.procnames = set()
+        for pid in split_list(pids):
+            if str(pid).isdigit():
+                self.pids.add(int(pid))
+            else:
+                self.procnames.add(pid)
+        self.begin = begin
+        self.end = end
+        self.event_pattern = re.compile("|".join(fnmatch.translate(event) for event in self.events)) if self.events else None
+        self.event_matches = {}
+
+    def __bool__(self):
+        return bool(self.events or self.pids or self.procnames or self.begin is not None or self.end is not None)
+
+    def match_event_name(self, name):
+        matches = self.event_matches.get(name)
+        if matches is None:
+            matches = self.event_pattern is None or self.event_pattern.match(name) is not None
+            self.event_matches[name] = matches
+        return matches
+
+    def __call__(self, event):
+        """
+        :param event: A flat event record, see `iter_trace_events`
+        :return: True if the event is selected
+        """
+        if self.begin is not None and event["timestamp"] < self.begin:
+            return False
+        if self.end is not None and event["timestamp"] > self.end:
+            return False
+        if not self.match_event_name(event["event"]):
+            return False
+        if self.pids or self.procnames:
+            return event.get("vpid") in self.pids or event.get("procname") in self.procnames
+        return True
+
+    def filter(self, events):
+        """Yield the selected events of an iterable of event records."""
+        if not self:
+            yield from events
+            return
+        yield from filter(self, events)
+
+    def starting_at(self, timestamp):
+        """
+        A copy of the selection which starts at `timestamp` at the earliest,
+        e.g. to resume a conversion.
+        """
+        selector = copy.copy(self)
+        selector.event_matches = {}
+        if timestamp is not None:
+            selector.begin = timestamp if self.begin is None else max(self.begin, timestamp)
+        return selector
+
+    def begin_seconds(self):
+        return None if self.begin is None else (self.begin - SECONDS_MARGIN_NS) / NS_PER_SECOND
+
+    def end_seconds(self):
+        return None if self.end is None else (self.end + SECONDS_MARGIN_NS) / NS_PER_SECOND
+
+    def component_params(self):
+        """
+        The `--params` string of the `filter.ros2observer.select` component.
+        """
+        params = []
+        if self.events:
+            params.append(f'events="{",".join(self.events)}"')
+        pids = [str(pid) for pid in sorted(self.pids)] + sorted(self.procnames)
+        if pids:
+            params.append(f'pid="{",".join(pids)}"')
+        if self.begin is not None:
+            params.append(f"begin={self.begin}")
+        if self.end is not None:
+            params.append(f"end={self.end}")
+        return ",".join(params)
@@ -0,0 +1,452 @@
+import fnmatch
+import glob
+import io
+import json
+import os
+import re
+import sys
+from bisect import bisect_right
+
+try:
+    from ros2tools.trace_converter import NS_PER_SECOND
+    from ros2tools.util import compression_extension, open_file, read_ndjson_file, write_json_file
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_converter import NS_PER_SECOND
+    from util import compression_extension, open_file, read_ndjson_file, write_json_file
+
+
+# trace_index.py writes a sidecar index for trace.ndjson (trace.ndjson.idx) and
+# reads time ranges of the trace through it. The records are grouped into time
+# buckets; the index stores the file offset and record count of every bucket
+# and, for every event class and vpid, the buckets containing it (postings).
+# `TraceReader.query` only reads and decodes the buckets which can contain
+# matching records.
+#
+# Index layout (JSON):
+#   bucket_ns  width of a time bucket in ns
+#   buckets    [[first_timestamp_of_bucket_window, offset, count], ...] in file order
+#   events     {event name: [bucket number, ...]}
+#   vpids      {vpid: [bucket number, ...]}
+#   size       size of the indexed part of the NDJSON file
+#   last_line  the last indexed line, to detect a rewritten NDJSON file
+#   ordered    whether the timestamps of all records are non-decreasing,
+#              otherwise queries read all candidate buckets to the end
+#
+# A trace recorded with session rotation consists of one trace.ndjson per
+# chunk below archives/. The chunk manifest chunks.json lists them in order
+# with their time ranges, `ChunkedTraceReader` queries them as one trace.
+
+INDEX_VERSION = 2
+INDEX_SUFFIX = ".idx"
+BUCKET_NS = NS_PER_SECOND // 10
+CHUNK_MANIFEST = "chunks.json"
+CHUNK_TRACE = "trace.ndjson"
+
+# The records of all converters start with the timestamp and carry the event
+# name before the payload, so the indexed keys are found without decoding
+RECORD_PATTERN = re.compile(r'\{"timestamp":(-?\d+),.*?"event":"((?:[^"\\]|\\.)*)"')
+VPID_PATTERN = re.compile(r'"vpid":(\d+)')
+
+
+def index_path(trace_file):
+    return trace_file + INDEX_SUFFIX
+
+
+def record_keys(line):
+    """
+    :return: A tuple (timestamp, event, vpid) of a NDJSON record
+    """
+    match = RECORD_PATTERN.match(line)
+    if match is None:
+        record = json.loads(line)
+        return record["timestamp"], record["event"], record.get("vpid")
+    timestamp, event = match.groups()
+    if "\\" in event:
+        event = json.loads(f'"{event}"')
+    vpid = VPID_PATTERN.search(line, match.end())
+    return int(timestamp), event, int(vpid.group(1)) if vpid else None
+
+
+class TraceIndex:
+    """
+    The index of a NDJSON trace file, see the layout above.
+    """
+
+    def __init__(self, bucket_ns=BUCKET_NS):
+        self.bucket_ns = bucket_ns
+        self.buckets = []
+        self.events = {}
+        self.vpids = {}
+        self.size = 0
+        self.last_line = ""
+        self.ordered = True
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            state = json.load(f)
+        if state.get("version") != INDEX_VERSION:
+            return None
+        index = cls(state["bucket_ns"])
+        index.buckets = state["buckets"]
+        index.events = state["events"]
+        index.vpids = {int(vpid): buckets for vpid, buckets in state["vpids"].items()}
+        index.size = state["size"]
+        index.last_line = state["last_line"]
+        index.ordered = state["ordered"]
+        return index
+
+    def save(self, path):
+        state = {
+            "version": INDEX_VERSION,
+            "bucket_ns": self.bucket_ns,
+            "buckets": self.buckets,
+            "events": self.events,
+            "vpids": {str(vpid): buckets for vpid, buckets in self.vpids.items()},
+            "size": self.size,
+            "last_line": self.last_line,
+            "ordered": self.ordered,
+        }
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as f:
+            f.write(json.dumps(state, separators=(',', ':')))
+        os.replace(temporary_path, path)
+
+    def matches(self, trace_file):
+        """Whether the indexed part of `trace_file` is unchanged."""
+        if os.path.getsize(trace_file) < self.size:
+            return False
+        if self.size == 0:
+            return True
+        last_line = self.last_line.encode()
+        with open(trace_file, "rb") as f:
+            f.seek(self.size - len(last_line))
+            return f.read(len(last_line)) == last_line
+
+    def update(self, trace_file):
+        """
+        Index the records appended to `trace_file` since the last update.
+
+        :return: The number of records indexed
+        """
+        with open(trace_file, "rb") as f:
+            f.seek(self.size)
+            return self.index_lines(f)
+
+    def index_lines(self, f):
+        """
+        Index the NDJSON lines of the binary file `f` from its current
+        position, which is at `size` in the indexed file.
+
+        :return: The number of records indexed
+        """
+        count = 0
+        offset = self.size
+        previous = record_keys(self.last_line)[0] if self.last_line else None
+        bucket = self.buckets[-1] if self.buckets else None
+        bucket_number = len(self.buckets) - 1
+        # Buckets already posted for the event classes and vpids, of the last bucket
+        posted = set()
+        if bucket is not None:
+            posted = {("e", e) for e, b in self.events.items() if b[-1] == bucket_number}
+            posted |= {("v", v) for v, b in self.vpids.items() if b[-1] == bucket_number}
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break
+            line = raw_line.decode()
+            if not line.strip():
+                offset += len(raw_line)
+                continue
+            timestamp, event, vpid = record_keys(line)
+            if previous is not None and timestamp < previous:
+                self.ordered = False
+            previous = timestamp
+            window = timestamp - timestamp % self.bucket_ns
+            if bucket is None or window != bucket[0]:
+                bucket = [window, offset, 0]
+                self.buckets.append(bucket)
+                bucket_number += 1
+                posted = set()
+            bucket[2] += 1
+            if ("e", event) not in posted:
+                posted.add(("e", event))
+                self.events.setdefault(event, []).append(bucket_number)
+            if vpid is not None and ("v", vpid) not in posted:
+                posted.add(("v", vpid))
+                self.vpids.setdefault(vpid, []).append(bucket_number)
+            offset += len(raw_line)
+            self.last_line = line
+            count += 1
+        self.size = offset
+        return count
+
+
+def update_trace_index(trace_file, bucket_ns=BUCKET_NS):
+    """
+    Write or update the index sidecar of a NDJSON trace file. Records appended
+    since the last update are indexed incrementally, the index is rebuilt if
+    the indexed part of the file changed.
+
+    :return: The `TraceIndex`
+    """
+    path = index_path(trace_file)
+    index = None
+    if os.path.exists(path):
+        index = TraceIndex.load(path)
+        if index is not None and (index.bucket_ns != bucket_ns or not index.matches(trace_file)):
+            index = None
+    if index is None:
+        index = TraceIndex(bucket_ns)
+    count = index.update(trace_file)
+    index.save(path)
+    print(f"Index written to {path} ({count} records indexed, {len(index.buckets)} buckets)")
+    return index
+
+
+def merge_postings(postings):
+    merged = set()
+    for buckets in postings:
+        merged.update(buckets)
+    return merged
+
+
+class TraceReader:
+    """
+    Random access to the records of a NDJSON trace file (trace.ndjson) through
+    its index sidecar. The index is built if it is missing or outdated.
+    Compressed files (.gz, .zst) cannot be indexed and are scanned, their
+    event classes, vpids, time range and length by a single scan.
+
+    :param trace_file: The NDJSON trace file
+    """
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.index = None
+        self.scanned = None
+        if compression_extension(trace_file):
+            return
+        path = index_path(trace_file)
+        index = TraceIndex.load(path) if os.path.exists(path) else None
+        if index is None or not index.matches(trace_file) or index.size != os.path.getsize(trace_file):
+            index = update_trace_index(trace_file)
+        self.index = index
+
+    @property
+    def summary(self):
+        """
+        The index, for a compressed file an index of the decompressed records
+        built by scanning it once. Its offsets can not be read from.
+        """
+        if self.index is not None:
+            return self.index
+        if self.scanned is None:
+            self.scanned = TraceIndex()
+            with io.BufferedReader(open_file(self.trace_file, "rb")) as f:
+                self.scanned.index_lines(f)
+        return self.scanned
+
+    @property
+    def event_classes(self):
+        return sorted(self.summary.events)
+
+    @property
+    def vpids(self):
+        return sorted(self.summary.vpids)
+
+    @property
+    def start(self):
+        """Start of the first time bucket in ns, None for an empty trace."""
+        summary = self.summary
+        return min(bucket[0] for bucket in summary.buckets) if summary.buckets else None
+
+    @property
+    def end(self):
+        """End of the last time bucket in ns, None for an empty trace."""
+        summary = self.summary
+        return max(bucket[0] for bucket in summary.buckets) + summary.bucket_ns if summary.buckets else None
+
+    def __len__(self):
+        return sum(bucket[2] for bucket in self.summary.buckets)
+
+    def __iter__(self):
+        return self.query()
+
+    def select_event_classes(self, events):
+        """Event class names of the index matching names or globs."""
+        if isinstance(events, str):
+            events = [events]
+        return {name for name in self.index.events if any(fnmatch.fnmatchcase(name, event) for event in events)}
+
+    def candidate_buckets(self, start_ns=None, end_ns=None, event_classes=None, vpids=None):
+        """Numbers of the buckets which can contain matching records, in file order."""
+        index = self.index
+        if index.ordered:
+            windows = [bucket[0] for bucket in index.buckets]
+            first = 0 if start_ns is None else max(bisect_right(windows, start_ns) - 1, 0)
+            last = len(windows) if end_ns is None else bisect_right(windows, end_ns)
+            candidates = set(range(first, last))
+        else:
+            candidates = set(range(len(index.buckets)))
+        if event_classes is not None:
+            candidates &= merge_postings(index.events[event] for event in event_classes)
+        if vpids is not None:
+            candidates &= merge_postings(index.vpids.get(vpid, ()) for vpid in vpids)
+        return sorted(candidates)
+
+    def read_ranges(self, buckets):
+        """Merge consecutive buckets into (start, end) byte ranges."""
+        index = self.index
+        ranges = []
+        for number in buckets:
+            start = index.buckets[number][1]
+            end = index.buckets[number + 1][1] if number + 1 < len(index.buckets) else index.size
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def query(self, start_ns=None, end_ns=None, events=None, vpid=None):
+        """
+        Yield the records in the time range [start_ns, end_ns] in file order.
+        Only the time buckets which can contain matching records are read.
+
+        :param start_ns: Start of the time range in ns since the Unix epoch, None for the start of the trace
+        :param end_ns: End of the time range in ns (inclusive), None for the end of the trace
+        :param events: Optional event class name or glob, or a list of them
+        :param vpid: Optional process ID or list of process IDs
+        """
+        vpids = None if vpid is None else ({vpid} if isinstance(vpid, int) else set(vpid))
+        if self.index is None:
+            yield from self.scan(start_ns, end_ns, events, vpids)
+            return
+        event_classes = None if events is None else self.select_event_classes(events)
+        buckets = self.candidate_buckets(start_ns, end_ns, event_classes, vpids)
+
+        with open(self.trace_file, "rb") as f:
+            for start, end in self.read_ranges(buckets):
+                f.seek(start)
+                for line in f.read(end - start).decode().splitlines():
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    timestamp = record["timestamp"]
+                    if start_ns is not None and timestamp < start_ns:
+                        continue
+                    if end_ns is not None and timestamp > end_ns:
+                        if self.index.ordered:
+                            return
+                        continue
+                    if event_classes is not None and record["event"] not in event_classes:
+                        continue
+                    if vpids is not None and record.get("vpid") not in vpids:
+                        continue
+                    yield record
+
+    def scan(self, start_ns, end_ns, events, vpids):
+        """`query` without an index: read and filter all records."""
+        if isinstance(events, str):
+            events = [events]
+        for record in read_ndjson_file(self.trace_file):
+            timestamp = record["timestamp"]
+            if start_ns is not None and timestamp < start_ns:
+                continue
+            if end_ns is not None and timestamp > end_ns:
+                continue
+            if events is not None and not any(fnmatch.fnmatchcase(record["event"], event) for event in events):
+                continue
+            if vpids is not None and record.get("vpid") not in vpids:
+                continue
+            yield record
+
+
+def chunk_number(chunk_directory):
+    """The number of a rotated chunk, the last part of its archive name, e.g. `...-...-3`."""
+    try:
+        return int(os.path.basename(chunk_directory.rstrip("/")).rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return -1
+
+
+def find_trace_chunks(trace_directory):
+    """The converted chunk traces (archives/*/trace.ndjson) of a rotated session, in chunk order."""
+    trace_files = glob.glob(os.path.join(trace_directory, "archives", "*", CHUNK_TRACE))
+    return sorted(trace_files, key=lambda trace_file: chunk_number(os.path.dirname(trace_file)))
+
+
+def write_chunk_manifest(trace_directory, trace_files=None):
+    """
+    Write the chunk manifest chunks.json of a rotated session: the chunk
+    traces in order with their time ranges and number of events.
+    """
+    chunks = []
+    for trace_file in trace_files or find_trace_chunks(trace_directory):
+        reader = TraceReader(trace_file)
+        chunks.append({
+            "trace": os.path.relpath(trace_file, trace_directory),
+            "start": reader.start,
+            "end": reader.end,
+            "events": len(reader),
+        })
+    path = os.path.join(trace_directory, CHUNK_MANIFEST)
+    write_json_file(path, {"version": INDEX_VERSION, "chunks": chunks})
+    print(f"Chunk manifest written to {path} ({len(chunks)} chunks)")
+    return chunks
+
+
+class ChunkedTraceReader:
+    """
+    `TraceReader` over the chunks of a rotated session, queried as one trace.
+    Chunks outside of a queried time range are not read.
+
+    :param trace_directory: The session directory with chunks.json, or the
+        chunks are found below its archives/ directory
+    """
+
+    def __init__(self, trace_directory):
+        manifest = os.path.join(trace_directory, CHUNK_MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest, "r") as f:
+                trace_files = [os.path.join(trace_directory, chunk["trace"]) for chunk in json.load(f)["chunks"]]
+        else:
+            trace_files = find_trace_chunks(trace_directory)
+        self.readers = [TraceReader(trace_file) for trace_file in trace_files]
+
+    @property
+    def event_classes(self):
+        return sorted({name for reader in self.readers for name in reader.event_classes})
+
+    @property
+    def vpids(self):
+        return sorted({vpid for reader in self.readers for vpid in reader.vpids})
+
+    @property
+    def start(self):
+        starts = [reader.start for reader in self.readers if reader.start is not None]
+        return min(starts) if starts else None
+
+    def __len__(self):
+        return sum(len(reader) for reader in self.readers)
+
+    def __iter__(self):
+        return self.query()
+
+    def query(self, start_ns=None, end_ns=None, events=None, vpid=None):
+        """`TraceReader.query` over all chunks, in chunk order."""
+        for reader in self.readers:
+            if reader.start is None:
+                continue
+            if start_ns is not None and reader.end <= start_ns:
+                continue
+            if end_ns is not None and reader.start > end_ns:
+                continue
+            yield from reader.query(start_ns, end_ns, events, vpid)
+
+
+def open_trace_reader(path):
+    """A `ChunkedTraceReader` for a session directory, a `TraceReader` for a trace file."""
+    if os.path.isdir(path):
+        return ChunkedTraceReader(path)
+    return TraceReader(path)
@@ -1,78 +1,244 @@
-import json
+import argparse
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
-from collections import defaultdict
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import os
+import sys
 
-def plot_process_timeline(json_file, output_dir="output"):
+try:
+    from ros2tools.trace_converter import load_trace_events
+    from ros2tools.trace_columns import ColumnarTrace
+    from ros2tools.trace_index import open_trace_reader
+    from ros2tools.trace_filter import parse_time
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_converter import load_trace_events
+    from trace_columns import ColumnarTrace
+    from trace_index import open_trace_reader
+    from trace_filter import parse_time
+
+# The events are grouped once into NumPy arrays sorted by process, event type
+# and time, and every process is rendered in its own worker process. Rows with
+# more events than MARKER_BUDGET are drawn as a density raster of
+# DENSITY_BINS bins instead of one marker per event.
+
+PLOT_COLUMNS = ['timestamp', 'vpid', 'procname']
+MARKER_BUDGET = 5000
+DENSITY_BINS = 2000
+DPI = 300
+
+
+class PlotColumns:
+    """
+    The timestamp, vpid and event type code of every event to plot, with the
+    event type names and the first procname of every vpid.
+    """
+
+    def __init__(self, timestamps, vpids, event_codes, event_types, procnames):
+        self.timestamps = timestamps
+        self.vpids = vpids
+        self.event_codes = event_codes
+        self.event_types = event_types
+        self.procnames = procnames
+
+
+def load_plot_columns(trace_file, start_ns=None, end_ns=None):
+    """
+    Load the events to plot as `PlotColumns`, optionally only the ones in the
+    time range [start_ns, end_ns]. For columnar (.npz) traces only the
+    timestamp, vpid and procname columns are read, NDJSON (.ndjson) traces and
+    the chunks of a rotated session directory are read through their index so
+    only the requested time range is decoded.
+    """
+    if trace_file.endswith('.npz'):
+        return load_columnar_plot_columns(trace_file, start_ns, end_ns)
+    if trace_file.endswith('.ndjson') or os.path.isdir(trace_file):
+        events = open_trace_reader(trace_file).query(start_ns, end_ns)
+    else:
+        events = (event for event in load_trace_events(trace_file)
+                  if (start_ns is None or event['timestamp'] >= start_ns) and (end_ns is None or event['timestamp'] <= end_ns))
+
+    timestamps, vpids, event_codes = array('q'), array('q'), array('l')
+    event_types = {}
+    procnames = {}
+    for event in events:
+        vpid = event.get('vpid')
+        if vpid is None:
+            continue
+        timestamp = event['timestamp']
+        timestamps.append(int(float(timestamp)) if isinstance(timestamp, str) else timestamp)
+        vpids.append(vpid)
+        event_codes.append(event_types.setdefault(event['event'], len(event_types)))
+        if vpid not in procnames and 'procname' in event:
+            procnames[vpid] = event['procname']
+    return PlotColumns(
+        np.frombuffer(timestamps, dtype=np.int64),
+        np.frombuffer(vpids, dtype=np.int64),
+        np.array(event_codes, dtype=np.int64),
+        list(event_types),
+        procnames,
+    )
+
+
+def load_columnar_plot_columns(trace_file, start_ns=None, end_ns=None):
+    trace = ColumnarTrace(trace_file)
+    timestamps, vpids, event_codes, event_types = [], [], [], []
+    procnames = {}
+    for event_type in trace.event_classes:
+        columns = trace.load(event_type, PLOT_COLUMNS)
+        if 'vpid' not in columns:
+            continue
+        selected = np.ones(len(columns['timestamp']), dtype=bool)
+        if start_ns is not None:
+            selected &= columns['timestamp'] >= start_ns
+        if end_ns is not None:
+            selected &= columns['timestamp'] <= end_ns
+        if not selected.any():
+            continue
+        timestamps.append(columns['timestamp'][selected])
+        vpids.append(columns['vpid'][selected])
+        event_codes.append(np.full(np.count_nonzero(selected), len(event_types), dtype=np.int64))
+        event_types.append(event_type)
+        if 'procname' in columns:
+            unique_vpids, first = np.unique(vpids[-1], return_index=True)
+            for vpid, procname in zip(unique_vpids.tolist(), columns['procname'][selected][first].tolist()):
+                procnames.setdefault(vpid, str(procname))
+    trace.close()
+    if not timestamps:
+        return PlotColumns(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), [], {})
+    return PlotColumns(np.concatenate(timestamps), np.concatenate(vpids), np.concatenate(event_codes), event_types, procnames)
+
+
+def group_rows(columns):
+    """
+    Sort the events once by process, event type and time and split them into
+    the rows of every process.
+
+    :return: A list of (vpid, [(event_type, timestamps), ...]) tuples, the
+        event types of a process sorted by name
+    """
+    names = np.array(columns.event_types, dtype=object)
+    # Codes in the order of the sorted names, so the rows come out sorted
+    ranks = np.empty(len(names), dtype=np.int64)
+    ranks[np.argsort(names.astype(str), kind='stable')] = np.arange(len(names))
+    codes = ranks[columns.event_codes] if len(names) else columns.event_codes
+    order = np.lexsort((columns.timestamps, codes, columns.vpids))
+    vpids, codes, timestamps = columns.vpids[order], codes[order], columns.timestamps[order]
+
+    changed = np.ones(len(order), dtype=bool)
+    changed[1:] = (vpids[1:] != vpids[:-1]) | (codes[1:] != codes[:-1])
+    starts = np.flatnonzero(changed)
+    ends = np.append(starts[1:], len(order))
+    sorted_names = np.sort(names.astype(str)) if len(names) else names
+    processes = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        vpid = int(vpids[start])
+        if not processes or processes[-1][0] != vpid:
+            processes.append((vpid, []))
+        processes[-1][1].append((str(sorted_names[codes[start]]), timestamps[start:end]))
+    return processes
+
+
+def draw_row(ax, times, color, marker_budget=MARKER_BUDGET, bins=DENSITY_BINS):
+    """
+    Draw the events of one row: one marker per event up to `marker_budget`
+    events, else the number of events per time bin as a raster.
+    """
+    if len(times) <= marker_budget:
+        ax.scatter(times, np.zeros(len(times)), color=color, s=30, alpha=0.8)
+        return
+    counts, edges = np.histogram(times, bins=bins)
+    density = np.ma.masked_equal(counts, 0)[np.newaxis, :]
+    colormap = matplotlib.colors.LinearSegmentedColormap.from_list('density', [(1, 1, 1), color])
+    ax.imshow(density, aspect='auto', cmap=colormap, interpolation='nearest',
+              extent=(edges[0], edges[-1], -0.5, 0.5), vmin=0, vmax=counts.max())
+    ax.set_ylim(-0.5, 0.5)
+
+
+def render_process_timeline(pid, procname, rows, min_time, output_dir, marker_budget=MARKER_BUDGET, dpi=DPI):
+    """Render the timeline of one process to a PNG file, runs in a worker process."""
+    num_event_types = len(rows)
+    height = num_event_types * 1.2
+    fig, axes = plt.subplots(num_event_types, 1, figsize=(15, height), sharex=True)
+
+    if num_event_types == 1:
+        axes = [axes]
+
+    colors = plt.cm.tab10.colors
+
+    end_time = min_time
+    for i, (event_type, timestamps) in enumerate(rows):
+        ax = axes[i]
+        times = (timestamps - min_time) / 1e9
+        end_time = max(end_time, int(timestamps[-1]))
+
+        draw_row(ax, times, colors[i % len(colors)], marker_budget)
+
+        ax.set_yticks([])
+        ax.set_ylabel(event_type.split(':')[-1], fontsize=8, rotation=0, ha='right', va='center')
+
+        ax.grid(True, axis='x', linestyle='--', alpha=0.5)
+
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['left'].set_visible(False)
+
+    axes[-1].set_xlabel('Time (seconds since trace start)')
+
+    total_duration = (end_time - min_time) / 1e9
+
+    axes[0].set_xlim(-0.1, total_duration + 0.1)
+
+    plt.suptitle(f'ros2-tracer Trace Timeline\nProcess Name: {procname}\nProcess ID: {pid}', fontsize=14)
+
+    plt.tight_layout()
+    # Keep about 0.9 inches for the three title lines, independent of the number of rows
+    plt.subplots_adjust(top=min(0.9, 1 - 0.9 / (height + 0.9)), hspace=0.3)
+
+    output_file = os.path.join(output_dir, f"process_{pid}_{procname}.png")
+    fig.savefig(output_file, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    return output_file
+
+
+def plot_process_timeline(json_file, output_dir="output", start_ns=None, end_ns=None, jobs=None, marker_budget=MARKER_BUDGET, dpi=DPI):
+    """
+    Plot one timeline per process with one row per event type.
+
+    :param jobs: Number of processes rendered concurrently, default is the number of CPU cores
+    :param marker_budget: Maximum events of a row drawn as markers, see `draw_row`
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    
-    with open(json_file, 'r') as f:
-        data = json.load(f)
-    
-    processes = defaultdict(list)
-    for event in data:
-        if isinstance(event['timestamp'], str):
-            event['timestamp'] = int(float(event['timestamp']))
-        
-        if 'vpid' in event:
-            processes[event['vpid']].append(event)
-    
-    min_time = min(event['timestamp'] for event in data)
-    
-    for pid, events in processes.items():
-        procname = events[0]['procname'] if 'procname' in events[0] else f"Unknown-{pid}"
-        
-        event_types = sorted(set(event['event'] for event in events))
-        
-        num_event_types = len(event_types)
-        fig, axes = plt.subplots(num_event_types, 1, figsize=(15, num_event_types * 1.2), sharex=True)
-        
-        if num_event_types == 1:
-            axes = [axes]
-        
-        colors = plt.cm.tab10.colors
-        
-        for i, event_type in enumerate(event_types):
-            ax = axes[i]
-            
-            type_events = [e for e in events if e['event'] == event_type]
-            
-            type_events.sort(key=lambda x: x['timestamp'])
-            
-            times = [(e['timestamp'] - min_time) / 1e9 for e in type_events]
-            y_values = [0] * len(times)
-            
-            ax.scatter(times, y_values, color=colors[i % len(colors)], s=30, alpha=0.8)
-            
-            ax.set_yticks([])
-            ax.set_ylabel(event_type.split(':')[-1], fontsize=8, rotation=0, ha='right', va='center')
-            
-            ax.grid(True, axis='x', linestyle='--', alpha=0.5)
-            
-            ax.spines['top'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            ax.spines['left'].set_visible(False)
-        
-        axes[-1].set_xlabel('Time (seconds since trace start)')
-        
-        total_duration = (max(e['timestamp'] for e in events) - min_time) / 1e9
-        
-        axes[0].set_xlim(-0.1, total_duration + 0.1)
-        
-        plt.suptitle(f'ros2-tracer Trace Timeline\nProcess Name: {procname}\nProcess ID: {pid}', fontsize=14)
-        
-        plt.tight_layout()
-        plt.subplots_adjust(top=0.9, hspace=0.3)
-        
-        output_file = os.path.join(output_dir, f"process_{pid}_{procname}.png")
-        fig.savefig(output_file, dpi=300, bbox_inches='tight')
-        plt.close(fig)
-        
-        print(f"Generated timeline for process {procname} (ID: {pid})")
+
+    columns = load_plot_columns(json_file, start_ns, end_ns)
+    if not len(columns.timestamps):
+        print("No events with a vpid to plot.")
+        return
+
+    min_time = int(columns.timestamps.min())
+    processes = group_rows(columns)
+    with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count() or 1, len(processes))) as executor:
+        futures = []
+        for pid, rows in processes:
+            procname = columns.procnames.get(pid, f"Unknown-{pid}")
+            futures.append((pid, procname, executor.submit(render_process_timeline, pid, procname, rows, min_time, output_dir, marker_budget, dpi)))
+        for pid, procname, future in futures:
+            future.result()
+            print(f"Generated timeline for process {procname} (ID: {pid})")
 
 if __name__ == "__main__":
-    json_file = "trace.json"
-    
-    plot_process_timeline(json_file)
+    parser = argparse.ArgumentParser(description="Plot a timeline of the events of every traced process")
+    parser.add_argument("trace_file", nargs="?", default="trace.npz", help="trace.npz, trace.ndjson, trace.json or the directory of a rotated session. Default is trace.npz.")
+    parser.add_argument("--from", dest="time_from", help="Only plot events at or after this time, in seconds since the Unix epoch.")
+    parser.add_argument("--to", dest="time_to", help="Only plot events at or before this time, in seconds since the Unix epoch.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of processes rendered concurrently. Default is the number of CPU cores.")
+    parser.add_argument("--marker-budget", type=int, default=MARKER_BUDGET, help=f"Maximum events of a row drawn as single markers, rows with more events are drawn as a density raster. Default is {MARKER_BUDGET}.")
+    parser.add_argument("--dpi", type=int, default=DPI, help=f"Resolution of the PNG files. Default is {DPI}.")
+    args = parser.parse_args()
+
+    plot_process_timeline(args.trace_file, start_ns=parse_time(args.time_from), end_ns=parse_time(args.time_to),
+                          jobs=args.jobs, marker_budget=args.marker_budget, dpi=args.dpi)
@@ -0,0 +1,263 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    from ros2tools.util import run_command
+    from ros2tools.ctf_reader import find_ctf_traces
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from util import run_command
+    from ctf_reader import find_ctf_traces
+
+
+# trace_profiles.py defines the tracing profiles of `ros2-tracer`: the UST and
+# kernel events, the ring buffer sizes and the contexts of an LTTng session,
+# from callbacks only up to all ROS 2 events with the scheduler events of the
+# kernel. `benchmark_profiles` measures what a profile costs on the running
+# system: the CPU time spent while tracing compared to an untraced window of
+# the same length, the recorded and discarded events and the trace size.
+
+# Initialization events which name the nodes, topics and callbacks; they are
+# rare and part of every profile so that the traces can be analyzed
+ROS2_INIT_EVENTS = [
+    "ros2:rcl_init",
+    "ros2:rcl_node_init",
+    "ros2:rcl_publisher_init",
+    "ros2:rcl_subscription_init",
+    "ros2:rclcpp_subscription_init",
+    "ros2:rclcpp_subscription_callback_added",
+    "ros2:rcl_service_init",
+    "ros2:rclcpp_service_callback_added",
+    "ros2:rcl_client_init",
+    "ros2:rcl_timer_init",
+    "ros2:rclcpp_timer_callback_added",
+    "ros2:rclcpp_timer_link_node",
+    "ros2:rclcpp_callback_register",
+]
+CALLBACK_EVENTS = ["ros2:callback_start", "ros2:callback_end"]
+MESSAGING_EVENTS = [
+    "ros2:rclcpp_publish",
+    "ros2:rclcpp_intra_publish",
+    "ros2:rcl_publish",
+    "ros2:rmw_publish",
+    "ros2:rmw_take",
+    "ros2:rcl_take",
+    "ros2:rclcpp_take",
+]
+KERNEL_EVENTS = [
+    "sched_switch",
+    "sched_wakeup",
+    "sched_waking",
+    "sched_process_fork",
+    "sched_process_exit",
+]
+UST_CONTEXTS = ["vpid", "vtid", "procname"]
+KERNEL_CONTEXTS = ["pid", "tid", "procname"]
+
+UST_CHANNEL = "ros"
+KERNEL_CHANNEL = "kernel"
+DISCARDED_EVENTS_PATTERN = re.compile(r"Discarded events:\s*(\d+)")
+LOST_PACKETS_PATTERN = re.compile(r"Lost packets:\s*(\d+)")
+BENCHMARK_SECONDS = 10
+
+
+class TraceProfile:
+    """
+    The events, ring buffers and contexts of a tracing session.
+
+    :param name: The name of the profile, see TRACE_PROFILES
+    :param description: One line description for the help
+    :param ust_events: UST event names or globs
+    :param kernel_events: Kernel event names, none for a UST only session
+    :param subbuf_size: Size of the UST sub-buffers, e.g. "1M"
+    :param num_subbuf: Number of UST sub-buffers per CPU
+    :param kernel_subbuf_size: Size of the kernel sub-buffers
+    :param kernel_num_subbuf: Number of kernel sub-buffers per CPU
+    """
+
+    def __init__(self, name, description, ust_events, kernel_events=(), subbuf_size="1M", num_subbuf=4,
+                 kernel_subbuf_size="4M", kernel_num_subbuf=4, ust_contexts=UST_CONTEXTS, kernel_contexts=KERNEL_CONTEXTS):
+        self.name = name
+        self.description = description
+        self.ust_events = list(ust_events)
+        self.kernel_events = list(kernel_events)
+        self.subbuf_size = subbuf_size
+        self.num_subbuf = num_subbuf
+        self.kernel_subbuf_size = kernel_subbuf_size
+        self.kernel_num_subbuf = kernel_num_subbuf
+        self.ust_contexts = list(ust_contexts)
+        self.kernel_contexts = list(kernel_contexts)
+
+    def session_commands(self, session_name, create_options="", subbuf_size=None, num_subbuf=None, overwrite=False):
+        """
+        The `lttng` commands which create and configure a session with this
+        profile, without starting it.
+
+        :param create_options: Options of `lttng create`, e.g. "--live" or "--output=<directory>"
+        :param subbuf_size: Size of the UST sub-buffers instead of the one of the profile
+        :param num_subbuf: Number of UST sub-buffers instead of the one of the profile
+        :param overwrite: Overwrite the oldest events when the buffers are full, for snapshot sessions
+        """
+        session = f"-s {session_name}"
+        mode = " --overwrite" if overwrite else ""
+        commands = [
+            f"lttng create {session_name} {create_options}".strip(),
+            f"lttng enable-channel -u {UST_CHANNEL} {session}{mode} --subbuf-size={subbuf_size or self.subbuf_size} --num-subbuf={num_subbuf or self.num_subbuf}",
+            f"lttng enable-event -u -c {UST_CHANNEL} {session} '{','.join(self.ust_events)}'",
+            f"lttng add-context -u {session} " + " ".join(f"-t {context}" for context in self.ust_contexts),
+        ]
+        if self.kernel_events:
+            commands += [
+                f"lttng enable-channel -k {KERNEL_CHANNEL} {session}{mode} --subbuf-size={self.kernel_subbuf_size} --num-subbuf={self.kernel_num_subbuf}",
+                f"lttng enable-event -k -c {KERNEL_CHANNEL} {session} '{','.join(self.kernel_events)}'",
+                f"lttng add-context -k -c {KERNEL_CHANNEL} {session} " + " ".join(f"-t {context}" for context in self.kernel_contexts),
+            ]
+        return commands
+
+
+TRACE_PROFILES = {
+    profile.name: profile
+    for profile in [
+        TraceProfile(
+            "minimal",
+            "callback start and end only, for the callback durations",
+            ROS2_INIT_EVENTS + CALLBACK_EVENTS,
+            subbuf_size="512K",
+        ),
+        TraceProfile(
+            "messaging",
+            "callbacks and the publish and take path of the messages",
+            ROS2_INIT_EVENTS + CALLBACK_EVENTS + MESSAGING_EVENTS,
+            subbuf_size="2M",
+        ),
+        TraceProfile(
+            "ros2",
+            "all ROS 2 events",
+            ["ros2:*"],
+            subbuf_size="8M",
+        ),
+        TraceProfile(
+            "full",
+            "all ROS 2 events and the scheduler events of the kernel",
+            ["ros2:*"],
+            KERNEL_EVENTS,
+            subbuf_size="8M",
+            kernel_subbuf_size="8M",
+        ),
+    ]
+}
+
+
+def get_profile(name):
+    profile = TRACE_PROFILES.get(name)
+    if profile is None:
+        raise Exception(f"ERROR: Unknown tracing profile: {name}, use one of {', '.join(TRACE_PROFILES)}.")
+    return profile
+
+
+def configure_session(profile, session_name, create_options="", echo=True, **options):
+    """Create and configure a session with `profile`, see `TraceProfile.session_commands`."""
+    for command in profile.session_commands(session_name, create_options, **options):
+        run_command(command, echo=echo, echo_out=echo)
+
+
+def cpu_busy_seconds():
+    """The CPU time of all cores in seconds, except idle and iowait, from /proc/stat."""
+    with open("/proc/stat", "r") as f:
+        fields = [int(value) for value in f.readline().split()[1:]]
+    # user nice system idle iowait irq softirq steal
+    busy = sum(fields[:8]) - fields[3] - fields[4]
+    return busy / os.sysconf("SC_CLK_TCK")
+
+
+def measure_cpu(seconds):
+    start = cpu_busy_seconds()
+    time.sleep(seconds)
+    return cpu_busy_seconds() - start
+
+
+def session_statistics(session_name):
+    """The discarded events and lost packets of all channels of a session, from `lttng list`."""
+    stdout, _ = run_command(f"lttng list {session_name}")
+    discarded = sum(int(count) for count in DISCARDED_EVENTS_PATTERN.findall(stdout))
+    lost = sum(int(count) for count in LOST_PACKETS_PATTERN.findall(stdout))
+    return discarded, lost
+
+
+def count_trace_events(trace_directory):
+    """The number of events of the CTF traces below `trace_directory`."""
+    traces = " ".join(f"'{trace}'" for trace in find_ctf_traces(trace_directory))
+    if not traces:
+        return 0
+    process = subprocess.Popen(f"babeltrace2 {traces}", shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    count = 0
+    for block in iter(lambda: process.stdout.read(1024 * 1024), b""):
+        count += block.count(b"\n")
+    process.wait()
+    return count
+
+
+def directory_size(directory):
+    size = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def benchmark_profile(profile, seconds=BENCHMARK_SECONDS, session_name="ros2_tracer_benchmark"):
+    """
+    Trace the running system with `profile` for `seconds` and compare the CPU
+    time with an untraced window of the same length right before.
+
+    :return: A dictionary with the measured values
+    """
+    baseline = measure_cpu(seconds)
+    with tempfile.TemporaryDirectory(prefix="ros2_tracer_benchmark_") as directory:
+        configure_session(profile, session_name, f"--output={directory}", echo=False)
+        run_command(f"lttng start {session_name}")
+        traced = measure_cpu(seconds)
+        run_command(f"lttng stop {session_name}", timeout=None)
+        discarded, lost = session_statistics(session_name)
+        run_command(f"lttng destroy {session_name}", timeout=None)
+        events = count_trace_events(directory)
+        size = directory_size(directory)
+    overhead = traced - baseline
+    return {
+        "profile": profile.name,
+        "events_per_second": events / seconds,
+        "discarded_events": discarded,
+        "lost_packets": lost,
+        "trace_bytes_per_second": size / seconds,
+        "cpu_baseline": baseline / seconds,
+        "cpu_traced": traced / seconds,
+        "cpu_overhead": overhead / seconds,
+        "ns_per_event": overhead * 1e9 / events if events else None,
+    }
+
+
+def benchmark_profiles(names=None, seconds=BENCHMARK_SECONDS):
+    """
+    Run `benchmark_profile` for the profiles `names` (all by default) one
+    after another and print a table of the results. The ROS 2 system to
+    observe must be running.
+    """
+    results = []
+    for name in names or TRACE_PROFILES:
+        print(f"Benchmarking profile {name} ({2 * seconds} s)...")
+        results.append(benchmark_profile(get_profile(name), seconds))
+
+    print(f"\n{'profile':<10} {'events/s':>10} {'discarded':>10} {'lost':>6} {'MB/s':>8} {'CPU base':>9} {'CPU traced':>11} {'overhead':>9} {'ns/event':>9}")
+    for result in results:
+        ns_per_event = "-" if result["ns_per_event"] is None else f"{result['ns_per_event']:.0f}"
+        print(
+            f"{result['profile']:<10} {result['events_per_second']:>10.0f} {result['discarded_events']:>10} {result['lost_packets']:>6} "
+            f"{result['trace_bytes_per_second'] / 1e6:>8.2f} {result['cpu_baseline']:>9.2f} {result['cpu_traced']:>11.2f} "
+            f"{result['cpu_overhead']:>9.3f} {ns_per_event:>9}"
+        )
+    print("CPU values are cores busy on average, the overhead includes the LTTng consumer daemons.")
+    return results
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import plotly.graph_objects as go
+
+try:
+    from ros2tools.trace_plotter import load_plot_columns, group_rows
+    from ros2tools.trace_filter import parse_time
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+    from trace_plotter import load_plot_columns, group_rows
+    from trace_filter import parse_time
+
+
+# trace_timeline.py writes an interactive HTML timeline of a trace with one row
+# per process and event type. The events are not embedded in the page, they are
+# aggregated into tiles at several time resolutions (levels):
+#   level 0     bins of `--resolution` us
+#   level n     bins of LEVEL_FACTOR times the width of level n - 1, up to the
+#               level where a single tile covers the whole trace
+#   tile        TILE_BINS consecutive bins of one level, a script in
+#               tiles/<level>/<tile>.js with the count and the first and last
+#               timestamp of every non empty bin of every row
+# The aggregates of a level are computed from the level below, so the events
+# are only sorted once. The page loads the coarsest tile first and on every
+# zoom or pan the tiles of the level with about TARGET_BINS bins across the
+# visible range, at most a few tiles with TILE_BINS bins per row each, however
+# large the trace is. Tiles are loaded as scripts, so the page also works when
+# it is opened from the file system.
+
+RESOLUTION_US = 10
+LEVEL_FACTOR = 4
+TILE_BINS = 1024
+TARGET_BINS = 1000
+CACHE_TILES = 64
+ROW_HEIGHT = 22
+
+VIEWER_SCRIPT = """
+(function() {
+    const manifest = MANIFEST;
+    const plot = document.getElementById('{plot_id}');
+    const coarsest = manifest.levels.length - 1;
+    const available = manifest.levels.map(level => new Set(level.tiles));
+    // Loaded tiles by "level/tile", in the order of their last use
+    const tiles = new Map();
+    const pending = new Set();
+    let view = {level: coarsest, first: 0, last: 0};
+
+    function tileSpan(level) {
+        return manifest.levels[level].width * manifest.tile_bins;
+    }
+
+    function loadTile(level, tile) {
+        const key = level + '/' + tile;
+        if (tiles.has(key) || pending.has(key)) {
+            return;
+        }
+        pending.add(key);
+        const script = document.createElement('script');
+        script.src = manifest.tiles + '/' + key + '.js';
+        script.onload = script.onerror = () => { pending.delete(key); script.remove(); };
+        document.head.appendChild(script);
+    }
+
+    window.timelineTile = function(level, tile, rows) {
+        tiles.set(level + '/' + tile, rows);
+        for (const key of tiles.keys()) {
+            if (tiles.size <= manifest.cache_tiles) {
+                break;
+            }
+            if (key !== coarsest + '/0') {
+                tiles.delete(key);
+            }
+        }
+        if (level === view.level || level === coarsest) {
+            render();
+        }
+    };
+
+    function update() {
+        const range = plot.layout.xaxis.range;
+        const start = Math.max(range[0] * 1e9, 0);
+        const end = Math.max(range[1] * 1e9, start);
+        let level = 0;
+        while (level < coarsest && manifest.levels[level].width * manifest.target_bins < end - start) {
+            level++;
+        }
+        if (level !== view.level) {
+            const width = manifest.levels[level].width;
+            Plotly.relayout(plot, {'title.text': manifest.title + '<br><sub>bins of ' + (width / 1e3).toLocaleString() + ' us</sub>'});
+        }
+        const span = tileSpan(level);
+        view = {level: level, first: Math.floor(start / span), last: Math.floor(end / span)};
+        for (let tile = view.first; tile <= view.last; tile++) {
+            if (available[level].has(tile)) {
+                loadTile(level, tile);
+            }
+        }
+        render();
+    }
+
+    function render() {
+        const xs = manifest.traces.map(() => []);
+        const ys = manifest.traces.map(() => []);
+        const counts = manifest.traces.map(() => []);
+        const span = tileSpan(view.level);
+
+        function draw(level, tile, rows, from, to) {
+            const width = manifest.levels[level].width;
+            const origin = tile * tileSpan(level);
+            for (const [row, bins, binCounts, firsts, lasts] of rows) {
+                const trace = manifest.rows[row].trace;
+                for (let i = 0; i < bins.length; i++) {
+                    const binStart = origin + bins[i] * width;
+                    if (binStart + width <= from || binStart >= to) {
+                        continue;
+                    }
+                    xs[trace].push((binStart + firsts[i]) / 1e9, (binStart + lasts[i]) / 1e9, null);
+                    ys[trace].push(row, row, null);
+                    counts[trace].push(binCounts[i], binCounts[i], null);
+                }
+            }
+        }
+
+        for (let tile = view.first; tile <= view.last; tile++) {
+            if (!available[view.level].has(tile)) {
+                continue;
+            }
+            const key = view.level + '/' + tile;
+            if (tiles.has(key)) {
+                const rows = tiles.get(key);
+                tiles.delete(key);
+                tiles.set(key, rows);
+                draw(view.level, tile, rows, -Infinity, Infinity);
+            } else if (tiles.has(coarsest + '/0')) {
+                // Until the tile is loaded its time range is drawn from the coarsest level
+                draw(coarsest, 0, tiles.get(coarsest + '/0'), tile * span, (tile + 1) * span);
+            }
+        }
+        Plotly.restyle(plot, {x: xs, y: ys, customdata: counts}, manifest.traces.map((_, trace) => trace));
+    }
+
+    plot.on('plotly_relayout', event => {
+        if (Object.keys(event).some(key => key.startsWith('xaxis'))) {
+            update();
+        }
+    });
+    loadTile(coarsest, 0);
+})();
+"""
+
+
+def row_bins(timestamps, origin, width):
+    """
+    Aggregate the sorted timestamps of one row into bins of `width` ns from `origin`.
+
+    :return: A dictionary of arrays `bin`, `count`, `first` and `last`, one
+        entry per non empty bin
+    """
+    bins = (timestamps - origin) // width
+    starts = np.flatnonzero(np.diff(bins, prepend=-1))
+    ends = np.append(starts[1:], len(bins))
+    return {"bin": bins[starts], "count": ends - starts, "first": timestamps[starts], "last": timestamps[ends - 1]}
+
+
+def coarser_bins(aggregates, factor):
+    """Merge every `factor` consecutive bins of `row_bins` aggregates into one."""
+    bins = aggregates["bin"] // factor
+    starts = np.flatnonzero(np.diff(bins, prepend=-1))
+    ends = np.append(starts[1:], len(bins))
+    return {
+        "bin": bins[starts],
+        "count": np.add.reduceat(aggregates["count"], starts),
+        "first": aggregates["first"][starts],
+        "last": aggregates["last"][ends - 1],
+    }
+
+
+def build_levels(rows, origin, end, resolution_ns, factor=LEVEL_FACTOR, tile_bins=TILE_BINS):
+    """
+    The aggregates of every row at every level.
+
+    :param rows: The sorted timestamps of every row
+    :return: A tuple (widths, levels): the bin width of every level in ns and
+        per level a list with the aggregates of every row, see `row_bins`
+    """
+    widths = [resolution_ns]
+    levels = [[row_bins(timestamps, origin, resolution_ns) for timestamps in rows]]
+    while widths[-1] * tile_bins <= end - origin:
+        widths.append(widths[-1] * factor)
+        levels.append([coarser_bins(aggregates, factor) for aggregates in levels[-1]])
+    return widths, levels
+
+
+def write_level_tiles(level, aggregates, origin, width, tile_dir, tile_bins=TILE_BINS):
+    """
+    Write the tiles of one level, see VIEWER_SCRIPT for the format.
+
+    :param aggregates: The aggregates of every row at this level
+    :return: The sorted numbers of the written tiles
+    """
+    row_numbers = np.concatenate([np.full(len(row["bin"]), number, dtype=np.int64) for number, row in enumerate(aggregates)])
+    columns = {name: np.concatenate([row[name] for row in aggregates]) for name in ["bin", "count", "first", "last"]}
+    # First and last timestamp relative to the start of their bin, to keep the tiles small
+    bin_starts = origin + columns["bin"] * width
+    columns["first"] = columns["first"] - bin_starts
+    columns["last"] = columns["last"] - bin_starts
+    tile_numbers = columns["bin"] // tile_bins
+    columns["bin"] = columns["bin"] % tile_bins
+    order = np.argsort(tile_numbers, kind="stable")
+    tile_numbers, row_numbers = tile_numbers[order], row_numbers[order]
+    columns = {name: column[order] for name, column in columns.items()}
+
+    os.makedirs(tile_dir, exist_ok=True)
+    tile_starts = np.flatnonzero(np.diff(tile_numbers, prepend=-1))
+    tile_ends = np.append(tile_starts[1:], len(tile_numbers))
+    for tile_start, tile_end in zip(tile_starts.tolist(), tile_ends.tolist()):
+        tile = int(tile_numbers[tile_start])
+        rows = []
+        boundaries = np.flatnonzero(np.diff(row_numbers[tile_start:tile_end], prepend=-1)).tolist() + [tile_end - tile_start]
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            start, end = tile_start + start, tile_start + end
+            rows.append([int(row_numbers[start])] + [columns[name][start:end].tolist() for name in ["bin", "count", "first", "last"]])
+        with open(os.path.join(tile_dir, f"{tile}.js"), "w") as f:
+            f.write(f"timelineTile({level}, {tile}, {json.dumps(rows, separators=(',', ':'))});\n")
+    return tile_numbers[tile_starts].tolist()
+
+
+def write_timeline(trace_file, output_dir="timeline", start_ns=None, end_ns=None, resolution_ns=RESOLUTION_US * 1000):
+    """
+    Write the interactive timeline of a trace to `output_dir`: index.html and
+    the tiles of every level in tiles/.
+
+    :param trace_file: trace.npz, trace.ndjson, trace.json or the directory of a rotated session
+    :param resolution_ns: Bin width of the finest level in ns
+    :return: The path of index.html, None if there are no events with a vpid
+    """
+    columns = load_plot_columns(trace_file, start_ns, end_ns)
+    if not len(columns.timestamps):
+        print("No events with a vpid to plot.")
+        return None
+    origin = int(columns.timestamps.min())
+    end = int(columns.timestamps.max())
+
+    rows, labels, event_types = [], [], []
+    for vpid, process_rows in group_rows(columns):
+        procname = columns.procnames.get(vpid, f"Unknown-{vpid}")
+        for event_type, timestamps in process_rows:
+            if event_type not in event_types:
+                event_types.append(event_type)
+            rows.append(timestamps)
+            labels.append({"label": f"{procname} ({vpid}) {event_type.split(':')[-1]}", "trace": event_types.index(event_type)})
+
+    widths, levels = build_levels(rows, origin, end, resolution_ns)
+    tiles = []
+    for number, (width, aggregates) in enumerate(zip(widths, levels)):
+        tiles.append({"width": width, "tiles": write_level_tiles(number, aggregates, origin, width, os.path.join(output_dir, "tiles", str(number)))})
+    print(f"Wrote {sum(len(level['tiles']) for level in tiles)} tiles in {len(widths)} levels for {len(columns.timestamps)} events")
+
+    title = f"ros2-tracer Trace Timeline: {os.path.basename(os.path.abspath(trace_file))}"
+    manifest = {
+        "title": title,
+        "tiles": "tiles",
+        "tile_bins": TILE_BINS,
+        "target_bins": TARGET_BINS,
+        "cache_tiles": CACHE_TILES,
+        "levels": tiles,
+        "rows": labels,
+        "traces": event_types,
+    }
+    colors = go.Figure().layout.template.layout.colorway or ["#1f77b4"]
+    fig = go.Figure(
+        data=[
+            go.Scattergl(
+                x=[], y=[], name=event_type.split(':')[-1], mode="lines+markers",
+                line=dict(width=6, color=colors[number % len(colors)]), marker=dict(size=6, color=colors[number % len(colors)]),
+                hovertemplate="%{x:.6f} s<br>%{customdata} events in the bin<extra>%{fullData.name}</extra>",
+            )
+            for number, event_type in enumerate(event_types)
+        ],
+        layout=go.Layout(
+            title=title,
+            height=200 + ROW_HEIGHT * len(rows),
+            hovermode="closest",
+            xaxis=dict(title="Time (seconds since trace start)", range=[0, (end - origin) / 1e9], showgrid=True),
+            yaxis=dict(tickvals=list(range(len(rows))), ticktext=[row["label"] for row in labels],
+                       range=[len(rows) - 0.5, -0.5], showgrid=False, zeroline=False, fixedrange=True),
+            margin=dict(l=260, r=20, t=80, b=60),
+        ),
+    )
+    output_file = os.path.join(output_dir, "index.html")
+    fig.write_html(output_file, post_script=VIEWER_SCRIPT.replace("MANIFEST", json.dumps(manifest)), config={"scrollZoom": True})
+    print(f"Timeline saved as {output_file}")
+    return output_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write an interactive HTML timeline of a trace, zoomable down to single events")
+    parser.add_argument("trace_file", nargs="?", default="trace.npz", help="trace.npz, trace.ndjson, trace.json or the directory of a rotated session. Default is trace.npz.")
+    parser.add_argument("-o", "--output", default="timeline", help="Output directory for index.html and the tiles. Default is timeline.")
+    parser.add_argument("--from", dest="time_from", help="Only show events at or after this time, in seconds since the Unix epoch.")
+    parser.add_argument("--to", dest="time_to", help="Only show events at or before this time, in seconds since the Unix epoch.")
+    parser.add_argument("--resolution", type=float, default=RESOLUTION_US, help=f"Bin width of the finest zoom level in us. Default is {RESOLUTION_US}.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.trace_file):
+        print(f"ERROR: There is no trace: {args.trace_file}", file=sys.stderr)
+        sys.exit(1)
+    write_timeline(args.trace_file, args.output, parse_time(args.time_from), parse_time(args.time_to), max(int(args.resolution * 1000), 1))
+
+
+if __name__ == "__main__":
+    main()
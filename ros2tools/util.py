@@ -1,9 +1,23 @@
 import subprocess
+import gzip
+import io
 import json
 import os
 import shutil
 import sys
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File extensions of the supported compression formats, zstd needs the
+# optional `zstandard` package
+COMPRESSION_EXTENSIONS = {"gz": ".gz", "zst": ".zst"}
+JSON_SEPARATORS = (',', ':')
+# Number of array elements encoded at once by `write_compact_json`
+JSON_CHUNK_RECORDS = 10_000
+
 def check_command_installed(command):
     """Checks if the given command is installed."""
     if shutil.which(command) is None:
@@ -80,14 +94,130 @@ def run_command(command, timeout=5, echo=False, echo_out=False):
 
 
 
-def write_json_file(output_path, data):
+def compression_extension(path):
+    """Returns the compression extension of a path (".gz", ".zst") or an empty string."""
+    for extension in COMPRESSION_EXTENSIONS.values():
+        if path.endswith(extension):
+            return extension
+    return ""
+
+def open_file(path, mode='r'):
+    """
+    Open a file for reading, writing or appending. Files ending in `.gz` or
+    `.zst` are compressed and decompressed as a stream with gzip or zstd, so
+    readers and writers handle compressed files transparently.
+
+    Parameters:
+        path (str): The file to open.
+        mode (str): 'r', 'w' or 'a', with 'b' for binary access. Default is text reading.
+
+    Returns:
+        A file object.
+    """
+    extension = compression_extension(path)
+    binary = 'b' in mode
+    mode = mode.replace('b', '').replace('t', '')
+    if extension == ".gz":
+        return gzip.open(path, mode + ('b' if binary else 't'))
+    if extension == ".zst":
+        if zstandard is None:
+            raise Exception(f"ERROR: Reading or writing {path} requires the zstandard package. Install it with `pip3 install zstandard` and try again.")
+        raw = open(path, mode + 'b')
+        if mode == 'r':
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor(threads=-1).stream_writer(raw, closefd=True)
+        return stream if binary else io.TextIOWrapper(stream, encoding='utf-8')
+    return open(path, mode + ('b' if binary else ''))
+
+def compress_file(input_path, compression, remove=True):
+    """
+    Compress a file with gzip ("gz") or zstd ("zst") as a stream.
+
+    Returns:
+        str: The path of the compressed file.
+    """
+    output_path = input_path + COMPRESSION_EXTENSIONS[compression]
+    with open(input_path, 'rb') as source, open_file(output_path, 'wb') as target:
+        shutil.copyfileobj(source, target, 8 * 1024 * 1024)
+    if remove:
+        os.remove(input_path)
+    print(f"Compressed {input_path} to {output_path}")
+    return output_path
+
+def write_compact_json(f, data):
+    """
+    Write data as compact JSON to an open file. `json.dump` always encodes in
+    pure Python, `json.dumps` with the C encoder, so the text is encoded with
+    `json.dumps`; arrays in chunks of JSON_CHUNK_RECORDS elements, which bounds
+    the size of the encoded text held in memory.
+    """
+    if not isinstance(data, list):
+        f.write(json.dumps(data, separators=JSON_SEPARATORS))
+        return
+    f.write('[')
+    for start in range(0, len(data), JSON_CHUNK_RECORDS):
+        if start:
+            f.write(',')
+        f.write(json.dumps(data[start:start + JSON_CHUNK_RECORDS], separators=JSON_SEPARATORS)[1:-1])
+    f.write(']')
+
+def write_json_file(output_path, data, pretty=False):
+    """
+    Write data as JSON. The output is compact unless `pretty` is set and is
+    compressed according to the file extension, see `open_file`.
+    """
     try:
         if not data:
             raise IOError(f"ERROR: The provided data is null, nothing to write to: {output_path} skipping.")
-        with open(output_path, 'w') as f:
-            json.dump(data, f, indent=4)
+        with open_file(output_path, 'w') as f:
+            if pretty:
+                f.write(json.dumps(data, indent=4))
+            else:
+                write_compact_json(f, data)
         print(f"JSON file written to {output_path}")
     except IOError as e:
         print(f"Error writing to file: {e}")
         sys.exit(1)
 
+def read_json_file(input_path):
+    """Read a JSON file, compressed files are decompressed transparently."""
+    with open_file(input_path, 'r') as f:
+        return json.load(f)
+
+
+def write_ndjson_file(output_path, records):
+    """
+    Stream records to a newline delimited JSON (NDJSON) file, one compact JSON
+    object per line. `records` may be any iterable, including a generator, so
+    the records never have to be held in memory at once.
+
+    Parameters:
+        output_path (str): The NDJSON file to write.
+        records (iterable): The records to serialize.
+
+    Returns:
+        int: The number of records written.
+    """
+    count = 0
+    try:
+        with open_file(output_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=JSON_SEPARATORS))
+                f.write('\n')
+                count += 1
+        print(f"NDJSON file written to {output_path} ({count} records)")
+        return count
+    except IOError as e:
+        print(f"Error writing to file: {e}")
+        sys.exit(1)
+
+def read_ndjson_file(input_path):
+    """
+    Lazily read a newline delimited JSON (NDJSON) file, yielding one record per line.
+    Compressed files are decompressed transparently.
+    """
+    with open_file(input_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,75 @@
+import pytest
+
+from ros2tools.trace_columns import write_columnar_trace
+from ros2tools.callback_analysis import open_columnar_trace
+from ros2tools.message_flow import match_messages
+
+BASE = 1_700_000_000_000_000_000
+MESSAGES = 100
+
+
+def handle(value):
+    return f"0x{value:X}"
+
+
+def message_trace(path, rcl_publish=True, rmw_publisher_handle=False):
+    """
+    A talker publishing MESSAGES messages on /chatter to a listener, with a
+    null `publisher_handle` in `rclcpp_publish` like rclcpp records it.
+
+    :return: The path of the trace and the publish to callback latency of every message
+    """
+    talker = dict(vpid=1, vtid=1, procname="talker")
+    listener = dict(vpid=2, vtid=5, procname="listener")
+    events = [
+        dict(event="ros2:rcl_node_init", timestamp=BASE, node_handle=handle(0x10), node_name="talker", namespace="/", **talker),
+        dict(event="ros2:rcl_node_init", timestamp=BASE + 1, node_handle=handle(0x10), node_name="listener", namespace="/", **listener),
+        dict(event="ros2:rcl_publisher_init", timestamp=BASE + 2, publisher_handle=handle(0x20), node_handle=handle(0x10),
+             rmw_publisher_handle=handle(0x21), topic_name="/chatter", queue_depth=10, **talker),
+        dict(event="ros2:rcl_subscription_init", timestamp=BASE + 3, subscription_handle=handle(0x30), node_handle=handle(0x10),
+             rmw_subscription_handle=handle(0x31), topic_name="/chatter", queue_depth=10, **listener),
+    ]
+    latencies = []
+    for number in range(MESSAGES):
+        publish = BASE + 1_000_000 * (number + 1)
+        message = handle(0x7000 + number % 4 * 8)
+        events.append(dict(event="ros2:rclcpp_publish", timestamp=publish, publisher_handle=handle(0), message=message, **talker))
+        if rcl_publish:
+            events.append(dict(event="ros2:rcl_publish", timestamp=publish + 500, publisher_handle=handle(0x20), message=message, **talker))
+        rmw_publish = dict(event="ros2:rmw_publish", timestamp=publish + 1000, message=message, payload_timestamp=publish + 990, **talker)
+        if rmw_publisher_handle:
+            rmw_publish["rmw_publisher_handle"] = handle(0x21)
+        events.append(rmw_publish)
+        take = publish + 20_000 + number
+        events.append(dict(event="ros2:rmw_take", timestamp=take, rmw_subscription_handle=handle(0x31), message=handle(0x9000),
+                           source_timestamp=publish + 990, taken=1, **listener))
+        events.append(dict(event="ros2:callback_start", timestamp=take + 2000, callback=handle(0x40), is_intra_process=0, **listener))
+        events.append(dict(event="ros2:callback_end", timestamp=take + 3000, callback=handle(0x40), **listener))
+        latencies.append(take + 2000 - publish)
+    trace_file = str(path / "trace.npz")
+    write_columnar_trace(trace_file, sorted(events, key=lambda event: event["timestamp"]))
+    return trace_file, latencies
+
+
+@pytest.mark.parametrize("rcl_publish, rmw_publisher_handle", [(True, False), (False, True), (True, True)])
+def test_null_rclcpp_publisher_handle(tmp_path, rcl_publish, rmw_publisher_handle):
+    trace_file, latencies = message_trace(tmp_path, rcl_publish, rmw_publisher_handle)
+    trace = open_columnar_trace(trace_file)
+    messages = match_messages(trace)
+    trace.close()
+
+    assert messages["exact"]
+    assert messages["unmatched_takes"] == 0
+    assert messages["topics"] == ["/chatter"]
+    assert sorted((messages["callback_start"] - messages["publish"]).tolist()) == sorted(latencies)
+    assert [messages["endpoints"][number] for number in set(messages["publisher"].tolist())] == [("/chatter", "/talker")]
+
+
+def test_unknown_publisher_is_not_matched(tmp_path):
+    trace_file, _ = message_trace(tmp_path, rcl_publish=False, rmw_publisher_handle=False)
+    trace = open_columnar_trace(trace_file)
+    messages = match_messages(trace)
+    trace.close()
+
+    assert len(messages["publish"]) == 0
+    assert messages["unmatched_takes"] == MESSAGES
@@ -0,0 +1,42 @@
+import pytest
+
+from ros2tools.trace_columns import write_columnar_trace
+from ros2tools.callback_analysis import open_columnar_trace
+from ros2tools.sched_analysis import analyze_scheduling, TASK_REPORT_MAX
+
+BASE = 1_700_000_000_000_000_000
+
+
+def sched_trace(path, prev_state):
+    """
+    A callback of thread 5 from 100 to 200 ns, which runs from 90 to 150 ns,
+    is switched out with `prev_state` and switched in again at 180 ns.
+    """
+    node = dict(vpid=5, vtid=5, procname="node")
+    events = [dict(event="ros2:rcl_node_init", timestamp=BASE, node_handle="0x1", rmw_handle="0x2", node_name="node", namespace="/", **node)]
+    for timestamp, prev_tid, state, next_tid in [(90, 0, 0, 5), (150, 5, prev_state, 0), (180, 0, 0, 5), (300, 5, 1, 0)]:
+        events.append(dict(event="sched_switch", timestamp=BASE + timestamp, cpu_id=0, prev_comm="a", prev_tid=prev_tid, prev_prio=20,
+                           prev_state=state, next_comm="b", next_tid=next_tid, next_prio=20))
+    events.append(dict(event="ros2:callback_start", timestamp=BASE + 100, callback="0x40", is_intra_process=0, **node))
+    events.append(dict(event="ros2:callback_end", timestamp=BASE + 200, callback="0x40", **node))
+    trace_file = str(path / "trace.npz")
+    write_columnar_trace(trace_file, sorted(events, key=lambda event: event["timestamp"]))
+    return trace_file
+
+
+def callback_states(trace_file):
+    trace = open_columnar_trace(trace_file)
+    analysis = analyze_scheduling(trace)
+    trace.close()
+    [callback] = analysis["callbacks"]
+    return {state: callback[state] for state in ["running", "preempted", "waiting", "blocked"]}
+
+
+@pytest.mark.parametrize("prev_state", [0, TASK_REPORT_MAX, "TASK_RUNNING", "TASK_REPORT_MAX"])
+def test_preempted(tmp_path, prev_state):
+    assert callback_states(sched_trace(tmp_path, prev_state)) == {"running": 70, "preempted": 30, "waiting": 0, "blocked": 0}
+
+
+@pytest.mark.parametrize("prev_state", [1, "TASK_INTERRUPTIBLE"])
+def test_blocked(tmp_path, prev_state):
+    assert callback_states(sched_trace(tmp_path, prev_state)) == {"running": 70, "preempted": 0, "waiting": 0, "blocked": 30}
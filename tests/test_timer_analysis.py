@@ -0,0 +1,51 @@
+import pytest
+
+from ros2tools.trace_columns import write_columnar_trace
+from ros2tools.callback_analysis import open_columnar_trace
+from ros2tools.timer_analysis import analyze_timers
+
+BASE = 1_700_000_000_000_000_000
+PERIOD = 10_000_000
+
+
+def timer_trace(path, interval, count=100, skipped=()):
+    """A 10 ms timer of node /control whose callback starts every `interval` ns, except the `skipped` ones."""
+    node = dict(vpid=5, vtid=5, procname="control")
+    events = [
+        dict(event="ros2:rcl_node_init", timestamp=BASE, node_handle="0x1", rmw_handle="0x2", node_name="control", namespace="/", **node),
+        dict(event="ros2:rcl_timer_init", timestamp=BASE + 1, timer_handle="0x50", period=PERIOD, **node),
+        dict(event="ros2:rclcpp_timer_callback_added", timestamp=BASE + 2, timer_handle="0x50", callback="0x60", **node),
+        dict(event="ros2:rclcpp_timer_link_node", timestamp=BASE + 3, timer_handle="0x50", node_handle="0x1", **node),
+    ]
+    for number in range(count):
+        if number not in skipped:
+            events.append(dict(event="ros2:callback_start", timestamp=BASE + 1000 + number * interval, callback="0x60", is_intra_process=0, **node))
+    trace_file = str(path / "trace.npz")
+    write_columnar_trace(trace_file, events)
+    return trace_file
+
+
+def analyze(trace_file):
+    trace = open_columnar_trace(trace_file)
+    timers, boundaries, series = analyze_timers(trace)
+    trace.close()
+    [timer] = timers
+    return timer, series
+
+
+def test_constant_offset(tmp_path):
+    timer, series = analyze(timer_trace(tmp_path, 10_300_000))
+    assert timer["drift_ppm"] == pytest.approx(30000)
+    assert timer["missed"] == 0
+    assert timer["jitter_max"] == 300_000
+    # The offset accumulates against the period grid of the first start
+    assert series["phase"].tolist() == [number * 300_000 for number in range(100)]
+    assert timer["phase_max"] == 99 * 300_000
+
+
+def test_missed_periods(tmp_path):
+    timer, series = analyze(timer_trace(tmp_path, PERIOD, skipped=(10, 50, 51)))
+    assert timer["count"] == 97
+    assert timer["missed"] == 3
+    assert timer["drift_ppm"] == pytest.approx(0)
+    assert timer["phase_max"] == 0
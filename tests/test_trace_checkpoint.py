@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+from ros2tools.trace_checkpoint import TraceCheckpoint, write_ndjson_checkpointed
+from ros2tools.util import compress_file
+
+BASE = 1_700_000_000_000_000_000
+EVENTS = 100
+CONVERTED = 60
+
+
+def trace_events():
+    """Events of two CPUs, the timestamps of the second one lag behind."""
+    return [dict(event="ros2:callback_start", timestamp=BASE + 1000 * number + (500 if number % 2 else 0), cpu_id=number % 2, callback="0x40")
+            for number in range(EVENTS)]
+
+
+def convert(path, output_file, events, fingerprint):
+    """A conversion run like `ros2_tracer.convert_trace`, resuming from the checkpoint."""
+    checkpoint = TraceCheckpoint(str(path / "trace.checkpoint.json"), fingerprint)
+    resume = checkpoint.resume_from(output_file)
+    write_ndjson_checkpointed(output_file, [event for event in events if resume is None or event["timestamp"] >= resume], checkpoint)
+    return checkpoint
+
+
+def read_events(output_file):
+    with open(output_file) as f:
+        return [(event["event"], event["timestamp"], event["cpu_id"]) for event in map(json.loads, f)]
+
+
+@pytest.mark.parametrize("change", [None, "compressed", "removed", "truncated"])
+def test_resume(tmp_path, change):
+    output_file = str(tmp_path / "trace.ndjson")
+    events = trace_events()
+    convert(tmp_path, output_file, [dict(event) for event in events[:CONVERTED]], "1:100")
+    if change == "compressed":
+        compress_file(output_file, "gz")
+    elif change == "removed":
+        os.remove(output_file)
+    elif change == "truncated":
+        os.truncate(output_file, os.path.getsize(output_file) // 2)
+
+    checkpoint = convert(tmp_path, output_file, [dict(event) for event in events], "1:200")
+    assert checkpoint.events == EVENTS
+    assert read_events(output_file) == [(event["event"], event["timestamp"], event["cpu_id"]) for event in events]
@@ -0,0 +1,39 @@
+import pytest
+
+from ros2tools.trace_columns import write_columnar_trace
+from ros2tools.trace_compare import compare_main, REGRESSION_EXIT_CODE
+
+BASE = 1_700_000_000_000_000_000
+
+
+def callback_trace(path, name, durations):
+    """A trace of node /worker whose subscription callback runs for `durations` ns."""
+    node = dict(vpid=5, vtid=5, procname="worker")
+    events = [dict(event="ros2:rcl_node_init", timestamp=BASE, node_handle="0x1", rmw_handle="0x2", node_name="worker", namespace="/", **node)]
+    for number, duration in enumerate(durations):
+        start = BASE + 1_000_000 * (number + 1)
+        events.append(dict(event="ros2:callback_start", timestamp=start, callback="0x40", is_intra_process=0, **node))
+        events.append(dict(event="ros2:callback_end", timestamp=start + duration, callback="0x40", **node))
+    trace_file = str(path / f"{name}.npz")
+    write_columnar_trace(trace_file, events)
+    return trace_file
+
+
+def compare(tmp_path, durations_a, durations_b, *options):
+    trace_a = callback_trace(tmp_path, "a", durations_a)
+    trace_b = callback_trace(tmp_path, "b", durations_b)
+    return compare_main([trace_a, trace_b, "-o", str(tmp_path / "compare.json"), *options])
+
+
+BASELINE = [100_000 + 1000 * (number % 50) for number in range(200)]
+
+
+@pytest.mark.parametrize("durations_b, options, exit_code", [
+    (BASELINE, [], 0),
+    ([duration + 2000 for duration in BASELINE], [], 0),
+    ([duration * 3 // 2 for duration in BASELINE], [], REGRESSION_EXIT_CODE),
+    ([duration * 3 // 2 for duration in BASELINE], ["--threshold", "60"], 0),
+    ([duration * 3 // 2 for duration in BASELINE[:20]], [], 0),
+])
+def test_regression_gate(tmp_path, durations_b, options, exit_code):
+    assert compare(tmp_path, BASELINE, durations_b, *options) == exit_code
@@ -0,0 +1,107 @@
+import json
+import os
+import subprocess
+import sys
+
+from ros2tools.trace_export import export_main
+
+BASE = 1_700_000_000_000_000_000
+MESSAGES = 10
+PERIOD = 10_000_000
+
+
+def handle(value):
+    return f"0x{value:X}"
+
+
+def export_trace(path):
+    """
+    A talker publishing MESSAGES messages on /chatter every 10 ms to a listener
+    as trace.ndjson, with a null `publisher_handle` in `rclcpp_publish`.
+    """
+    talker = dict(vpid=1, vtid=1, procname="talker")
+    listener = dict(vpid=2, vtid=5, procname="listener")
+    events = [
+        dict(event="ros2:rcl_node_init", node_handle=handle(0x10), node_name="talker", namespace="/", **talker),
+        dict(event="ros2:rcl_node_init", node_handle=handle(0x10), node_name="listener", namespace="/", **listener),
+        dict(event="ros2:rcl_publisher_init", publisher_handle=handle(0x20), node_handle=handle(0x10), rmw_publisher_handle=handle(0x21),
+             topic_name="/chatter", queue_depth=10, **talker),
+        dict(event="ros2:rcl_subscription_init", subscription_handle=handle(0x30), node_handle=handle(0x10), rmw_subscription_handle=handle(0x31),
+             topic_name="/chatter", queue_depth=10, **listener),
+        dict(event="ros2:rclcpp_subscription_init", subscription_handle=handle(0x30), subscription=handle(0x32), **listener),
+        dict(event="ros2:rclcpp_subscription_callback_added", subscription=handle(0x32), callback=handle(0x40), **listener),
+    ]
+    events = [dict(timestamp=BASE + number, **event) for number, event in enumerate(events)]
+    for number in range(MESSAGES):
+        publish = BASE + PERIOD * (number + 1)
+        message = handle(0x7000 + number % 2 * 8)
+        events += [
+            dict(timestamp=publish, event="ros2:rclcpp_publish", publisher_handle=handle(0), message=message, **talker),
+            dict(timestamp=publish + 500, event="ros2:rcl_publish", publisher_handle=handle(0x20), message=message, **talker),
+            dict(timestamp=publish + 1234, event="ros2:rmw_publish", message=message, payload_timestamp=publish + 1000, **talker),
+            dict(timestamp=publish + 20_000, event="ros2:rmw_take", rmw_subscription_handle=handle(0x31), message=handle(0x9000),
+                 source_timestamp=publish + 1000, taken=1, **listener),
+            dict(timestamp=publish + 22_000, event="ros2:callback_start", callback=handle(0x40), is_intra_process=0, **listener),
+            dict(timestamp=publish + 25_000, event="ros2:callback_end", callback=handle(0x40), **listener),
+        ]
+    trace_file = str(path / "trace.ndjson")
+    with open(trace_file, "w") as f:
+        f.writelines(json.dumps(event, separators=(",", ":")) + "\n" for event in events)
+    return trace_file
+
+
+def read_export(output_file):
+    with open(output_file) as f:
+        text = f.read()
+    return text, json.loads(text)["traceEvents"]
+
+
+def phases(trace_events, phase):
+    return [event for event in trace_events if event["ph"] == phase]
+
+
+def test_export(tmp_path):
+    output_file = str(tmp_path / "trace_events.json")
+    assert export_main([export_trace(tmp_path), "-o", output_file]) == 0
+    text, trace_events = read_export(output_file)
+
+    starts, ends = phases(trace_events, "B"), phases(trace_events, "E")
+    assert len(starts) == len(ends) == MESSAGES
+    assert {event["name"] for event in starts} == {"/chatter"}
+    # Relative to the first event after the init events, the first publish
+    assert [event["ts"] for event in ends] == [(PERIOD * number + 25_000) / 1000 for number in range(MESSAGES)]
+
+    publishes = phases(trace_events, "X")
+    assert [event["name"] for event in publishes] == ["publish /chatter"] * MESSAGES
+    # Timestamps and durations are exact decimal us
+    assert '"ts":10000.000,"pid":1,"tid":1,"dur":1.234,' in text
+
+    flows_out, flows_in = phases(trace_events, "s"), phases(trace_events, "f")
+    assert len(flows_out) == len(flows_in) == MESSAGES
+    assert [event["id"] for event in flows_out] == [event["id"] for event in flows_in]
+    assert len({event["id"] for event in flows_out}) == MESSAGES
+    assert all(event["tid"] == 5 and event["bp"] == "e" for event in flows_in)
+
+
+def test_export_time_range(tmp_path):
+    output_file = str(tmp_path / "trace_events.json")
+    start_seconds = f"{BASE // 10**9}.{PERIOD * 5 // 10**6:03d}"
+    assert export_main([export_trace(tmp_path), "-o", output_file, "--from", start_seconds]) == 0
+    _, trace_events = read_export(output_file)
+
+    # The registry and publisher init events before --from still name the callbacks and topics
+    starts = phases(trace_events, "B")
+    assert len(starts) == MESSAGES - 4
+    assert {event["name"] for event in starts} == {"/chatter"}
+    assert len(phases(trace_events, "X")) == len(phases(trace_events, "f")) == MESSAGES - 4
+
+
+def test_export_is_deterministic(tmp_path):
+    trace_file = export_trace(tmp_path)
+    outputs = []
+    for seed in ("1", "2"):
+        output_file = str(tmp_path / f"trace_events_{seed}.json")
+        code = f"import sys; from ros2tools.trace_export import export_main; sys.exit(export_main([{trace_file!r}, '-o', {output_file!r}]))"
+        subprocess.run([sys.executable, "-c", code], check=True, env=dict(os.environ, PYTHONHASHSEED=seed), cwd=os.path.dirname(os.path.dirname(__file__)))
+        outputs.append(read_export(output_file)[0])
+    assert outputs[0] == outputs[1]
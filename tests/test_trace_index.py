@@ -0,0 +1,64 @@
+import json
+
+from ros2tools.trace_index import TraceReader, ChunkedTraceReader, write_chunk_manifest, BUCKET_NS
+from ros2tools.util import compress_file
+
+BASE = 1_700_000_000_000_000_000
+
+
+def write_trace(path, timestamps, name="trace.ndjson"):
+    trace_file = str(path / name)
+    with open(trace_file, "w") as f:
+        for number, timestamp in enumerate(timestamps):
+            event = "ros2:callback_start" if number % 2 else "ros2:callback_end"
+            f.write(json.dumps({"timestamp": timestamp, "event": event, "vpid": 10 + number % 3}, separators=(",", ":")) + "\n")
+    return trace_file
+
+
+def timestamps_of(records):
+    return [record["timestamp"] for record in records]
+
+
+def test_out_of_order_in_bucket(tmp_path):
+    # A lagging stream writes 200 and 250 after 300, all in the first bucket
+    timestamps = [BASE + offset for offset in (100, 300, 200, 250, BUCKET_NS + 100)]
+    reader = TraceReader(write_trace(tmp_path, timestamps))
+    assert not reader.index.ordered
+    assert timestamps_of(reader.query(BASE + 150, BASE + 260)) == [BASE + 200, BASE + 250]
+    assert timestamps_of(reader.query(None, BASE + 260)) == [BASE + 100, BASE + 200, BASE + 250]
+
+
+def test_ordered_query(tmp_path):
+    timestamps = [BASE + number * BUCKET_NS // 4 for number in range(20)]
+    reader = TraceReader(write_trace(tmp_path, timestamps))
+    assert reader.index.ordered
+    assert timestamps_of(reader.query(timestamps[5], timestamps[9])) == timestamps[5:10]
+
+
+def test_compressed(tmp_path):
+    timestamps = [BASE + number * BUCKET_NS // 4 for number in range(20)]
+    trace_file = compress_file(write_trace(tmp_path, timestamps), "gz")
+    reader = TraceReader(trace_file)
+    assert reader.index is None
+    assert reader.event_classes == ["ros2:callback_end", "ros2:callback_start"]
+    assert reader.vpids == [10, 11, 12]
+    assert len(reader) == 20
+    assert (reader.start, reader.end) == (BASE, BASE + 5 * BUCKET_NS)
+    assert timestamps_of(reader.query(timestamps[5], timestamps[9], events="*start")) == timestamps[5:10:2]
+
+
+def test_compressed_chunks(tmp_path):
+    chunks = []
+    for number in range(2):
+        directory = tmp_path / "archives" / f"chunk-{number}"
+        directory.mkdir(parents=True)
+        timestamps = [BASE + number * 10 * BUCKET_NS + offset * BUCKET_NS // 2 for offset in range(10)]
+        chunks.append(compress_file(write_trace(directory, timestamps), "gz"))
+    manifest = write_chunk_manifest(str(tmp_path), chunks)
+    assert [chunk["events"] for chunk in manifest] == [10, 10]
+
+    reader = ChunkedTraceReader(str(tmp_path))
+    assert len(reader) == 20
+    assert reader.start == BASE
+    assert reader.vpids == [10, 11, 12]
+    assert timestamps_of(reader.query(BASE + 9 * BUCKET_NS, BASE + 11 * BUCKET_NS)) == [BASE + 10 * BUCKET_NS + offset * BUCKET_NS // 2 for offset in range(3)]